@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Fleet heartbeat aggregator: collects the udp heartbeats sent by py-eyepi daemons (the [heartbeat] section of eyepi.conf)
+into an in memory index, logs alerts when nodes or cameras go stale or come back, and optionally serves the index as
+json over http.
+"""
+import argparse
+import json
+import logging
+import time
+from http.server import BaseHTTPRequestHandler
+from threading import Thread
+from libeyepi.Heartbeat import HeartbeatIndex, HeartbeatReceiver
+from libeyepi.StatusServer import ThreadingHTTPServer
+
+
+class IndexRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /nodes     the whole index
+    GET /stale     stale nodes and cameras and why, as of the last check
+    """
+
+    # set on the subclass created by :func:`serve_index`
+    index = None
+
+    def log_message(self, format, *args):
+        logging.getLogger("Aggregator").debug(format % args)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/nodes":
+            document, status = self.index.summary(), 200
+        elif path == "/stale":
+            document, status = dict(self.index.last_check), 200
+        else:
+            document, status = {"error": "not found"}, 404
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_index(index: HeartbeatIndex, bind: str, port: int) -> ThreadingHTTPServer:
+    handler = type("BoundIndexRequestHandler", (IndexRequestHandler,), dict(index=index))
+    server = ThreadingHTTPServer((bind, port), handler)
+    Thread(target=server.serve_forever, name="AggregatorHTTP", daemon=True).start()
+    return server
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="collect heartbeats from py-eyepi nodes and alert on stale cameras")
+    argparser.add_argument("--bind", default="0.0.0.0", help="address to listen on")
+    argparser.add_argument("--port", type=int, default=8094, help="udp port to receive heartbeats on")
+    argparser.add_argument("--http-port", type=int, default=None, help="serve the index as json on this port")
+    argparser.add_argument("--node-timeout", type=float, default=90,
+                           help="seconds without a heartbeat before a node is stale")
+    argparser.add_argument("--stale-intervals", type=float, default=3,
+                           help="capture intervals without a capture before a camera is stale")
+    argparser.add_argument("--check-interval", type=float, default=10, help="seconds between staleness checks")
+    argparser.add_argument("--stats-interval", type=float, default=300,
+                           help="seconds between logging how many heartbeats have been received")
+    argparser.add_argument("-v", "--verbose", action="store_true", help="debug logging")
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    logger = logging.getLogger("Aggregator")
+
+    index = HeartbeatIndex(node_timeout=args.node_timeout, stale_intervals=args.stale_intervals, logger=logger)
+    receiver = HeartbeatReceiver(index, bind=args.bind, port=args.port)
+    receiver.start()
+    logger.info("Receiving heartbeats on udp {}:{}".format(*receiver.address))
+    if args.http_port is not None:
+        serve_index(index, args.bind, args.http_port)
+        logger.info("Serving the index on http://{}:{}/nodes".format(args.bind, args.http_port))
+
+    last_stats, last_received = time.time(), 0
+    try:
+        while receiver.is_alive():
+            time.sleep(args.check_interval)
+            index.check()
+            now = time.time()
+            if now - last_stats >= args.stats_interval:
+                logger.info("{} nodes, {} cameras, {} stale, {:.1f} heartbeats/s, {} invalid".format(
+                    len(index.nodes), len(index.cameras), len(index.stale),
+                    (index.received - last_received) / (now - last_stats), index.invalid))
+                last_stats, last_received = now, index.received
+    except KeyboardInterrupt:
+        pass
+    receiver.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Encodes a sample frame with each of the output format/codec options supported by :class:`libeyepi.Encoder.Encoder`
+and reports how long each one took and how big the output was, so that a site can choose the trade-off between
+encode time and storage for the output_types/tiff_compression/jpeg_*/webp_* settings in eyepi.conf.
+"""
+import argparse
+import time
+from PIL import Image
+from libeyepi.Encoder import Encoder
+
+
+# each option is the eyepi.conf configuration that produces it.
+options = [
+    dict(output_types=["tif"], tiff_compression="none"),
+    dict(output_types=["tif"], tiff_compression="lzw"),
+    dict(output_types=["tif"], tiff_compression="deflate"),
+    dict(output_types=["tif"], tiff_compression="zstd"),
+    dict(output_types=["jpg"], jpeg_quality=75, jpeg_subsampling="4:2:0"),
+    dict(output_types=["jpg"], jpeg_quality=90, jpeg_subsampling="4:2:0"),
+    dict(output_types=["jpg"], jpeg_quality=90, jpeg_subsampling="4:4:4"),
+    dict(output_types=["jpg"], jpeg_quality=90, jpeg_subsampling="4:2:0", jpeg_optimize=True),
+    dict(output_types=["jpg"], jpeg_quality=90, jpeg_subsampling="4:2:0", jpeg_progressive=True),
+    dict(output_types=["jpg"], jpeg_quality=95, jpeg_subsampling="4:4:4"),
+    dict(output_types=["webp"], webp_quality=80, webp_method=0),
+    dict(output_types=["webp"], webp_quality=80, webp_method=4),
+    dict(output_types=["webp"], webp_lossless=True, webp_method=0),
+]
+
+
+def synthetic_frame(width: int, height: int) -> Image:
+    """
+    Creates a sample frame with a mixture of smooth and noisy areas, so that it compresses somewhat like a photo.
+
+    :param width: width of the frame
+    :param height: height of the frame
+    :return: RGB image
+    :rtype: PIL.Image
+    """
+    gradient = Image.linear_gradient("L").resize((width, height))
+    mandelbrot = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 0.8, 1.2), 64)
+    noise = Image.effect_noise((width, height), 48)
+    return Image.merge("RGB", (gradient, mandelbrot, noise))
+
+
+def describe(option: dict) -> str:
+    """
+    Formats an option as the eyepi.conf keys that select it.
+    """
+    return " ".join("{}={}".format(k, v) for k, v in option.items() if k != "output_types")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="report encode time and size for each output option")
+    argparser.add_argument("image", nargs="?", help="sample frame to encode, defaults to a synthetic frame")
+    argparser.add_argument("--width", type=int, default=3280, help="width of the synthetic frame")
+    argparser.add_argument("--height", type=int, default=2464, help="height of the synthetic frame")
+    argparser.add_argument("--repeat", type=int, default=3, help="number of times to encode with each option")
+    args = argparser.parse_args()
+
+    if args.image:
+        img = Image.open(args.image).convert("RGB")
+    else:
+        img = synthetic_frame(args.width, args.height)
+    img.load()
+    raw_size = img.size[0] * img.size[1] * len(img.getbands())
+    print("Sample frame {}x{}, {:.1f}MB uncompressed".format(img.size[0], img.size[1], raw_size / 1e6))
+    print("{:<6}{:>10}{:>12}{:>8}  {}".format("type", "time (s)", "size (MB)", "ratio", "options"))
+
+    for option in options:
+        encoder = Encoder(option)
+        ext = encoder.output_types[0]
+        times = []
+        size = 0
+        try:
+            for _ in range(max(1, args.repeat)):
+                st = time.time()
+                size = len(encoder.encode(img, ext).getbuffer())
+                times.append(time.time() - st)
+        except Exception as e:
+            print("{:<6}{:>10}{:>12}{:>8}  {} ({})".format(ext, "-", "-", "-", describe(option), str(e)))
+            continue
+        print("{:<6}{:>10.3f}{:>12.2f}{:>8.1f}  {}".format(ext, min(times), size / 1e6, raw_size / size,
+                                                         describe(option)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Lists or extracts single frames from the hourly archives written by :class:`libeyepi.ArchivePacker.ArchivePacker`,
+using the offsets in their sidecar manifests.
+"""
+import argparse
+import os
+import sys
+from libeyepi.ArchivePacker import read_manifest, read_member
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="list or extract frames from a packed hour archive")
+    argparser.add_argument("archive", help="archive to read, eg. 2018_06_01_12.tar")
+    argparser.add_argument("members", nargs="*", help="members to extract, lists the archive if none are given")
+    argparser.add_argument("-o", "--output", default=".", help="directory to extract to, - for stdout")
+    args = argparser.parse_args()
+
+    manifest = read_manifest(args.archive)
+    if not args.members:
+        for name, member in sorted(manifest["members"].items()):
+            print("{:>12}  {}".format(member["size"], name))
+        return
+
+    for name in args.members:
+        data = read_member(args.archive, name, manifest=manifest)
+        if args.output == "-":
+            sys.stdout.buffer.write(data)
+            continue
+        with open(os.path.join(args.output, name), "wb") as f:
+            f.write(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Load test for a node: runs N :class:`libeyepi.VirtualCamera.VirtualCamera` workers through the normal
+:func:`eyepiscripts.pyeyepi.start_workers` path for a set duration, then reports achieved versus scheduled captures,
+stage latencies, cpu, memory and disk throughput.
+"""
+import argparse
+import os
+import resource
+import time
+from libeyepi.VirtualCamera import VirtualCamera
+from libeyepi.Camera import parse_duration
+from eyepiscripts.pyeyepi import start_workers, kill_workers
+
+
+def read_proc_fields(path: str) -> dict:
+    """
+    Reads a "key: value" file from /proc into a dict of the first number of each value.
+
+    :param path: path of the proc file, eg. /proc/self/io
+    :return: dict of field names to integers
+    :rtype: dict
+    """
+    fields = dict()
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                value = value.split()
+                if value and value[0].isdigit():
+                    fields[key.strip()] = int(value[0])
+    except Exception:
+        pass
+    return fields
+
+
+def scheduled_captures(start: float, end: float, interval: float) -> int:
+    """
+    Counts the interval boundaries between start and end, which is when :attr:`Camera.time_to_capture` fires.
+    """
+    return int(end // interval) - int(start // interval)
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Nearest rank percentile of a list of values.
+    """
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def directory_size(path: str) -> int:
+    """
+    Total size of the files under a directory.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="load test the capture pipeline with virtual cameras")
+    argparser.add_argument("--cameras", type=int, default=4, help="number of virtual cameras")
+    argparser.add_argument("--interval", default="10s", help="capture interval, eg. 10s or 1m")
+    argparser.add_argument("--width", type=int, default=3280, help="width of the synthetic frames")
+    argparser.add_argument("--height", type=int, default=2464, help="height of the synthetic frames")
+    argparser.add_argument("--latency", type=float, default=0.5, help="simulated capture latency in seconds")
+    argparser.add_argument("--duration", default="5m", help="how long to run for, eg. 5m")
+    argparser.add_argument("--output", default="/tmp/eyepi-loadtest", help="output directory for the captures")
+    argparser.add_argument("--output-types", default="tif,jpg", help="comma separated output types")
+    args = argparser.parse_args()
+
+    interval = parse_duration(args.interval).total_seconds()
+    duration = parse_duration(args.duration).total_seconds()
+
+    cameras = []
+    for n in range(args.cameras):
+        identifier = "loadtest{:02d}".format(n)
+        cameras.append(VirtualCamera(dict(filenameprefix=identifier,
+                                          interval=args.interval,
+                                          width=args.width,
+                                          height=args.height,
+                                          latency=args.latency,
+                                          output_types=args.output_types.split(","),
+                                          output_directory=os.path.join(args.output, identifier))))
+
+    io_start = read_proc_fields("/proc/self/io")
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    start_workers(cameras)
+    try:
+        time.sleep(duration)
+    except KeyboardInterrupt:
+        pass
+    end = time.time()
+    kill_workers(cameras)
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    io_end = read_proc_fields("/proc/self/io")
+    elapsed = end - start
+
+    scheduled = scheduled_captures(start, end, interval)
+    print("{} cameras, {}x{}, interval {}s, latency {}s, ran for {:.0f}s".format(
+        args.cameras, args.width, args.height, interval, args.latency, elapsed))
+    print("{:<12}{:>10}{:>10}{:>10}".format("camera", "scheduled", "achieved", "failed"))
+    for camera in cameras:
+        print("{:<12}{:>10}{:>10}{:>10}".format(camera.identifier, scheduled, camera.captures, camera.failures))
+    achieved = sum(camera.captures for camera in cameras)
+    print("achieved {} of {} scheduled captures ({:.1f}%)".format(
+        achieved, scheduled * len(cameras), 100 * achieved / max(1, scheduled * len(cameras))))
+
+    stages = dict()
+    for camera in cameras:
+        for capture_time, telemetry in camera.capture_history:
+            for key, value in telemetry.items():
+                if key.startswith("timing_"):
+                    stages.setdefault(key, []).append(value)
+    print("{:<20}{:>10}{:>10}{:>10}".format("stage", "p50 (s)", "p95 (s)", "max (s)"))
+    for key, values in sorted(stages.items()):
+        print("{:<20}{:>10.3f}{:>10.3f}{:>10.3f}".format(key, percentile(values, 50), percentile(values, 95),
+                                                         max(values)))
+
+    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    print("cpu: {:.1f}s ({:.0f}% of one core), load average: {:.2f} {:.2f} {:.2f}".format(
+        cpu, 100 * cpu / elapsed, *os.getloadavg()))
+    status = read_proc_fields("/proc/self/status")
+    print("rss: {:.1f}MB, peak {:.1f}MB".format(status.get("VmRSS", 0) / 1024, usage_end.ru_maxrss / 1024))
+    written = io_end.get("write_bytes", 0) - io_start.get("write_bytes", 0)
+    print("disk: {:.1f}MB written ({:.2f}MB/s), {:.1f}MB stored".format(
+        written / 1e6, written / 1e6 / elapsed, directory_size(args.output) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,11 @@ import pyudev
 from libeyepi import Camera
 from libeyepi import PiCamera
 from libeyepi import GPCamera
+from libeyepi import USBCamera
+from libeyepi import LogQueue
+from libeyepi.StatusServer import StatusServer
+from libeyepi.Heartbeat import HeartbeatSender
+from libeyepi.Recovery import Watchdog
 from threading import Lock
 import re
 import traceback
@@ -31,9 +36,12 @@ default_config = """
 enable = true
 """
 
-if not os.path.isfile("/etc/eyepi/eyepi.conf"):
-    with open("/etc/eyepi/eyepi.conf", 'w') as f:
-        f.write(default_config)
+try:
+    if not os.path.isfile("/etc/eyepi/eyepi.conf"):
+        with open("/etc/eyepi/eyepi.conf", 'w') as f:
+            f.write(default_config)
+except Exception as e:
+    print("Couldnt write default config: {}".format(str(e)))
 
 default_logging_config = """
 [loggers]
@@ -81,16 +89,16 @@ format = %(name)s - %(levelname)s:   %(message)s
 """
 
 
-if not os.path.isfile("/etc/eyepi/logging.ini"):
-    with open("/etc/eyepi/logging.ini", 'w') as f:
-        f.write(default_logging_config)
-
-# attempt to setup logging.
 try:
-    logging.config.fileConfig("/etc/eyepi/logging.ini")
+    if not os.path.isfile("/etc/eyepi/logging.ini"):
+        with open("/etc/eyepi/logging.ini", 'w') as f:
+            f.write(default_logging_config)
 except Exception as e:
+    print("Couldnt write default logging config: {}".format(str(e)))
+
+# attempt to setup logging.
+if not LogQueue.configure_logging("/etc/eyepi/logging.ini"):
     print("COULDNT SET UP LOGGING WTF")
-    pass
 logger = logging.getLogger("WORKER_DISPATCH")
 
 global recent
@@ -154,7 +162,8 @@ def detect_gphoto_info():
         # check output of the --auto-detect gphoto2 command.
         detect_ret = subprocess.check_output(["/usr/bin/gphoto2",
                                               "--auto-detect"],
-                                             universal_newlines=True)
+                                             universal_newlines=True,
+                                             timeout=60)
         # iterate over the results, should be in the format of [(bus, addr), (bus, addr) ...] for usb connected dslrs
         # this regex matches occurrences of "usb:" followed by 2 comma separated digits.
         for bus, addr in re.findall(r'usb:(\d+),(\d+)', detect_ret):
@@ -170,7 +179,8 @@ def detect_gphoto_info():
                 sn_detect_ret = subprocess.check_output(['/usr/bin/gphoto2',
                                                          '--port={}'.format(port),
                                                          '--get-config=serialnumber'],
-                                                        universal_newlines=True)
+                                                        universal_newlines=True,
+                                                        timeout=60)
 
                 # Match the serial number.
                 # this regex can also be used to parse the values from --get-config as all results are returned like this:
@@ -199,7 +209,7 @@ def detect_gphoto_info():
                 logger.error("Exception detecting gphoto2 camera")
                 logger.error(traceback.format_exc())
         return cams
-    except subprocess.CalledProcessError as e:
+    except subprocess.SubprocessError as e:
         traceback.print_exc()
         logger.error("Subprocess error detecting gphoto2 cameras")
         logger.error(traceback.format_exc())
@@ -246,6 +256,74 @@ def detect_gphoto(confs):
     return tuple
 
 
+def detect_usb(confs) -> tuple:
+    """
+    creates usb web cameras from their configuration sections.
+    each section must have a "sysnumber", the 0 from /dev/video0
+
+    :param confs: dict of configuration sections for usb cameras
+    :return: tuple of camera thread objects
+    :rtype: tuple(USBCamera)
+    """
+    logger.info("Detecting USB web cameras.")
+    workers = []
+    for filenameprefix, conf in confs.items():
+        try:
+            conf['filenameprefix'] = conf.get("filenameprefix", filenameprefix)
+            if not os.path.exists("/dev/video{}".format(conf.get("sysnumber", 0))):
+                continue
+            camera = USBCamera.USBCamera(conf)
+            workers.append(camera)
+            logger.debug("Sucessfully detected {} @ /dev/video{}".format(camera.identifier, camera.sys_number))
+        except Exception as e:
+            logger.error("Unable to start usb webcamera {}: {}".format(filenameprefix, str(e)))
+    return tuple(workers)
+
+
+def detect_gige(confs) -> tuple:
+    """
+    creates GigE Vision cameras from their configuration sections.
+
+    :param confs: dict of configuration sections for GigE Vision cameras
+    :return: tuple of camera thread objects
+    :rtype: tuple(GigECamera)
+    """
+    logger.info("Detecting GigE Vision cameras.")
+    from libeyepi import GigECamera
+    workers = []
+    for filenameprefix, conf in confs.items():
+        try:
+            conf['filenameprefix'] = conf.get("filenameprefix", filenameprefix)
+            camera = GigECamera.GigECamera(conf)
+            workers.append(camera)
+            logger.debug("Sucessfully detected {} @ {}".format(camera.identifier, camera.camera.get_device_id()))
+        except Exception as e:
+            logger.error("Unable to start GigE Vision camera {}: {}".format(filenameprefix, str(e)))
+    return tuple(workers)
+
+
+def detect_replay(confs) -> tuple:
+    """
+    creates replay cameras from their configuration sections, to run the capture pipeline on an existing archive.
+
+    :param confs: dict of configuration sections for replay cameras
+    :return: tuple of camera thread objects
+    :rtype: tuple(ReplayCamera)
+    """
+    logger.info("Setting up replay cameras.")
+    from libeyepi import ReplayCamera
+    workers = []
+    for filenameprefix, conf in confs.items():
+        try:
+            conf['filenameprefix'] = conf.get("filenameprefix", filenameprefix)
+            camera = ReplayCamera.ReplayCamera(conf)
+            workers.append(camera)
+            logger.debug("Replaying {} from {}".format(camera.identifier, camera.replay_directory))
+        except Exception as e:
+            logger.error("Unable to start replay camera {}: {}".format(filenameprefix, str(e)))
+    return tuple(workers)
+
+
 # def detect_webcam() -> tuple:
 #     """
 #     Detects usb web camers using the video4linux pyudev subsystem.
@@ -333,9 +411,85 @@ def run_from_toml():
     if gphoto2_conf:
         gphoto2cameras = detect_gphoto(gphoto2_conf)
         workers.extend(gphoto2cameras)
+    usb_conf = config.get("usb", None)
+    if usb_conf:
+        workers.extend(detect_usb(usb_conf))
+    gige_conf = config.get("gige", None)
+    if gige_conf:
+        workers.extend(detect_gige(gige_conf))
+    replay_conf = config.get("replay", None)
+    if replay_conf:
+        workers.extend(detect_replay(replay_conf))
     return start_workers(workers)
 
 
+def start_status_server():
+    """
+    starts the http status api if it is enabled in the [http] section of the config.
+
+    :return: the status server thread, or None
+    :rtype: StatusServer
+    """
+    try:
+        conf = toml.load("/etc/eyepi/eyepi.conf").get("http", dict())
+        if not conf.get("enable", False):
+            return None
+        # workers is reassigned when they are recreated, so look it up every time.
+        server = StatusServer(lambda: workers, bind=conf.get("bind", "127.0.0.1"), port=conf.get("port", 8080))
+        server.start()
+        return server
+    except Exception as e:
+        logger.error("Couldnt start status server: {}".format(str(e)))
+    return None
+
+
+def start_watchdog():
+    """
+    starts the watchdog that flags cameras that stop capturing, configured from the [watchdog] section of the config.
+
+    :return: the watchdog thread, or None
+    :rtype: Watchdog
+    """
+    try:
+        try:
+            conf = toml.load("/etc/eyepi/eyepi.conf").get("watchdog", dict())
+        except Exception as e:
+            logger.error("Couldnt read watchdog config, using the defaults: {}".format(str(e)))
+            conf = dict()
+        if not conf.get("enable", True):
+            return None
+        # workers is reassigned when they are recreated, so look it up every time.
+        watchdog = Watchdog(lambda: workers, max_missed=int(conf.get("max_missed", 3)),
+                            period=float(conf.get("period", 60)))
+        watchdog.start()
+        return watchdog
+    except Exception as e:
+        logger.error("Couldnt start watchdog: {}".format(str(e)))
+    return None
+
+
+def start_heartbeat():
+    """
+    starts sending heartbeats to the fleet aggregator if it is enabled in the [heartbeat] section of the config.
+
+    :return: the heartbeat sender thread, or None
+    :rtype: HeartbeatSender
+    """
+    try:
+        conf = toml.load("/etc/eyepi/eyepi.conf").get("heartbeat", dict())
+        if not conf.get("enable", False):
+            return None
+        # workers is reassigned when they are recreated, so look it up every time.
+        sender = HeartbeatSender(lambda: [w for w in workers if hasattr(w, "heartbeat")], conf["host"],
+                                 port=conf.get("port", 8094), period=float(conf.get("period", 30)),
+                                 node=conf.get("node", None))
+        sender.start()
+        return sender
+    except Exception as e:
+        logger.error("Couldnt start heartbeat: {}".format(str(e)))
+    return None
+
+
 def enumerate_usb_devices() -> set:
     """
     Gets a set of the current usb devices from pyudev
@@ -404,6 +558,10 @@ def main():
         except Exception as e:
             logger.fatal(e)
             traceback.print_exc()
+        start_status_server()
+        start_heartbeat()
+        # flag cameras that stop capturing.
+        start_watchdog()
         # enumerate the usb devices to compare them later on.
         global glock
         glock = Lock()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Bulk reprocessing of existing capture archives (/var/lib/eyepi/<filenameprefix>/YYYY/...) in a process pool: re-encode
+to other output types or codec settings, backfill exif, or generate previews.
+
+Encoding and exif use the same :class:`libeyepi.Encoder.Encoder` and :func:`libeyepi.Encoder.write_exif` as
+:func:`libeyepi.Camera.Camera.encode_write_image`, configured from a camera section of eyepi.conf.
+
+Progress can be checkpointed to a file so an interrupted run resumes where it left off.
+
+Files written into an hour directory that has a checksum manifest (see :class:`libeyepi.Manifest.Manifest`) are
+recorded in it, so py-eyepi-verify still passes after re-encoding or backfilling exif. Hours that have been packed into
+archives are reported and skipped.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import os
+import sys
+import time
+import toml
+from PIL import Image
+from libeyepi.Encoder import Encoder, write_exif
+from libeyepi.Manifest import Manifest, archived_captures, timestamp_re
+
+_encoder = None
+
+
+def find_captures(paths: list, packed: list = None) -> list:
+    """
+    Walks directories for captures, keeping one source file per capture.
+
+    :param paths: directories or image files
+    :param packed: list to add the archives of packed hours to, their captures arent reprocessed
+    :return: list of source files, sorted
+    :rtype: list(str)
+    """
+    sources = []
+    for path in paths:
+        if os.path.isfile(path):
+            sources.append(path)
+            continue
+        sources.extend(fn for _, fn in archived_captures(path, packed))
+    return sorted(sources)
+
+
+def capture_time(fn: str) -> datetime.datetime:
+    """
+    Gets the capture time of a file from the timestamp in its name, or its modification time.
+    """
+    m = timestamp_re.search(os.path.basename(fn))
+    if m:
+        return datetime.datetime.strptime(m.group(1), "%Y_%m_%d_%H_%M_%S")
+    return datetime.datetime.fromtimestamp(os.path.getmtime(fn))
+
+
+def plan(source: str, args) -> list:
+    """
+    Gets the files that reprocessing a source will write.
+
+    :param source: source file
+    :param args: parsed arguments
+    :return: list of output filenames
+    :rtype: list(str)
+    """
+    stem = os.path.splitext(source)[0]
+    if args.output:
+        stem = os.path.join(args.output, os.path.relpath(stem, args.root))
+    outputs = []
+    for ext in args.output_types:
+        fn = "{}.{}".format(stem, ext)
+        if args.force or not os.path.exists(fn):
+            outputs.append(fn)
+    if args.preview and (args.force or not os.path.exists("{}_preview.jpg".format(stem))):
+        outputs.append("{}_preview.jpg".format(stem))
+    return outputs
+
+
+def hour_manifests(fn: str) -> list:
+    """
+    Gets the checksum manifests of the hour directory a file is in.
+
+    :param fn: file in an hour directory
+    :return: list of manifests that exist
+    :rtype: list(Manifest)
+    """
+    hour_dir = os.path.dirname(os.path.abspath(fn))
+    manifests = [Manifest(hour_dir, algorithm) for algorithm in Manifest.algorithms]
+    return [manifest for manifest in manifests if os.path.isfile(manifest.path)]
+
+
+def rehash(fn: str) -> list:
+    """
+    Hashes a rewritten file for each manifest of its hour directory, while it is still in the page cache.
+
+    :param fn: rewritten file
+    :return: list of (manifest path, name, digest)
+    :rtype: list(tuple)
+    """
+    return [(manifest.path, os.path.basename(fn), manifest.hash_file(fn)) for manifest in hour_manifests(fn)]
+
+
+def _init_worker(config: dict):
+    global _encoder
+    _encoder = Encoder(config)
+
+
+def process(source: str, outputs: list, exif: dict, preview: tuple, backfill_exif: bool) -> tuple:
+    """
+    Reprocesses a single capture, runs in a pool worker. Manifest entries are returned rather than written here so
+    that only the main process appends to the manifests.
+
+    :return: source, bytes read, bytes written, manifest entries for the files rewritten (see :func:`rehash`) and an
+        error message or None
+    :rtype: tuple
+    """
+    rehashed = []
+    try:
+        exif = dict(exif, **{"Exif.Photo.DateTimeOriginal": capture_time(source)})
+        written = 0
+        img = None
+        for fn in outputs:
+            if img is None:
+                img = Image.open(source)
+                img.load()
+            os.makedirs(os.path.dirname(fn) or ".", exist_ok=True)
+            partial = "{}.partial{}".format(*os.path.splitext(fn))
+            if fn.endswith("_preview.jpg"):
+                thumb = img.copy()
+                thumb.thumbnail(preview)
+                _encoder.save(thumb, partial)
+            else:
+                _encoder.save(img, partial)
+            try:
+                write_exif(partial, exif, overwrite=False)
+            except Exception:
+                pass
+            os.replace(partial, fn)
+            written += os.path.getsize(fn)
+            rehashed.extend(rehash(fn))
+        if backfill_exif:
+            write_exif(source, exif, overwrite=False)
+            rehashed.extend(rehash(source))
+        return source, os.path.getsize(source), written, rehashed, None
+    except Exception as e:
+        return source, 0, 0, rehashed, str(e)
+
+
+def load_checkpoint(path: str) -> set:
+    if not path or not os.path.isfile(path):
+        return set()
+    with open(path) as f:
+        return set(line.rstrip("\n") for line in f)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="reprocess existing captures in parallel")
+    argparser.add_argument("paths", nargs="*", help="camera output directories or images to reprocess")
+    argparser.add_argument("--index", help="file listing the images to reprocess, one per line, instead of walking")
+    argparser.add_argument("--config", default="/etc/eyepi/eyepi.conf", help="eyepi config to take codec settings from")
+    argparser.add_argument("--camera", help="config section to take codec settings and exif from, eg. gphoto.camera1")
+    argparser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                           help="override a camera config key, eg. jpeg_quality=90, can be repeated")
+    argparser.add_argument("--output-types", default="", help="comma separated output types to (re)encode")
+    argparser.add_argument("--exif", action="store_true", help="backfill missing exif tags in the source images")
+    argparser.add_argument("--preview", help="also write a WIDTHxHEIGHT <name>_preview.jpg")
+    argparser.add_argument("--output", help="directory to write to, mirroring the source tree, defaults to in place")
+    argparser.add_argument("--force", action="store_true", help="overwrite outputs that already exist")
+    argparser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    argparser.add_argument("--checkpoint", help="file recording finished sources, to resume an interrupted run")
+    argparser.add_argument("--dry-run", action="store_true", help="only print what would be written")
+    argparser.add_argument("--report-interval", type=float, default=10, help="seconds between progress reports")
+    args = argparser.parse_args()
+
+    config = dict()
+    if args.camera:
+        config = toml.load(args.config)
+        for key in args.camera.split("."):
+            config = config.get(key, dict())
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        try:
+            config[key] = toml.loads("v = {}".format(value))["v"]
+        except Exception:
+            config[key] = value
+    if args.output_types:
+        config["output_types"] = args.output_types.split(",")
+    encoder = Encoder(config)
+    args.output_types = encoder.output_types if args.output_types else []
+    args.preview = tuple(int(v) for v in args.preview.lower().split("x")) if args.preview else None
+
+    if args.index:
+        with open(args.index) as f:
+            sources = [line.strip() for line in f if line.strip()]
+    else:
+        packed = []
+        sources = find_captures(args.paths, packed)
+        if packed:
+            print("skipping {} packed hours, extract them with py-eyepi-extract to reprocess them:".format(len(packed)),
+                  file=sys.stderr)
+            for archive in packed:
+                print("  {}".format(archive), file=sys.stderr)
+    args.root = os.path.commonpath([os.path.abspath(p) for p in args.paths]) if args.paths else "/"
+    if os.path.isfile(args.root):
+        args.root = os.path.dirname(args.root)
+    sources = [os.path.abspath(s) for s in sources]
+
+    done = load_checkpoint(args.checkpoint)
+    tasks = [(s, plan(s, args)) for s in sources if s not in done]
+    tasks = [(s, outputs) for s, outputs in tasks if outputs or args.exif]
+    print("{} captures, {} already done, {} to reprocess".format(len(sources), len(done), len(tasks)), file=sys.stderr)
+
+    identifier = config.get("filenameprefix", os.path.basename(args.root))
+    exif = {"Exif.Image.Make": "Make", "Exif.Image.Model": "Model", "Exif.Image.CameraSerialNumber": identifier}
+
+    if args.dry_run:
+        for source, outputs in tasks:
+            for fn in outputs:
+                print("{} -> {}".format(source, fn))
+            if args.exif:
+                print("{} exif".format(source))
+        return
+
+    checkpoint = open(args.checkpoint, "a") if args.checkpoint else None
+    count, failed, bytes_in, bytes_out = 0, 0, 0, 0
+    st = last_report = time.time()
+
+    def report():
+        elapsed = max(time.time() - st, 1e-9)
+        print("{}/{} done, {} failed, {:.1f} files/s, {:.1f} MB/s read, {:.1f} MB/s written".format(
+            count, len(tasks), failed, count / elapsed, bytes_in / elapsed / 1e6, bytes_out / elapsed / 1e6),
+            file=sys.stderr)
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                                    initargs=(config,)) as pool:
+            pending = set()
+            task_iter = iter(tasks)
+            while True:
+                # keep a bounded number of tasks in flight rather than submitting the whole archive at once.
+                for source, outputs in task_iter:
+                    pending.add(pool.submit(process, source, outputs, exif, args.preview, args.exif))
+                    if len(pending) >= args.jobs * 4:
+                        break
+                if not pending:
+                    break
+                finished, pending = concurrent.futures.wait(pending, timeout=args.report_interval,
+                                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    source, read, written, rehashed, error = future.result()
+                    count += 1
+                    bytes_in += read
+                    bytes_out += written
+                    # even a failed capture may have had some files rewritten before it failed.
+                    for manifest, name, digest in rehashed:
+                        Manifest.from_path(manifest).record(name, digest)
+                    if error:
+                        failed += 1
+                        print("{} failed: {}".format(source, error), file=sys.stderr)
+                    elif checkpoint is not None:
+                        checkpoint.write(source + "\n")
+                        checkpoint.flush()
+                if time.time() - last_report >= args.report_interval:
+                    last_report = time.time()
+                    report()
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    report()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Verifies captures against the per hour checksum manifests written by the capture pipeline, whether the hours are still
+directories or have been packed into archives.
+"""
+import argparse
+import sys
+import time
+from libeyepi.Manifest import Manifest, find_manifests
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="verify captures against their checksum manifests")
+    argparser.add_argument("paths", nargs="+", help="camera output directories or manifest files")
+    argparser.add_argument("-q", "--quiet", action="store_true", help="only print problems")
+    args = argparser.parse_args()
+
+    totals = dict(ok=0, failed=0, missing=0)
+    st = time.time()
+    for path in args.paths:
+        for manifest_path in find_manifests(path):
+            manifest = Manifest.from_path(manifest_path)
+            for name, result in sorted(manifest.verify().items()):
+                totals[result] += 1
+                if result != "ok" or not args.quiet:
+                    print("{}: {} {}".format(manifest.hour_dir, name, result.upper()))
+    print("{ok} ok, {failed} failed, {missing} missing in {t:.1f}s".format(t=time.time() - st, **totals))
+    if totals["failed"] or totals["missing"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
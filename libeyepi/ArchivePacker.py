@@ -0,0 +1,197 @@
+import datetime
+import glob
+import json
+import logging
+import os
+import shutil
+import struct
+import tarfile
+import warnings
+import zipfile
+from threading import Thread, Lock
+from .ResourceGovernor import lower_priority
+
+
+class ArchivePacker(object):
+    """
+    Packs each completed hour directory of captures into a single uncompressed archive with a sidecar manifest.
+
+    The manifest (<archive>.json) records the offset and size of every member's data in the archive, so single frames
+    can be read with one seek and one read by :func:`read_member`, without scanning the archive.
+
+    archives are written next to the hour directory they replace:
+        <output_directory>/YYYY/YYYY_mm/YYYY_mm_dd/YYYY_mm_dd_HH.tar
+        <output_directory>/YYYY/YYYY_mm/YYYY_mm_dd/YYYY_mm_dd_HH.tar.json
+    """
+
+    formats = ["tar", "zip"]
+    hour_dir_glob = "[0-9]" * 4 + "/*_*/*_*_*/*_*_*_*"
+    hour_dir_format = "%Y_%m_%d_%H"
+
+    def __init__(self, output_directory: str, fmt: str = "tar", logger: logging.Logger = None):
+        """
+        :param output_directory: camera output directory containing the YYYY/... tree
+        :param fmt: archive format, "tar" or "zip" (stored, no compression)
+        :param logger: logger to log to
+        """
+        if fmt not in ArchivePacker.formats:
+            raise ValueError("Unknown archive format {}".format(fmt))
+        self.output_directory = output_directory
+        self.format = fmt
+        self.logger = logger or logging.getLogger("ArchivePacker")
+        # callables that take an hour directory and return True if it shouldnt be packed yet.
+        self.holds = []
+        self._thread = None
+        self._lock = Lock()
+
+    def completed_hours(self, now: datetime.datetime) -> list:
+        """
+        Gets the hour directories for hours before the current one.
+
+        :param now: current time
+        :return: list of hour directory paths
+        :rtype: list(str)
+        """
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        completed = []
+        for path in sorted(glob.glob(os.path.join(self.output_directory, ArchivePacker.hour_dir_glob))):
+            if not os.path.isdir(path):
+                continue
+            try:
+                hour = datetime.datetime.strptime(os.path.basename(path), ArchivePacker.hour_dir_format)
+            except ValueError:
+                continue
+            if hour < current_hour and not any(hold(path) for hold in self.holds):
+                completed.append(path)
+        return completed
+
+    def _pack_tar(self, hour_dir: str, archive: str, append: bool = False) -> dict:
+        with tarfile.open(archive, "a" if append else "w", format=tarfile.PAX_FORMAT) as tar:
+            for fn in sorted(os.listdir(hour_dir)):
+                tar.add(os.path.join(hour_dir, fn), arcname=fn, recursive=False)
+        members = dict()
+        with tarfile.open(archive, "r") as tar:
+            for info in tar:
+                if info.isfile():
+                    members[info.name] = dict(offset=info.offset_data, size=info.size, mtime=info.mtime)
+        return members
+
+    def _pack_zip(self, hour_dir: str, archive: str, append: bool = False) -> dict:
+        with zipfile.ZipFile(archive, "a" if append else "w", compression=zipfile.ZIP_STORED) as zf, \
+                warnings.catch_warnings():
+            # duplicate names are expected when adding to an archive, see :func:`pack`.
+            warnings.simplefilter("ignore", UserWarning)
+            for fn in sorted(os.listdir(hour_dir)):
+                zf.write(os.path.join(hour_dir, fn), arcname=fn)
+        members = dict()
+        with zipfile.ZipFile(archive, "r") as zf, open(archive, "rb") as f:
+            for info in zf.infolist():
+                # the data starts after the local file header, whose name and extra field lengths can differ from
+                # the central directory.
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack("<HH", f.read(4))
+                offset = info.header_offset + 30 + name_length + extra_length
+                mtime = datetime.datetime(*info.date_time).timestamp()
+                members[info.filename] = dict(offset=offset, size=info.file_size, mtime=int(mtime))
+        return members
+
+    def pack(self, hour_dir: str) -> str:
+        """
+        Packs an hour directory into an archive and sidecar manifest, then removes the directory.
+
+        The archive is written to a temporary name and renamed into place, so a partial archive is never left behind.
+
+        If the hour has already been packed (the directory can come back after a clock jump or a late write) the files
+        are added to a copy of the existing archive, so nothing in it is lost. Members are never removed, if a file has
+        the same name as one already in the archive both are kept and the manifest points to the newer one.
+
+        :param hour_dir: hour directory to pack
+        :return: path of the archive
+        :rtype: str
+        """
+        hour_dir = hour_dir.rstrip(os.sep)
+        archive = "{}.{}".format(hour_dir, self.format)
+        partial = archive + ".partial"
+        append = os.path.exists(archive)
+        if append:
+            shutil.copyfile(archive, partial)
+            try:
+                duplicates = set(read_manifest(archive)["members"]) & set(os.listdir(hour_dir))
+            except Exception:
+                duplicates = set()
+            self.logger.warning("{} has already been packed, adding {} files to it{}".format(
+                os.path.basename(hour_dir), len(os.listdir(hour_dir)),
+                ", {} have the same name as members already in it".format(len(duplicates)) if duplicates else ""))
+        if self.format == "tar":
+            members = self._pack_tar(hour_dir, partial, append=append)
+        else:
+            members = self._pack_zip(hour_dir, partial, append=append)
+        os.rename(partial, archive)
+        with open(archive + ".json.partial", "w") as f:
+            json.dump(dict(format=self.format, members=members), f, indent=1, sort_keys=True)
+        os.rename(archive + ".json.partial", archive + ".json")
+        shutil.rmtree(hour_dir)
+        self.logger.info("Packed {} files into {}".format(len(members), os.path.basename(archive)))
+        return archive
+
+    def pack_completed(self, now: datetime.datetime) -> list:
+        """
+        Packs every completed hour directory.
+
+        :param now: current time
+        :return: list of archives written
+        :rtype: list(str)
+        """
+        archives = []
+        for hour_dir in self.completed_hours(now):
+            try:
+                archives.append(self.pack(hour_dir))
+            except Exception as e:
+                self.logger.error("Couldnt pack {}: {}".format(hour_dir, str(e)))
+        return archives
+
+    def _pack_background(self, now: datetime.datetime):
+        lower_priority()
+        self.pack_completed(now)
+
+    def pack_in_background(self, now: datetime.datetime):
+        """
+        Packs every completed hour directory in a background thread, unless one is already running.
+
+        :param now: current time
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._pack_background, args=(now,), name="ArchivePacker")
+            self._thread.daemon = True
+            self._thread.start()
+
+
+def read_manifest(archive: str) -> dict:
+    """
+    Reads the sidecar manifest of an archive.
+
+    :param archive: path to the archive
+    :return: manifest with format and members
+    :rtype: dict
+    """
+    with open(archive + ".json") as f:
+        return json.load(f)
+
+
+def read_member(archive: str, name: str, manifest: dict = None) -> bytes:
+    """
+    Reads a single member from an archive using the offset in its manifest.
+
+    :param archive: path to the archive
+    :param name: name of the member, eg. the image filename
+    :param manifest: already loaded manifest, read from the sidecar if not given
+    :return: member data
+    :rtype: bytes
+    """
+    manifest = manifest or read_manifest(archive)
+    member = manifest["members"][name]
+    with open(archive, "rb") as f:
+        f.seek(member["offset"])
+        return f.read(member["size"])
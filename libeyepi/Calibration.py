@@ -0,0 +1,222 @@
+import os
+import numpy
+from PIL import Image
+
+# gain maps are cached as fixed point, gain * 2 ** GAIN_BITS in a uint16, so gains up to 16x.
+GAIN_BITS = 12
+# 3D tables are baked into a dense table with this many levels per channel (6MB), so applying them is a single lookup.
+LUT_3D_LEVELS = 128
+
+
+def read_cube(fn: str) -> numpy.ndarray:
+    """
+    Reads a .cube colour lookup table (the Adobe/Resolve text format).
+
+    :param fn: filename
+    :return: float array in 0-1, size x 3 for a 1D table, or size x size x size x 3 indexed [r, g, b] for a 3D one
+    :rtype: numpy.ndarray
+    """
+    size_1d = size_3d = None
+    domain_min, domain_max = numpy.zeros(3), numpy.ones(3)
+    rows = []
+    with open(fn) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            key = parts[0].upper()
+            if key == "LUT_1D_SIZE":
+                size_1d = int(parts[1])
+            elif key == "LUT_3D_SIZE":
+                size_3d = int(parts[1])
+            elif key == "DOMAIN_MIN":
+                domain_min = numpy.array([float(v) for v in parts[1:4]])
+            elif key == "DOMAIN_MAX":
+                domain_max = numpy.array([float(v) for v in parts[1:4]])
+            elif key[0].isdigit() or key[0] in "-.":
+                rows.append([float(v) for v in parts[:3]])
+            # TITLE and anything else we dont use
+    table = (numpy.array(rows, dtype=numpy.float32) - domain_min) / (domain_max - domain_min)
+    if size_3d:
+        if len(table) != size_3d ** 3:
+            raise ValueError("{} should have {} entries, not {}".format(fn, size_3d ** 3, len(table)))
+        # red changes fastest in the file
+        return table.reshape(size_3d, size_3d, size_3d, 3).transpose(2, 1, 0, 3)
+    if size_1d and len(table) != size_1d:
+        raise ValueError("{} should have {} entries, not {}".format(fn, size_1d, len(table)))
+    return table
+
+
+class Calibration(object):
+    """
+    Flat field and colour correction of captured frames, applied in place to a uint8 rgb array.
+
+    The flat field is either a gain map (.npy, height x width or height x width x 3) or an image of an evenly lit flat
+    target, from which the gain map is the target's mean divided by it. The gain map is resized to the frame size the
+    first time a frame of that size comes along and cached as fixed point, so each frame only costs a multiply.
+
+    The colour lookup table is a .cube file or a .npy array, either per channel (256 x 3, or another size which is
+    interpolated to 256) or 3D (size x size x size x 3, indexed [r, g, b]). Tables are in 0-1. Per channel tables are
+    precomputed into 8 bit lookups, 3D tables are trilinearly interpolated once into a dense 128 level table and looked up
+    at the nearest level, which is within a level of interpolating every pixel at a fraction of the cost.
+
+    Frames are worked through in bands of chunk_rows rows so the temporaries stay small, :func:`apply_image` corrects a
+    PIL image into a new one without any other full frame copies.
+    """
+
+    def __init__(self, flat_field: str = None, lut: str = None, chunk_rows: int = 256):
+        """
+        :param flat_field: gain map (.npy) or flat target image filename
+        :param lut: colour lookup table filename (.cube or .npy)
+        :param chunk_rows: rows to correct at a time
+        """
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.flat = None
+        self._gain_maps = dict()
+        if flat_field:
+            if os.path.splitext(flat_field)[1].lower() == ".npy":
+                gain = numpy.load(flat_field).astype(numpy.float32)
+            else:
+                with Image.open(flat_field) as img:
+                    flat = numpy.asarray(img.convert("RGB"), dtype=numpy.float32)
+                flat = numpy.maximum(flat, 1)
+                gain = flat.mean(axis=(0, 1)) / flat
+            if gain.ndim == 3 and numpy.allclose(gain, gain[..., :1], atol=1e-3):
+                gain = gain[..., 0]
+            self.flat = gain
+        self.lut_1d = None
+        self.lut_3d = None
+        self._lut_3d_index = self.lut_3d_index
+        if lut:
+            table = read_cube(lut) if os.path.splitext(lut)[1].lower() == ".cube" else numpy.load(lut)
+            table = numpy.asarray(table, dtype=numpy.float32)
+            if table.ndim == 2 and table.shape[0] == 3 and table.shape[1] != 3:
+                table = table.T
+            if table.ndim == 2 and table.shape[1] == 3:
+                levels = numpy.linspace(0, 1, len(table))
+                self.lut_1d = numpy.stack([numpy.interp(numpy.linspace(0, 1, 256), levels, table[:, c])
+                                           for c in range(3)])
+                self.lut_1d = numpy.clip(self.lut_1d * 255 + 0.5, 0, 255).astype(numpy.uint8)
+            elif table.ndim == 4 and table.shape[3] == 3 and table.shape[0] == table.shape[1] == table.shape[2]:
+                self.lut_3d = self.bake_3d(table)
+            else:
+                raise ValueError("Colour lookup table {} has an unknown shape {}".format(lut, table.shape))
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        Creates the calibration from the flat_field, colour_lut and calibration_chunk_rows keys of a camera config.
+
+        :param config: camera config
+        :return: calibration, or None if there are no calibration files
+        :rtype: Calibration
+        """
+        flat_field = config.get("flat_field", None)
+        lut = config.get("colour_lut", None)
+        if not flat_field and not lut:
+            return None
+        return cls(flat_field=flat_field, lut=lut, chunk_rows=int(config.get("calibration_chunk_rows", 256)))
+
+    def gain_map(self, width: int, height: int) -> numpy.ndarray:
+        """
+        Gets the fixed point gain map for a frame size, resizing it the first time.
+
+        :param width: frame width
+        :param height: frame height
+        :return: uint16 gain map, height x width or height x width x 3
+        :rtype: numpy.ndarray
+        """
+        key = (width, height)
+        if key not in self._gain_maps:
+            channels = [self.flat] if self.flat.ndim == 2 else [self.flat[..., c] for c in range(3)]
+            resized = [numpy.asarray(Image.fromarray(c, mode="F").resize((width, height), Image.BILINEAR))
+                       for c in channels]
+            gain = numpy.stack(resized, axis=2) if len(resized) == 3 else resized[0]
+            gain = numpy.clip(gain * (1 << GAIN_BITS) + 0.5, 0, 65535).astype(numpy.uint16)
+            # only one frame size is normally captured, dont keep maps for every size that has come along.
+            self._gain_maps.clear()
+            self._gain_maps[key] = gain
+        return self._gain_maps[key]
+
+    @staticmethod
+    def bake_3d(table: numpy.ndarray) -> numpy.ndarray:
+        """
+        Interpolates a 3D table into a dense uint8 table of LUT_3D_LEVELS levels per channel, flattened so that it is
+        indexed by the offsets from :attr:`lut_3d_index`.
+
+        :param table: size x size x size x 3 table in 0-1, indexed [r, g, b]
+        :rtype: numpy.ndarray
+        """
+        n = table.shape[0]
+        x = numpy.linspace(0, n - 1, LUT_3D_LEVELS, dtype=numpy.float32)
+        i = numpy.minimum(x.astype(numpy.intp), n - 2)
+        f = x - i
+        # interpolate along one axis at a time, each pass is only the size of the output.
+        table = table[i] * (1 - f)[:, None, None, None] + table[i + 1] * f[:, None, None, None]
+        table = table[:, i] * (1 - f)[None, :, None, None] + table[:, i + 1] * f[None, :, None, None]
+        table = table[:, :, i] * (1 - f)[None, None, :, None] + table[:, :, i + 1] * f[None, None, :, None]
+        return numpy.clip(table * 255 + 0.5, 0, 255).astype(numpy.uint8).reshape(-1, 3)
+
+    @property
+    def lut_3d_index(self) -> numpy.ndarray:
+        """
+        Offsets into the baked 3D table of each 8 bit value, for red, green and blue.
+
+        :rtype: numpy.ndarray
+        """
+        levels = (numpy.arange(256) * (LUT_3D_LEVELS - 1) + 127) // 255
+        return numpy.stack([levels * LUT_3D_LEVELS ** 2, levels * LUT_3D_LEVELS, levels]).astype(numpy.int32)
+
+    def _apply_band(self, chunk: numpy.ndarray, gain: numpy.ndarray = None):
+        if gain is not None:
+            tmp = chunk.astype(numpy.uint32)
+            tmp *= gain[..., None] if gain.ndim == 2 else gain
+            tmp >>= GAIN_BITS
+            numpy.minimum(tmp, 255, out=tmp)
+            chunk[...] = tmp
+        if self.lut_1d is not None:
+            for c in range(3):
+                chunk[..., c] = self.lut_1d[c][chunk[..., c]]
+        if self.lut_3d is not None:
+            index = self._lut_3d_index[0][chunk[..., 0]]
+            index += self._lut_3d_index[1][chunk[..., 1]]
+            index += self._lut_3d_index[2][chunk[..., 2]]
+            chunk[...] = self.lut_3d[index]
+
+    def apply(self, arr: numpy.ndarray) -> numpy.ndarray:
+        """
+        Corrects a frame in place.
+
+        :param arr: writable uint8 rgb array, height x width x 3
+        :return: the same array
+        :rtype: numpy.ndarray
+        """
+        if arr.dtype != numpy.uint8 or arr.ndim != 3 or arr.shape[2] != 3:
+            raise ValueError("Can only calibrate 8 bit rgb frames")
+        gain = self.gain_map(arr.shape[1], arr.shape[0]) if self.flat is not None else None
+        for y0 in range(0, arr.shape[0], self.chunk_rows):
+            self._apply_band(arr[y0:y0 + self.chunk_rows], gain[y0:y0 + self.chunk_rows] if gain is not None else None)
+        return arr
+
+    def apply_image(self, img: Image.Image) -> Image.Image:
+        """
+        Corrects a PIL image into a new rgb image, a band of chunk_rows rows at a time, so the corrected image is the only
+        full frame allocated. The image given isnt changed, cameras may hand out the same image more than once.
+
+        :param img: image, converted to rgb a band at a time if it isnt already
+        :return: corrected image
+        :rtype: PIL.Image
+        """
+        width, height = img.size
+        out = Image.new("RGB", (width, height))
+        gain = self.gain_map(width, height) if self.flat is not None else None
+        for y0 in range(0, height, self.chunk_rows):
+            box = (0, y0, width, min(height, y0 + self.chunk_rows))
+            band = img.crop(box)
+            if band.mode != "RGB":
+                band = band.convert("RGB")
+            band = numpy.array(band)
+            self._apply_band(band, gain[box[1]:box[3]] if gain is not None else None)
+            out.paste(Image.fromarray(band), box)
+        return out
@@ -1,4 +1,6 @@
 import datetime
+import functools
+import hashlib
 import logging.config
 
 import os
@@ -9,17 +11,33 @@ import traceback
 from dateutil import zoneinfo, parser
 from io import BytesIO
 import threading
+from collections import deque
+import numpy
 from threading import Thread, Event
 # import cv2
 from PIL import Image, ImageDraw, ImageFont
 import re
+from .Encoder import Encoder, write_exif
+from .ArchivePacker import ArchivePacker
+from .Manifest import Manifest
+from .DerivativeQueue import DerivativeQueue
+from .ResourceGovernor import ResourceGovernor
+from .Timelapse import Timelapse
+from .Thumbnails import Thumbnails
+from .Solar import SolarTable
+from .DeviceArbiter import DeviceArbiter
+from .Plugins import PluginRunner
+from .Clock import Clock
+from .ExposureFusion import ExposureFusion
+from .Calibration import Calibration
+from .Heartbeat import disk_headroom
+from .QualityMetrics import QualityMetrics
+from .LogQueue import configure_logging, get_camera_logger
+from .Recovery import Backoff, CaptureTimeout, call_with_timeout, usb_reset as reset_usb_device
 
 timezone = zoneinfo.get_zonefile_instance().get("Australia/Canberra")
 
-try:
-    logging.config.fileConfig("/etc/eyepi/logging.ini")
-except:
-    pass
+configure_logging()
 
 try:
     import telegraf
@@ -27,6 +45,9 @@ except Exception as e:
     logging.error("Couldnt import pytelegraf module, no telemetry: {}".format(str(e)))
 
 regex = re.compile(r'((?P<hours>\d+?)hr)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?')
+hhmm_regex = re.compile(r'^\s*(?P<hour>\d{1,2}):?(?P<minute>\d{2})\s*$')
+roi_name_regex = re.compile(r'^[\w-]+$')
+solar_regex = re.compile(r'^\s*(?P<event>sunrise|sunset)\s*((?P<sign>[+-])\s*(?P<offset>\S+))?\s*$')
 
 
 def parse_duration(time_str):
@@ -58,6 +79,8 @@ class TwentyFourHourTimeParserInfo(parser.parserinfo):
 
 USBDEVFS_RESET = 21780
 
+_arbiter_lock = threading.Lock()
+
 
 def nested_lookup(key, document):
     """
@@ -96,10 +119,26 @@ class Camera(Thread):
     file_types = ["CR2", "RAW", "NEF", "JPG", "JPEG", "PPM", "TIF", "TIFF"]
     output_types = ["tif", 'jpg']
 
+    # recovery steps taken after each successive failed attempt, see :func:`Camera.recover`
+    recovery_ladder = ["retry", "retry", "usb_reset", "retry", "redetect"]
+
     _frame = None
     _thread = None
     _last_access = None
 
+    @classmethod
+    def arbiter(cls) -> DeviceArbiter:
+        """
+        Gets the arbiter for the device of this camera class, shared between live view and the capture threads the same
+        way the stream state is. Captures of different cameras of the class dont wait for each other, only for live view.
+
+        :rtype: DeviceArbiter
+        """
+        with _arbiter_lock:
+            if "_arbiter" not in cls.__dict__:
+                cls._arbiter = DeviceArbiter()
+            return cls._arbiter
+
     def init_stream(self):
         """
         Initialises a video stream class thread.
@@ -127,6 +166,7 @@ class Camera(Thread):
         """
         Boilerplate stream thread.
         Override this with the correct method of opening the camera, grabbing image data and closing the camera.
+        The device must only be opened while holding it from :func:`arbiter`, and released when a capture preempts.
         """
         print("Unimplemented classmethod call: stream_thread")
         print("You should not create a Camera object directly")
@@ -134,15 +174,18 @@ class Camera(Thread):
         def get_camera():
             pass
 
-        with get_camera() as camera:
-            # let camera warm up
-            while True:
-                # example, you actually need to get the data from somewhere.
-                cls._frame = camera.get_frame().read()
-                # if there hasn't been any clients asking for frames in
-                # the last 10 seconds stop the thread
-                if time.time() - cls._last_access > 10:
-                    break
+        arbiter = cls.arbiter()
+        # if there hasn't been any clients asking for frames in the last 10 seconds stop the thread
+        while time.time() - cls._last_access <= 10:
+            if not arbiter.acquire("live_view", timeout=1):
+                continue
+            try:
+                with get_camera() as camera:
+                    while not arbiter.preempted and time.time() - cls._last_access <= 10:
+                        # example, you actually need to get the data from somewhere.
+                        cls._frame = camera.get_frame().read()
+            finally:
+                arbiter.release("live_view")
         cls._thread = None
 
     def __init__(self, config, **kwargs):
@@ -153,10 +196,11 @@ class Camera(Thread):
         :param config: Configuration section for this camera.
         :param queue: deque to push info into
         :param noconf: dont create a config, or watch anything. Used for temporarily streaming from a camera
+        :param clock: :class:`Clock` to schedule captures by, defaults to the clock in the config or real time
         :param kwargs:
         """
         identifier = config['filenameprefix']
-        self.logger = logging.getLogger(identifier)
+        self.logger = get_camera_logger(identifier, self.__class__.__name__)
 
         super().__init__(name=identifier)
         print("Thread started {}: {}".format(self.__class__, identifier))
@@ -169,27 +213,191 @@ class Camera(Thread):
         self._exif = dict()
         self._frame = None
         self._image = Image.new('RGB', (1,1))
+        self._image_bytes = None
         # self._image = numpy.empty((Camera.default_width, Camera.default_height, 3), numpy.uint8)
         self.config = config.copy()
         self.name = self.config.get("filenameprefix", identifier)
+        # everything that schedules captures goes through the clock, so runs can be replayed faster than real time.
+        self.clock = kwargs.get("clock", None)
+        if self.clock is None:
+            try:
+                self.clock = Clock.from_config(self.config)
+            except Exception as e:
+                self.logger.error("Invalid clock configuration, using real time: {}".format(str(e)))
+                self.clock = Clock()
 
         self.interval = parse_duration(self.config.get("interval", "10m"))
-        self.output_directory = "/var/lib/eyepi/{}".format(str(self.identifier))
-
-        # self.begin_capture = datetime.time(0, 0)
-        # self.end_capture = datetime.time(23, 59)
-        #
-        # try:
-        #     self.begin_capture = parser.parse(str(self.config["starttime"]),
-        #                                       parserinfo=TwentyFourHourTimeParserInfo()).time()
-        # except Exception as e:
-        #     self.logger.error("Time conversion error starttime - {}".format(str(e)))
-        # try:
-        #     # cut string to max of 4.
-        #     self.end_capture = parser.parse(str(self.config["stoptime"]),
-        #                                     parserinfo=TwentyFourHourTimeParserInfo()).time()
-        # except Exception as e:
-        #     self.logger.error("Time conversion error stoptime - {}".format(str(e)))
+        # write the native output of the cameras encoder straight to disk instead of re-encoding it.
+        self.passthrough = bool(self.config.get("passthrough", False))
+        try:
+            self.encoder = Encoder(self.config)
+        except ValueError as e:
+            self.logger.error("Invalid output configuration, using defaults: {}".format(str(e)))
+            self.encoder = Encoder()
+        self.output_types = self.encoder.output_types
+        self.output_directory = self.config.get("output_directory",
+                                                "/var/lib/eyepi/{}".format(str(self.identifier)))
+
+        # capture accounting, the telemetry of recent captures is kept for status reporting.
+        self.captures = 0
+        self.failures = 0
+        self.last_capture_time = None
+        self.capture_history = deque(maxlen=256)
+
+        # the latest preview is kept in memory to be served, copying it to disk is optional.
+        self.last_image_copy = bool(self.config.get("last_image_copy", True))
+        self._preview_bytes = None
+        self._preview_etag = None
+        self._capture_requested = Event()
+
+        # recovery: every capture has a hard timeout, failures are retried with backoff up the recovery ladder.
+        self.recovery_ladder = list(self.config.get("recovery_ladder", Camera.recovery_ladder))
+        self.backoff = Backoff(base=float(self.config.get("backoff_base", 1)),
+                               max_delay=float(self.config.get("backoff_max", 60)))
+        self.capture_timeout = self.default_capture_timeout()
+        if "capture_timeout" in self.config:
+            self.capture_timeout = parse_duration(str(self.config["capture_timeout"])).total_seconds()
+        # set when a capture call times out, so backends retrying inside it give up instead of carrying on orphaned.
+        self._capture_abandoned = Event()
+        self.watchdog_flagged = False
+        self._stuck_call = None
+        # captures in a row that returned nothing, they escalate up the recovery ladder like timeouts.
+        self._empty_captures = 0
+        self._started_time = self.clock.now()
+
+        # image quality metrics computed on a downsampled copy of each capture, sent with the telemetry.
+        self.quality_metrics = None
+        if self.config.get("quality_metrics", True):
+            self.quality_metrics = QualityMetrics(budget_s=float(self.config.get("quality_budget", 0.05)))
+
+        # checksum algorithm for the per hour manifests, checksums are computed as files are moved into place.
+        self.checksum = self.config.get("checksum", False)
+        if self.checksum and self.checksum not in Manifest.algorithms:
+            self.logger.error("Unknown checksum algorithm {}, not writing manifests".format(self.checksum))
+            self.checksum = False
+
+        # pack each completed hour directory into a single archive.
+        self.packer = None
+        self._packed_hour = None
+        pack_format = self.config.get("pack_archives", False)
+        if pack_format:
+            try:
+                self.packer = ArchivePacker(self.output_directory,
+                                            fmt="tar" if pack_format is True else str(pack_format),
+                                            logger=self.logger)
+            except ValueError as e:
+                self.logger.error("Not packing archives: {}".format(str(e)))
+
+        # sheds or defers optional work when the cpu is hot or the system is loaded.
+        self.governor = ResourceGovernor.from_config(self.config)
+
+        # write only the primary output type at capture time and generate the rest later at idle priority.
+        # with the governor enabled this is also where secondary outputs are deferred to under pressure, but only if the
+        # primary output can be their source, spooling an uncompressed frame would add disk writes while under pressure.
+        self.defer_outputs = bool(self.config.get("deferred_outputs", False))
+        self.derivatives = None
+        governor_defers = self.governor is not None and len(self.output_types) > 1 and DerivativeQueue.choose_primary(
+            self.output_types, self.config.get("primary_output", None)) in DerivativeQueue.lossless_types
+        if (self.defer_outputs or governor_defers) and len(self.output_types) > 1:
+            queue_directory = self.config.get("deferred_directory",
+                                              os.path.join(os.path.dirname(self.output_directory.rstrip(os.sep)),
+                                                           ".deferred", self.identifier))
+            try:
+                self.derivatives = DerivativeQueue(self, queue_directory,
+                                                   primary=self.config.get("primary_output", None),
+                                                   governor=self.governor)
+                if self.packer is not None:
+                    self.packer.holds.append(self.derivatives.has_pending)
+                self.derivatives.start()
+            except Exception as e:
+                self.logger.error("Couldnt start deferred output queue, writing all outputs at capture: {}".format(str(e)))
+                self.derivatives = None
+
+        # daily timelapse video built one preview frame at a time.
+        self.timelapse = None
+        if self.config.get("timelapse", False):
+            self.timelapse = Timelapse(self.output_directory,
+                                       fps=int(self.config.get("timelapse_fps", 25)),
+                                       crf=int(self.config.get("timelapse_crf", 23)),
+                                       ffmpeg_path=self.config.get("ffmpeg_path", "ffmpeg"),
+                                       logger=self.logger, clock=self.clock)
+            self.timelapse.start()
+
+        # thumbnail pyramid written with each capture, and a per day contact sheet.
+        self.thumbnails = None
+        if self.config.get("thumbnails", False):
+            self.thumbnails = Thumbnails(self.output_directory, self.interval.total_seconds(),
+                                         sizes=self.config.get("thumbnail_sizes", None),
+                                         contact_sheet=bool(self.config.get("contact_sheet", True)),
+                                         max_per_hour=int(self.config.get("contact_sheet_per_hour", 12)),
+                                         logger=self.logger)
+
+        # latest decoded frame published to shared memory for analysis processes.
+        self.frame_bus = None
+        if self.config.get("frame_bus", False):
+            try:
+                # multiprocessing.shared_memory is python 3.8+, only needed if the bus is enabled.
+                from .FrameBus import FrameBus, bus_name
+                self.frame_bus = FrameBus(self.config.get("frame_bus_name", bus_name(self.identifier)))
+            except ImportError as e:
+                self.logger.error("Couldnt import the frame bus, it needs python 3.8 or later: {}".format(str(e)))
+
+        # analysis plugins run on each stored capture in separate processes.
+        self.plugins = None
+        try:
+            self.plugins = PluginRunner.from_config(self.config, on_result=self.plugin_result, logger=self.logger)
+        except Exception as e:
+            self.logger.error("Couldnt set up plugins: {}".format(str(e)))
+        if self.plugins is not None:
+            if self.packer is not None:
+                self.packer.holds.append(self.plugins.has_pending)
+            self.plugins.start()
+
+        # exposure bracketing, each capture is a bracket of exposures fused into one image.
+        self.bracket = [float(ev) for ev in self.config.get("bracket", [])]
+        self.bracket_keep = bool(self.config.get("bracket_keep", False))
+        self.fusion = None
+        if len(self.bracket) > 1:
+            self.fusion = ExposureFusion(workers=int(self.config.get("fusion_workers", 2)),
+                                         tile_rows=int(self.config.get("fusion_tile_rows", 128)))
+            self.capture_timeout *= len(self.bracket)
+
+        # flat field and colour correction applied to every capture before it is encoded.
+        self.calibration = None
+        try:
+            self.calibration = Calibration.from_config(self.config)
+        except Exception as e:
+            self.logger.error("Couldnt load calibration, not correcting captures: {}".format(str(e)))
+
+        # regions of interest cropped out of every capture, the full frame is only stored every full_frame_interval.
+        self.rois = dict()
+        for roi_name, roi in self.config.get("rois", dict()).items():
+            if not roi_name_regex.match(roi_name) or len(roi) != 4:
+                self.logger.error("Invalid region of interest {}, needs a name and [x, y, width, height]".format(roi_name))
+                continue
+            self.rois[roi_name] = [float(v) for v in roi]
+        self.full_frame_interval = None
+        if self.rois:
+            self.full_frame_interval = parse_duration(str(self.config.get("full_frame_interval", "1hr")))
+        self._full_frame_slot = None
+
+        # capture window, either times of day or relative to sunrise/sunset. None captures all day.
+        self.solar = None
+        if "latitude" in self.config and "longitude" in self.config:
+            self.solar = SolarTable(self.config["latitude"], self.config["longitude"])
+        self.begin_capture = None
+        self.end_capture = None
+        if "starttime" in self.config or "stoptime" in self.config:
+            try:
+                self.begin_capture = self.parse_capture_time(self.config.get("starttime", "0000"))
+            except Exception as e:
+                self.logger.error("Time conversion error starttime - {}".format(str(e)))
+            try:
+                self.end_capture = self.parse_capture_time(self.config.get("stoptime", "2359"))
+            except Exception as e:
+                self.logger.error("Time conversion error stoptime - {}".format(str(e)))
+            if self.begin_capture is None or self.end_capture is None:
+                self.begin_capture = self.end_capture = None
 
         try:
             if not os.path.exists(self.output_directory):
@@ -200,11 +408,12 @@ class Camera(Thread):
 
         self._exif = self.get_exif_fields()
 
-        # self.logger.info("Capturing from {} to {}".format(self.begin_capture.strftime("%H:%M"),
-        #                                                   self.end_capture.strftime("%H:%M")))
+        if self.begin_capture is not None:
+            self.logger.info("Capturing from {} to {}".format(self.config.get("starttime", "0000"),
+                                                              self.config.get("stoptime", "2359")))
         self.logger.info("Interval: {}".format(self.interval))
 
-        self.current_capture_time = datetime.datetime.now()
+        self.current_capture_time = self.clock.now()
 
     def capture_image(self, filename: str = None):
         """
@@ -221,6 +430,16 @@ class Camera(Thread):
         """
         return self._image
 
+    def default_capture_timeout(self) -> float:
+        """
+        Gets the capture timeout to use if capture_timeout isnt configured, the interval. Backends that retry inside
+        :func:`capture_image` override this so the timeout covers all their tries.
+
+        :return: seconds
+        :rtype: float
+        """
+        return self.interval.total_seconds()
+
     def capture(self, filename: str = None):
         """
         capture method, only extends functionality of :func:`Camera.capture` so that testing with  can happen
@@ -236,7 +455,272 @@ class Camera(Thread):
         if filename:
             dirname = os.path.dirname(filename)
             os.makedirs(dirname, exist_ok=True)
-        return self.capture_image(filename=filename)
+        if self._stuck_call is not None and self._stuck_call.is_alive():
+            # the device is still held by a call that timed out, dont pile more on top of it.
+            self.recover(len(self.recovery_ladder))
+            raise CaptureTimeout("previous capture call is still running", self._stuck_call)
+        self._capture_abandoned.clear()
+        self._image_bytes = None
+        if self.fusion is None and self.calibration is None:
+            files = self.capture_from_stream(filename)
+            if files is not None:
+                return files
+        capture = self.capture_bracket if self.fusion is not None else self.capture_image
+        if self.calibration is not None:
+            capture = self.capture_calibrated
+        # preempts live view if it is running, it resumes when the capture is done.
+        arbiter = self.arbiter()
+        if not arbiter.acquire("capture", timeout=self.capture_timeout):
+            raise CaptureTimeout("capture couldnt acquire the device from {}".format(arbiter.owner), None)
+
+        @functools.wraps(capture)
+        def held_capture(**kwargs):
+            # released by the call itself, so a call that times out keeps the device until it really returns.
+            try:
+                return capture(**kwargs)
+            finally:
+                arbiter.release("capture")
+
+        try:
+            files = call_with_timeout(held_capture, self.capture_timeout, filename=filename)
+        except CaptureTimeout as e:
+            self._stuck_call = e.args[1]
+            self._capture_abandoned.set()
+            self.logger.critical("Capture timed out after {}s".format(self.capture_timeout))
+            self.recover(len(self.recovery_ladder))
+            raise
+        if files is None or (isinstance(files, list) and not len(files)):
+            self.logger.error("Capture returned nothing")
+            self._empty_captures += 1
+            self.recover(self._empty_captures - 1)
+        else:
+            self._empty_captures = 0
+        return files
+
+    def full_frame_due(self, t: datetime.datetime) -> bool:
+        """
+        Whether the full frame should be stored with a capture, or only the regions of interest.
+        The full frame is stored with the first capture in each full_frame_interval, never if it is 0.
+
+        :param t: capture time
+        :rtype: bool
+        """
+        if not self.rois or self.full_frame_interval is None:
+            return True
+        seconds = self.full_frame_interval.total_seconds()
+        if seconds <= 0:
+            return False
+        return self.time2seconds(t) // seconds != self._full_frame_slot
+
+    @staticmethod
+    def roi_box(roi: list, size: tuple) -> tuple:
+        """
+        Gets the crop box of a region of interest in an image, clipped to the image.
+
+        :param roi: x, y, width, height in pixels, or as fractions of the image size if they are all 1 or less
+        :param size: width and height of the image
+        :return: left, upper, right, lower
+        :rtype: tuple(int)
+        """
+        x, y, w, h = roi
+        if all(v <= 1 for v in roi):
+            x, w = x * size[0], w * size[0]
+            y, h = y * size[1], h * size[1]
+        box = (max(0, int(round(x))), max(0, int(round(y))),
+               min(size[0], int(round(x + w))), min(size[1], int(round(y + h))))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            raise ValueError("{} is outside the {}x{} frame".format(roi, *size))
+        return box
+
+    def write_rois(self, fn: str) -> list:
+        """
+        Crops the regions of interest out of the current image and writes them in the output types, as fn_roi-*name*.
+        Encoded images from passthrough captures are only decoded here if the full frame isnt being stored.
+
+        :param fn: capture filename without extension
+        :return: files written
+        :rtype: list(str)
+        """
+        files = []
+        for roi_name, roi in self.rois.items():
+            try:
+                crop = self._image.crop(self.roi_box(roi, self._image.size))
+                files.extend(self.encode_write_image(crop, "{}_roi-{}".format(fn, roi_name)))
+            except Exception as e:
+                self.logger.error("Couldnt write region of interest {}: {}".format(roi_name, str(e)))
+        return files
+
+    def set_exposure_bias(self, ev: float) -> bool:
+        """
+        Sets the exposure bias for the following captures, relative to the exposure the camera would otherwise use.
+        Override this in backends that can bracket.
+
+        :param ev: exposure bias in stops, 0 to go back to normal
+        :return: whether the bias was set
+        :rtype: bool
+        """
+        return False
+
+    def capture_calibrated(self, filename: str = None):
+        """
+        Captures an image into memory (a bracket if bracketing), applies the flat field and colour correction from
+        :class:`Calibration` to it band by band into a new image, and writes it like a normal capture. The corrected
+        image is the only full frame made besides the capture itself.
+
+        The camera's own files (eg. raw files from a DSLR) arent kept, as they arent corrected.
+
+        :param filename: image filename without extension
+        :return: image if filename not specified, otherwise list of files.
+        :rtype: PIL.Image or list(str)
+        """
+        self._image = None
+        if self.fusion is not None:
+            self.capture_bracket()
+        else:
+            self.capture_image()
+        if self._image is None:
+            return [] if filename else None
+        st = time.time()
+        self._image = self.calibration.apply_image(self._image)
+        self._image_bytes = None
+        self.logger.debug("Calibrated in {:.2f}s".format(time.time() - st))
+        if filename:
+            return self.encode_write_image(self._image, filename)
+        return self._image
+
+    def capture_bracket(self, filename: str = None):
+        """
+        Captures a frame at each exposure bias in the bracket with :func:`capture_image`, and fuses them into one image
+        with :class:`ExposureFusion`, which is written like a normal capture.
+
+        The brackets are only written (as filename_ev-2 etc.) if bracket_keep is set.
+
+        :param filename: image filename without extension
+        :return: image if filename not specified, otherwise list of files.
+        :rtype: PIL.Image or list(str)
+        """
+        frames = []
+        files = []
+        try:
+            for ev in self.bracket:
+                if not self.set_exposure_bias(ev):
+                    raise ValueError("{} cant set the exposure bias to bracket".format(self.__class__.__name__))
+                bracket_fn = "{}_ev{:+g}".format(filename, ev) if filename and self.bracket_keep else None
+                self._image = None
+                self._image_bytes = None
+                ret = self.capture_image(filename=bracket_fn)
+                if self._image is None:
+                    raise ValueError("No image captured at {:+g}ev".format(ev))
+                frames.append(numpy.asarray(self._image.convert("RGB")))
+                if bracket_fn and ret:
+                    files.extend(ret)
+        finally:
+            self.set_exposure_bias(0)
+        self._image = Image.fromarray(self.fusion.fuse(frames))
+        self._image_bytes = None
+        self.logger.debug("Fused {} exposures in {:.2f}s".format(len(frames), self.fusion.last_duration))
+        if filename:
+            return self.encode_write_image(self._image, filename) + files
+        return self._image
+
+    def capture_from_stream(self, filename: str = None):
+        """
+        Fulfils a capture from the live view stream instead of interrupting it, if live view is running and its frames
+        are at least live_view_min_size.
+
+        :param filename: image filename without extension
+        :return: files written, or None if the capture cant be fulfilled from the stream
+        :rtype: list(str)
+        """
+        min_size = self.config.get("live_view_min_size", None)
+        frame = self.__class__._frame
+        if not min_size or self.__class__._thread is None or frame is None:
+            return None
+        try:
+            img = Image.open(BytesIO(frame))
+            if img.size[0] < int(min_size[0]) or img.size[1] < int(min_size[1]):
+                return None
+            self.set_image_bytes(frame)
+            self.logger.info("Capturing from the live view stream at {}x{}".format(*img.size))
+            if not filename:
+                return self._image
+            if self.passthrough:
+                return self.write_passthrough(BytesIO(frame), filename, "jpg")
+            return self.encode_write_image(self._image, filename)
+        except Exception as e:
+            self.logger.error("Couldnt capture from the live view stream: {}".format(str(e)))
+        return None
+
+    def recover(self, attempt: int):
+        """
+        Takes the recovery step for an attempt from the recovery ladder, then waits with exponential backoff.
+
+        Steps are:
+            - retry: just wait.
+            - usb_reset: reset the usb device with :func:`Camera.usb_reset`.
+            - redetect: find the device again with :func:`Camera.redetect`.
+
+        Attempts past the end of the ladder take every reset/redetect step in order.
+
+        :param attempt: number of failed attempts so far
+        """
+        if attempt < len(self.recovery_ladder):
+            steps = [self.recovery_ladder[attempt]]
+        else:
+            steps = [step for step in self.recovery_ladder if step != "retry"]
+        for step in steps:
+            self.logger.warning("Recovery attempt {}: {}".format(attempt, step))
+            try:
+                if step == "usb_reset":
+                    self.usb_reset()
+                elif step == "redetect":
+                    self.redetect()
+            except Exception as e:
+                self.logger.error("Recovery step {} failed: {}".format(step, str(e)))
+        self.clock.wait(self.stopper, self.backoff.delay(min(attempt, len(self.recovery_ladder))))
+
+    def usb_reset(self) -> bool:
+        """
+        Resets the usb port of the camera, if it has a usb_address.
+
+        :return: whether the device was reset
+        :rtype: bool
+        """
+        usb_address = getattr(self, "usb_address", None)
+        if not usb_address or None in usb_address:
+            self.logger.debug("No usb address to reset")
+            return False
+        reset_usb_device(*usb_address)
+        self.logger.warning("Reset usb device {}:{}".format(*usb_address))
+        return True
+
+    def redetect(self) -> bool:
+        """
+        Finds the camera device again, override this for cameras whose device address can change.
+
+        :return: whether the device was found
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def missed_deadlines(self) -> int:
+        """
+        Gets the number of scheduled captures that have been missed since the last successful capture.
+
+        :return: number of missed captures
+        :rtype: int
+        """
+        now = self.clock.now()
+        last = self.last_capture_time or self._started_time
+        if self.begin_capture is not None:
+            # captures outside the capture window arent missed.
+            window = self.capture_window_at(now)
+            if window is None:
+                return 0
+            last = max(last, window[0])
+        elapsed = (now - last).total_seconds()
+        return max(0, int(elapsed // self.interval.total_seconds()) - 1)
 
     @property
     def exif(self) -> dict:
@@ -246,7 +730,7 @@ class Camera(Thread):
         :return: dictionary of exif fields and their values.
         :rtype: dict
         """
-        self._exif["Exif.Photo.DateTimeOriginal"] = datetime.datetime.now()
+        self._exif["Exif.Photo.DateTimeOriginal"] = self.clock.now()
         return self._exif
 
     @property
@@ -259,6 +743,36 @@ class Camera(Thread):
         """
         return self._image
 
+    def set_image_bytes(self, data: bytes):
+        """
+        Sets the current image from encoded image data (the native output of the cameras encoder).
+        The image is opened lazily, so the pixel data isnt decoded until something actually needs it.
+
+        :param data: encoded image data (jpeg).
+        """
+        self._image_bytes = data
+        self._image = Image.open(BytesIO(data))
+
+    def preview_image(self, width: int, height: int) -> Image:
+        """
+        Gets a resized copy of the current image.
+        If the current image is encoded jpeg data the decoder is put into draft mode so that only a reduced scale
+        version of the image is decoded.
+
+        :param width: width of the preview
+        :param height: height of the preview
+        :return: resized image
+        :rtype: PIL.Image
+        """
+        if self._image_bytes is not None:
+            try:
+                img = Image.open(BytesIO(self._image_bytes))
+                img.draft("RGB", (width, height))
+                return img.convert("RGB").resize((width, height), resample=Image.NEAREST)
+            except Exception as e:
+                self.logger.error("Couldnt draft decode image bytes: {}".format(str(e)))
+        return self._image.resize((width, height), resample=Image.NEAREST)
+
     @staticmethod
     def timestamp(tn: datetime.datetime) -> str:
         """
@@ -305,6 +819,112 @@ class Camera(Thread):
         return '{camera_name}_{timestamp}'.format(camera_name=self.name,
                                                   timestamp=Camera.timestamp(self.current_capture_time))
 
+    def parse_capture_time(self, value):
+        """
+        Parses a starttime/stoptime config value, either a time of day (eg. "0600") or a time relative to sunrise or
+        sunset (eg. "sunrise", "sunrise-30m", "sunset+1hr").
+
+        :param value: config value
+        :return: time of day, or tuple of ("sunrise" or "sunset", offset)
+        :rtype: datetime.time or tuple(str, datetime.timedelta)
+        """
+        m = hhmm_regex.match(str(value))
+        if m:
+            return datetime.time(int(m.group("hour")), int(m.group("minute")))
+        m = solar_regex.match(str(value).lower())
+        if not m:
+            return parser.parse(str(value), parserinfo=TwentyFourHourTimeParserInfo()).time()
+        if self.solar is None:
+            raise ValueError("{} needs latitude and longitude to be configured".format(value))
+        offset = datetime.timedelta(0)
+        if m.group("offset"):
+            offset = parse_duration(m.group("offset"))
+            if m.group("sign") == "-":
+                offset = -offset
+        return m.group("event"), offset
+
+    def resolve_capture_time(self, spec, day: datetime.date):
+        """
+        Gets the datetime of a parsed starttime/stoptime on a day.
+
+        :param spec: value from :func:`parse_capture_time`
+        :param day: local date
+        :return: datetime, or None if the sun doesnt rise that day
+        :rtype: datetime.datetime
+        """
+        if isinstance(spec, datetime.time):
+            return datetime.datetime.combine(day, spec)
+        event, offset = spec
+        sunrise, sunset = self.solar.get(day)
+        if sunrise is None:
+            return None
+        return (sunrise if event == "sunrise" else sunset) + offset
+
+    def capture_window(self, day: datetime.date):
+        """
+        Gets the capture window that starts on a day. Windows that end before they start carry over midnight.
+
+        :param day: local date
+        :return: start and end of the window, or None if there is no window that day
+        :rtype: tuple(datetime.datetime, datetime.datetime)
+        """
+        start = self.resolve_capture_time(self.begin_capture, day)
+        end = self.resolve_capture_time(self.end_capture, day)
+        if start is None or end is None:
+            return None
+        if end <= start:
+            end = self.resolve_capture_time(self.end_capture, day + datetime.timedelta(days=1))
+            if end is None:
+                return None
+        return start, end
+
+    def capture_window_at(self, t: datetime.datetime):
+        """
+        Gets the capture window a time falls within.
+
+        :param t: local time
+        :return: start and end of the window, or None if the time is outside every window
+        :rtype: tuple(datetime.datetime, datetime.datetime)
+        """
+        if self.begin_capture is None:
+            day_start = datetime.datetime.combine(t.date(), datetime.time(0, 0))
+            return day_start, day_start + datetime.timedelta(days=1)
+        for day in (t.date() - datetime.timedelta(days=1), t.date()):
+            window = self.capture_window(day)
+            if window is not None and window[0] <= t <= window[1]:
+                return window
+        return None
+
+    def next_window_start(self, t: datetime.datetime):
+        """
+        Gets the start of the next capture window after a time.
+
+        :param t: local time
+        :return: start of the next window, or None if there isnt one within a year
+        :rtype: datetime.datetime
+        """
+        for days in range(367):
+            window = self.capture_window(t.date() + datetime.timedelta(days=days))
+            if window is not None and window[0] > t:
+                return window[0]
+        return None
+
+    def current_window(self):
+        """
+        Gets the current capture window, or the next one if it is outside the capture window now, for status reporting.
+
+        :return: iso formatted start and end, or None if there is no capture window
+        :rtype: list(str)
+        """
+        if self.begin_capture is None:
+            return None
+        now = self.clock.now()
+        window = self.capture_window_at(now)
+        if window is None:
+            start = self.next_window_start(now)
+            window = self.capture_window(start.date()) if start is not None else None
+        return [t.isoformat() for t in window] if window is not None else None
+
     @property
     def time_to_capture(self) -> bool:
         """
@@ -317,17 +937,8 @@ class Camera(Thread):
         :return: whether or not it is time to capture
         :rtype: bool
         """
-        current_naive_time = self.current_capture_time.time()
-
-        # if self.begin_capture < self.end_capture:
-        #     # where the start capture time is less than the end capture time
-        #     if not self.begin_capture <= current_naive_time <= self.end_capture:
-        #         return False
-        # else:
-        #     # where the start capture time is greater than the end capture time
-        #     # i.e. capturing across midnight.
-        #     if self.end_capture <= current_naive_time <= self.begin_capture:
-        #         return False
+        if self.begin_capture is not None and self.capture_window_at(self.current_capture_time) is None:
+            return False
 
         # capture interval
         if not (self.time2seconds(self.current_capture_time) % self.interval.total_seconds() < Camera.accuracy):
@@ -347,10 +958,20 @@ class Camera(Thread):
         exif['Exif.Image.CameraSerialNumber'] = self.identifier
         return exif
 
+    def get_telemetry(self) -> dict:
+        """
+        Gets backend specific telemetry fields to send along with the capture timings.
+        Override this to report things like device counters.
+
+        :return: telemetry fields
+        :rtype: dict
+        """
+        return dict()
+
     def encode_write_image(self, img: Image, fn: str) -> list:
         """
-        takes an image from PIL and writes it to disk as a tif and jpg
-        converts from rgb to bgr for cv2 so that the images save correctly
+        takes an image from PIL and writes it to disk in each of the output types configured for this camera
+        (tif and jpg by default), using the codec settings from :class:`Encoder`.
         also tries to add exif data to the images
 
         :param PIL.Image img: 3 dimensional image array, x,y,rgb
@@ -361,16 +982,15 @@ class Camera(Thread):
         # output types must be valid!
         fnp = os.path.splitext(fn)[0]
         successes = list()
-        for ext in Camera.output_types:
+        output_types = self.encoder.output_types
+        defer = self.derivatives is not None and (self.defer_outputs or not self.allow("secondary_encode"))
+        if defer:
+            output_types = [self.derivatives.primary]
+        for ext in output_types:
             fn = "{}.{}".format(fnp, ext)
             s = False
             try:
-                if ext == "tiff" or ext == "tif":
-                    # format="TIFF" and compression='tiff_lzw' are required
-                    # without these 2 params it will save a tiff without
-                    img.save(fn, format="TIFF", compression='tiff_lzw')
-                else:
-                    img.save(fn)
+                self.encoder.save(img, fn)
                 s = True
             except Exception as e:
                 self.logger.error("Couldnt write image")
@@ -381,40 +1001,302 @@ class Camera(Thread):
 
             if s:
                 successes.append(fn)
-                try:
-                    # set exif data
-                    import pyexiv2
-                    meta = pyexiv2.ImageMetadata(fn)
-                    meta.read()
-                    for k, v in self.exif.items():
-                        try:
-                            meta[k] = v
-                        except:
-                            pass
-                    meta.write()
-                except Exception as e:
-                    self.logger.debug("Couldnt write the appropriate metadata: {}".format(str(e)))
+                self.write_exif(fn)
+        if defer and successes:
+            try:
+                self.derivatives.enqueue(img, fnp, self.current_capture_time)
+            except Exception as e:
+                self.logger.error("Couldnt queue deferred outputs: {}".format(str(e)))
         return successes
 
+    def write_exif(self, fn: str, overwrite: bool = True, exif: dict = None):
+        """
+        Splices exif data into an image file that has already been written, without decoding the image data.
+
+        :param str fn: filename of the image
+        :param bool overwrite: whether to overwrite tags that already exist in the image.
+        :param dict exif: exif data to write, defaults to :func:`Camera.exif`
+        """
+        try:
+            # set exif data
+            write_exif(fn, exif if exif is not None else self.exif, overwrite=overwrite)
+        except Exception as e:
+            self.logger.debug("Couldnt write the appropriate metadata: {}".format(str(e)))
+
+    def write_passthrough(self, image_bytesio: BytesIO, fn: str, ext: str) -> list:
+        """
+        Writes the native output of a cameras encoder to disk byte-for-byte, and then splices in exif data.
+        The image is never decoded.
+
+        :param image_bytesio: bytesio of the encoded image.
+        :param str fn: filename
+        :param str ext: extension of the encoded image data
+        :return: files successfully written.
+        :rtype: list(str)
+        """
+        fn = "{}.{}".format(os.path.splitext(fn)[0], ext)
+        try:
+            self._write_raw_bytes(image_bytesio, fn)
+        except Exception as e:
+            self.logger.error("Couldnt write image bytes")
+            self.logger.error(e)
+            return []
+        self.write_exif(fn)
+        return [fn]
+
     @staticmethod
     def _write_raw_bytes(image_bytesio: BytesIO, fn: str) -> str:
         """
-        Writes a BytesIO object to disk.
+        Writes the entire contents of a BytesIO object to disk.
 
         :param image_bytesio: bytesio of an image.
         :param fn:
         :return: file name
         """
         with open(fn, 'wb') as f:
-            f.write(image_bytesio.read())
-            # no exif data when writing the purest bytes :-P
+            f.write(image_bytesio.getbuffer())
         return fn
 
+    def update_preview(self):
+        """
+        Creates the preview of the current image with the timestamp drawn on it, and keeps it in memory to be served
+        by :func:`preview`.
+        Writes it to /dev/shm and, if last_image_copy is enabled, to last_image.jpg in the output directory.
+        """
+        img = self.preview_image(Camera.default_width, Camera.default_height)
+
+        if self.allow("preview_overlay"):
+            d = ImageDraw.Draw(img)
+            fontpaths = ["/usr/share/fonts/TTF/Inconsolata-Bold.ttf", "/usr/share/fonts/truetype/Inconsolata-Bold.ttf"]
+            for fontpath in fontpaths:
+                if os.path.exists(fontpath):
+                    d.text((20, img.size[1] - 100), self.timestamped_imagename, fill=(0, 0, 255),
+                           font=ImageFont.truetype(fontpath, 50))
+                    break
+            else:
+                d.text((20, img.size[1] - 40), self.timestamped_imagename, fill=(0,0,255))
+
+        output = BytesIO()
+        img.save(output, format="JPEG")
+        self._preview_bytes = output.getvalue()
+        self._preview_etag = '"{}"'.format(hashlib.blake2b(self._preview_bytes, digest_size=8).hexdigest())
+
+        self._write_raw_bytes(output, os.path.join("/dev/shm", self.identifier + ".jpg"))
+        if self.last_image_copy:
+            self._write_raw_bytes(output, os.path.join(self.output_directory, "last_image.jpg"))
+
+    def write_thumbnails(self, fn: str) -> list:
+        """
+        Writes the thumbnail pyramid of the current image next to it, and adds it to the contact sheet.
+        The current image is used as it is in memory, encoded jpeg data is draft decoded rather than fully decoded.
+
+        :param str fn: filename of the capture
+        :return: files written
+        :rtype: list(str)
+        """
+        try:
+            img = Image.open(BytesIO(self._image_bytes)) if self._image_bytes is not None else self._image
+            files, smallest = self.thumbnails.write_pyramid(img, fn)
+        except Exception as e:
+            self.logger.error("Couldnt write thumbnails: {}".format(str(e)))
+            return list()
+        if self.thumbnails.contact_sheet:
+            try:
+                self.thumbnails.add_to_contact_sheet(smallest, self.current_capture_time)
+            except Exception as e:
+                self.logger.error("Couldnt update contact sheet: {}".format(str(e)))
+        return files
+
+    def publish_frame(self, name: str):
+        """
+        Publishes the current image to the frame bus, see :class:`FrameBus`.
+
+        :param str name: basename of the capture, published with the frame
+        """
+        try:
+            self.frame_bus.publish(self._image, self.current_capture_time,
+                                   dict(identifier=self.identifier, name=name,
+                                        capture_time=self.current_capture_time.isoformat()))
+        except Exception as e:
+            self.logger.error("Couldnt publish frame: {}".format(str(e)))
+
+    def plugin_result(self, metadata: dict, name: str, result: dict):
+        """
+        Adds the numeric results of an analysis plugin to the telemetry of its capture and sends them to telegraf.
+        Called from the plugin runner when a plugin finishes.
+
+        :param dict metadata: metadata the capture was submitted with
+        :param str name: plugin name
+        :param dict result: plugin result
+        """
+        fields = {"plugin_{}_{}".format(name, k): v for k, v in result.items()
+                  if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        for capture_time, telemetry in reversed(list(self.capture_history)):
+            if capture_time.isoformat() == metadata.get("capture_time"):
+                telemetry.update(fields)
+                break
+        try:
+            telegraf_client = telegraf.TelegrafClient(host="localhost", port=8092)
+            telegraf_client.metric("camera_plugin", fields, tags={"camera_name": self.name, "plugin": name})
+        except Exception as exc:
+            self.logger.debug("Couldnt communicate plugin results with telegraf client. {}".format(str(exc)))
+
+    def allow(self, work: str) -> bool:
+        """
+        Whether a kind of optional work should be done now, see :class:`ResourceGovernor`.
+
+        :param work: kind of optional work, eg. "quality_metrics"
+        :rtype: bool
+        """
+        return self.governor is None or self.governor.allow(work)
+
+    def measure_quality(self) -> dict:
+        """
+        Computes image quality metrics of the current image on a downsampled copy of it.
+
+        :return: quality metrics, empty if they couldnt be computed
+        :rtype: dict
+        """
+        try:
+            size = self.quality_metrics.target_size(self._image)
+            return self.quality_metrics.compute(self.preview_image(*size))
+        except Exception as e:
+            self.logger.error("Couldnt compute quality metrics: {}".format(str(e)))
+        return dict()
+
+    @property
+    def preview(self) -> tuple:
+        """
+        Gets the latest preview jpeg and its etag.
+
+        :return: tuple of jpeg data and etag, both None if there hasnt been a capture yet.
+        :rtype: tuple(bytes, str)
+        """
+        return self._preview_bytes, self._preview_etag
+
+    def trigger_capture(self):
+        """
+        Requests a capture outside of the schedule, it happens as soon as the capture thread is free.
+        """
+        self._capture_requested.set()
+
+    @property
+    def next_capture_time(self) -> datetime.datetime:
+        """
+        Gets the next scheduled capture time.
+
+        :return: next capture time
+        :rtype: datetime.datetime
+        """
+        interval = self.interval.total_seconds()
+        now = self.time2seconds(self.clock.now())
+        next_time = datetime.datetime.fromtimestamp((now // interval + 1) * interval)
+        if self.begin_capture is not None and self.capture_window_at(next_time) is None:
+            start = self.next_window_start(next_time)
+            if start is not None:
+                next_time = datetime.datetime.fromtimestamp(-(-self.time2seconds(start) // interval) * interval)
+        return next_time
+
+    def queue_depths(self) -> dict:
+        """
+        Gets the number of items waiting in any background queues this camera has.
+        Override and super this when adding queues.
+
+        :return: queue names and their lengths
+        :rtype: dict
+        """
+        queues = dict()
+        if self.derivatives is not None:
+            queues["deferred_outputs"] = len(self.derivatives.jobs)
+        if self.timelapse is not None:
+            queues["timelapse"] = self.timelapse.frames.qsize()
+        if self.plugins is not None:
+            queues["plugins"] = self.plugins.pending
+        return queues
+
+    @property
+    def status(self) -> dict:
+        """
+        Gets the status of this camera as a json serialisable dict.
+
+        :return: camera status
+        :rtype: dict
+        """
+        last_telemetry = self.capture_history[-1][1] if len(self.capture_history) else dict()
+        return {
+            "identifier": self.identifier,
+            "type": self.__class__.__name__,
+            "enabled": bool(self.config.get("enable", True)),
+            "alive": self.is_alive(),
+            "interval_s": self.interval.total_seconds(),
+            "captures": self.captures,
+            "failures": self.failures,
+            "last_capture": self.last_capture_time.isoformat() if self.last_capture_time else None,
+            "next_capture": self.next_capture_time.isoformat(),
+            "capture_window": self.current_window(),
+            "missed_deadlines": self.missed_deadlines,
+            "watchdog_flagged": self.watchdog_flagged,
+            "last_timings": {k: v for k, v in last_telemetry.items() if k.startswith("timing_")},
+            "queues": self.queue_depths()
+        }
+
+    @property
+    def heartbeat(self) -> dict:
+        """
+        Gets a compact summary of this camera for :class:`HeartbeatSender`, short keys to keep the datagrams small:
+
+            - id, type, en (enabled), alive, wd (flagged by the watchdog), int (interval seconds)
+            - age: seconds since the last capture by this camera's clock, None if it hasnt captured yet
+            - cap, fail, miss: captures, failures and missed deadlines
+            - q: items waiting in background queues
+            - free, free_pct: disk headroom of the output directory
+            - lat: p50, p95 and max seconds of each timed stage over the recent captures
+
+        :rtype: dict
+        """
+        timings = dict()
+        for capture_time, telemetry in list(self.capture_history)[-32:]:
+            for k, v in telemetry.items():
+                if k.startswith("timing_") and isinstance(v, (int, float)):
+                    stage = k[len("timing_"):]
+                    timings.setdefault(stage[:-2] if stage.endswith("_s") else stage, []).append(v)
+        lat = {k: [round(float(v), 3) for v in numpy.percentile(values, [50, 95, 100])] for k, values in timings.items()}
+        try:
+            free, free_fraction = disk_headroom(self.output_directory)
+        except Exception:
+            free, free_fraction = None, None
+        return {
+            "id": self.identifier,
+            "type": self.__class__.__name__,
+            "en": bool(self.config.get("enable", True)),
+            "alive": self.is_alive(),
+            "wd": self.watchdog_flagged,
+            "int": self.interval.total_seconds(),
+            "age": round((self.clock.now() - self.last_capture_time).total_seconds(), 1)
+            if self.last_capture_time else None,
+            "cap": self.captures,
+            "fail": self.failures,
+            "miss": self.missed_deadlines,
+            "q": sum(self.queue_depths().values()),
+            "free": free,
+            "free_pct": round(free_fraction * 100, 1) if free_fraction is not None else None,
+            "lat": lat
+        }
+
     def stop(self):
         """
         Stops the capture thread, if self is an instance of :class:`threading.Thread`.
         """
         self.stopper.set()
+        self._capture_requested.set()
+        if self.derivatives is not None:
+            self.derivatives.stop()
+        if self.timelapse is not None:
+            self.timelapse.stop()
+        if self.plugins is not None:
+            self.plugins.stop()
+        if self.fusion is not None:
+            self.fusion.close()
 
     def focus(self):
         """
@@ -428,52 +1310,61 @@ class Camera(Thread):
         Main method. continuously captures and stores images.
         """
         while True and not self.stopper.is_set():
-            self.current_capture_time = datetime.datetime.now()
+            if self.clock.expired:
+                self.logger.info("Clock has reached the end of the run, stopping")
+                self.stop()
+                break
+            self.current_capture_time = self.clock.now()
             # checking if enabled and other stuff
-            if self.__class__._thread is not None:
-                self.logger.critical("Camera live view thread is not closed, camera lock cannot be acquired.")
+            if self.begin_capture is not None and not self._capture_requested.is_set() \
+                    and self.capture_window_at(self.current_capture_time) is None:
+                # sleep through the whole dark period, triggered captures and stopping still wake it.
+                next_start = self.next_window_start(self.current_capture_time)
+                self.logger.info("Outside the capture window, sleeping until {}".format(next_start))
+                wait = 86400 if next_start is None else (next_start - self.clock.now()).total_seconds()
+                self.clock.wait(self._capture_requested, max(1, wait))
                 continue
-            if self.time_to_capture:
+            if (self.time_to_capture or self._capture_requested.is_set()) and not self.stopper.is_set():
+                self._capture_requested.clear()
                 telemetry = dict()
+                # disabled cameras still go through the loop, only a capture that was tried can fail.
+                attempted = False
                 try:
                     with tempfile.TemporaryDirectory(prefix=self.name) as spool:
                         start_capture_time = time.time()
                         raw_image = self.timestamped_imagename
                         files = []
                         if self.config.get("enable", True):
+                            attempted = True
                             self.logger.info("{} capture...".format(self.identifier))
-                            files = self.capture(filename=os.path.join(spool, raw_image))
+                            full_frame = self.full_frame_due(self.current_capture_time)
+                            if full_frame:
+                                files = self.capture(filename=os.path.join(spool, raw_image))
+                            else:
+                                # only the regions of interest are stored, so the capture is kept in memory.
+                                self._image = None
+                                self.capture()
                             # capture. if capture didnt happen dont continue with the rest.
 
                             telemetry["timing_capture_s"] = float(time.time() - start_capture_time)
+                            if self.fusion is not None and self.fusion.last_duration is not None:
+                                telemetry["timing_fusion_s"] = float(self.fusion.last_duration)
 
                             st = time.time()
 
-                            img = self._image.resize((Camera.default_width,
-                                                      Camera.default_height),
-                                resample = Image.NEAREST)
-
-                            d = ImageDraw.Draw(img)
-                            fontpaths = ["/usr/share/fonts/TTF/Inconsolata-Bold.ttf", "/usr/share/fonts/truetype/Inconsolata-Bold.ttf"]
-                            for fontpath in fontpaths:
-                                if os.path.exists(fontpath):
-                                    d.text((20, img.size[1] - 100), self.timestamped_imagename, fill=(0, 0, 255),
-                                           font=ImageFont.truetype(fontpath, 50))
-                                    break
-                            else:
-                                d.text((20, img.size[1] - 40), self.timestamped_imagename, fill=(0,0,255))
-
-                            img.save(os.path.join("/dev/shm", self.identifier + ".jpg"))
-
-                            # cv2.imwrite(os.path.join("/dev/shm", self.identifier + ".jpg"), self._image)
-                            shutil.copy(os.path.join("/dev/shm", self.identifier + ".jpg"),
-                                        os.path.join(self.output_directory, "last_image.jpg"))
+                            if self.allow("preview"):
+                                self.update_preview()
+                                if self.timelapse is not None and self._preview_bytes and self.allow("timelapse"):
+                                    self.timelapse.add(self._preview_bytes, self.current_capture_time)
 
                             resize_t = time.time() - st
 
                             telemetry["timing_resize_s"] = float(resize_t)
                             self.logger.info("Resize {0:.3f}s, total: {0:.3f}s".format(resize_t, time.time() - st))
 
+                            if self.quality_metrics is not None and self.allow("quality_metrics"):
+                                telemetry.update(self.measure_quality())
+
                             # munge into list if list of lists
 
 
@@ -485,16 +1376,38 @@ class Camera(Thread):
                                     files.extend(fn)
                                 else:
                                     files.append(fn)
+
+                            if self.rois and self._image is not None and (len(files) or not full_frame):
+                                st = time.time()
+                                if len(files):
+                                    self._full_frame_slot = self.time2seconds(self.current_capture_time) // \
+                                                            max(1, self.full_frame_interval.total_seconds())
+                                files.extend(self.write_rois(os.path.join(spool, raw_image)))
+                                telemetry["timing_roi_s"] = float(time.time() - st)
+                            telemetry["full_frame"] = bool(full_frame)
+
+                            if self.thumbnails is not None and len(files):
+                                files.extend(self.write_thumbnails(os.path.join(spool, raw_image)))
+
+                            if self.frame_bus is not None and len(files):
+                                st = time.time()
+                                self.publish_frame(raw_image)
+                                telemetry["timing_frame_bus_s"] = float(time.time() - st)
                         try:
                             telemetry["num_files_created"] = len(files)
                         except:
                             pass
+                        stored = []
                         for fn in files:
                             # move files to the upload directory
                             try:
                                 out_dir = os.path.join(self.output_directory, Camera.directory_timestamp(self.current_capture_time))
                                 os.makedirs(out_dir, exist_ok=True)
-                                shutil.move(fn, out_dir)
+                                if self.checksum:
+                                    Manifest(out_dir, self.checksum).move(fn)
+                                else:
+                                    shutil.move(fn, out_dir)
+                                stored.append(os.path.join(out_dir, os.path.basename(fn)))
                                 self.logger.info("Captured & stored for upload - {}".format(os.path.basename(fn)))
                             except Exception as e:
                                 self.logger.error("Couldn't move for timestamped: {}".format(str(e)))
@@ -506,10 +1419,27 @@ class Camera(Thread):
                                     os.remove(fn)
                             except Exception as e:
                                 self.logger.error("Couldn't remove spooled when it still exists: {}".format(str(e)))
+                        if self.plugins is not None and len(stored) and self.allow("plugins"):
+                            self.plugins.submit(stored, dict(identifier=self.identifier, camera_name=self.name,
+                                                             capture_time=self.current_capture_time.isoformat()))
+                        # pack the hours that have been completed since the last check.
+                        current_hour = self.current_capture_time.replace(minute=0, second=0, microsecond=0)
+                        if self.packer is not None and current_hour != self._packed_hour and self.allow("packing"):
+                            self._packed_hour = current_hour
+                            self.packer.pack_in_background(self.current_capture_time)
                         # log total capture time
                         total_capture_time = time.time() - start_capture_time
                         self.logger.info("Total capture time: {0:.2f}s".format(total_capture_time))
                         telemetry["timing_total_s"] = float(total_capture_time)
+                        telemetry.update(self.get_telemetry())
+                        if self.governor is not None:
+                            telemetry.update(self.governor.get_telemetry())
+                        if len(files):
+                            self.captures += 1
+                            self.last_capture_time = self.current_capture_time
+                        elif attempted:
+                            self.failures += 1
+                        self.capture_history.append((self.current_capture_time, telemetry))
                         # communicate our success with the updater
                         try:
                             # use UDP for telegraf, http is overhead and dodgy
@@ -522,9 +1452,14 @@ class Camera(Thread):
                         last_captured_b = bytes(self.current_capture_time.replace(tzinfo=timezone).isoformat(), 'utf-8')
                         # self.communicate_with_updater()
                         # sleep for a little bit so we dont try and capture again so soon.
-                        time.sleep(Camera.accuracy * 2)
+                        self.clock.sleep(Camera.accuracy * 2)
                 except Exception as e:
+                    if attempted:
+                        self.failures += 1
                     self.logger.critical("Image Capture error - {}".format(str(e)))
                     self.logger.critical(traceback.format_exc())
-            time.sleep(1)
+            # wait until the next check, waking early for triggered captures.
+            self.clock.wait(self._capture_requested, 1)
+        if self.frame_bus is not None:
+            self.frame_bus.close()
 
@@ -0,0 +1,169 @@
+import datetime
+import time
+from threading import Lock
+from dateutil import parser
+
+
+def _parse_datetime(value) -> datetime.datetime:
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return parser.parse(str(value))
+
+
+class Clock(object):
+    """
+    Wall clock used by the capture loop, everything that schedules captures gets the time and sleeps through this so
+    that it can be replaced for testing, see :class:`SimulatedClock` and :class:`AcceleratedClock`.
+
+    This one is the real time.
+    """
+
+    def now(self) -> datetime.datetime:
+        """
+        :return: current local time
+        :rtype: datetime.datetime
+        """
+        return datetime.datetime.now()
+
+    def time(self) -> float:
+        """
+        :return: current time in seconds since the epoch
+        :rtype: float
+        """
+        return self.now().timestamp()
+
+    def sleep(self, seconds: float):
+        """
+        Sleeps for a number of seconds of this clock's time.
+
+        :param seconds: seconds to sleep
+        """
+        time.sleep(seconds)
+
+    def wait(self, event, timeout: float = None) -> bool:
+        """
+        Waits for an event, for at most timeout seconds of this clock's time.
+
+        :param event: :class:`threading.Event` to wait for
+        :param timeout: seconds to wait, forever if None
+        :return: whether the event is set
+        :rtype: bool
+        """
+        return event.wait(timeout)
+
+    @property
+    def expired(self) -> bool:
+        """
+        Whether the clock has reached the end of its run, real time never does.
+
+        :rtype: bool
+        """
+        return False
+
+    @staticmethod
+    def from_config(config: dict):
+        """
+        Creates a clock from the clock keys of a camera config:
+
+            - clock: "real" (default), "accelerated" or "simulated"
+            - clock_start: time the clock starts at, defaults to now
+            - clock_end: time the clock stops at, the camera stops when it gets there
+            - clock_rate: clock seconds per real second, for the accelerated clock
+
+        :param config: camera config
+        :rtype: Clock
+        """
+        kind = str(config.get("clock", "real")).lower()
+        start = _parse_datetime(config.get("clock_start", None))
+        end = _parse_datetime(config.get("clock_end", None))
+        if kind == "real":
+            return Clock()
+        if kind == "accelerated":
+            return AcceleratedClock(start=start, rate=float(config.get("clock_rate", 60)), end=end)
+        if kind == "simulated":
+            return SimulatedClock(start=start, end=end)
+        raise ValueError("Unknown clock {}".format(kind))
+
+
+class AcceleratedClock(Clock):
+    """
+    Clock that runs rate times faster than real time, from a start time.
+
+    Everything still really happens concurrently, so the work done between clock readings takes rate times longer in
+    clock time. Good for watching a whole daemon run through a few days, but not deterministic, use
+    :class:`SimulatedClock` for that.
+    """
+
+    def __init__(self, start: datetime.datetime = None, rate: float = 60, end: datetime.datetime = None):
+        """
+        :param start: time the clock starts at, defaults to now
+        :param rate: clock seconds per real second
+        :param end: time the clock expires at, never if None
+        """
+        if rate <= 0:
+            raise ValueError("Clock rate must be positive, not {}".format(rate))
+        self.start = start or datetime.datetime.now()
+        self.rate = float(rate)
+        self.end = end
+        self._started = time.monotonic()
+
+    def now(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(seconds=(time.monotonic() - self._started) * self.rate)
+
+    def sleep(self, seconds: float):
+        time.sleep(max(0, seconds) / self.rate)
+
+    def wait(self, event, timeout: float = None) -> bool:
+        return event.wait(None if timeout is None else max(0, timeout) / self.rate)
+
+    @property
+    def expired(self) -> bool:
+        return self.end is not None and self.now() >= self.end
+
+
+class SimulatedClock(Clock):
+    """
+    Clock whose time only moves when it is slept or waited on, and then moves instantly.
+
+    A capture loop on this clock runs as fast as it can do the work, and captures land on exactly the same times however
+    long the work takes, so the output of a run is deterministic. Give each camera its own simulated clock, a clock
+    shared between threads moves forward by all of their sleeps.
+    """
+
+    def __init__(self, start: datetime.datetime = None, end: datetime.datetime = None):
+        """
+        :param start: time the clock starts at, defaults to now
+        :param end: time the clock expires at, never if None
+        """
+        self._now = start or datetime.datetime.now()
+        self.end = end
+        self._lock = Lock()
+
+    def now(self) -> datetime.datetime:
+        with self._lock:
+            return self._now
+
+    def advance(self, seconds: float):
+        """
+        Moves the clock forward.
+
+        :param seconds: seconds to move it by
+        """
+        with self._lock:
+            self._now += datetime.timedelta(seconds=max(0, seconds))
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+
+    def wait(self, event, timeout: float = None) -> bool:
+        if event.is_set():
+            return True
+        if timeout is None:
+            # nothing will happen in clock time without a timeout, so wait in real time.
+            return event.wait()
+        self.advance(timeout)
+        return event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.end is not None and self.now() >= self.end
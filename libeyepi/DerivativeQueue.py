@@ -0,0 +1,186 @@
+import datetime
+import glob
+import json
+import os
+import time
+from threading import Thread, Event
+from PIL import Image
+from .Manifest import Manifest
+from .ResourceGovernor import lower_priority
+
+
+class DerivativeQueue(Thread):
+    """
+    Persistent, low priority queue that generates the secondary output formats of captures after the fact.
+
+    At capture time only the primary output type is written, and a job file is written to the queue directory. This
+    idle priority (nice 19) thread works through the jobs, writing the secondary output types into the hour directory.
+    Jobs are files, so after a restart the queue carries on where it left off.
+
+    The source for the secondary outputs is the primary output if that is lossless (tif/png), otherwise an
+    uncompressed copy of the frame is spooled into the queue directory alongside the job.
+
+    Work is paused while the :class:`libeyepi.ResourceGovernor.ResourceGovernor` is shedding secondary encodes.
+    """
+
+    lossless_types = ["tif", "tiff", "png"]
+    # sources that havent appeared after this long are given up on
+    source_timeout = 60 * 60
+
+    def __init__(self, camera, queue_directory: str, primary: str = None, governor=None):
+        """
+        :param camera: camera whose captures this queue generates derivatives for
+        :param queue_directory: directory to keep the job files and spooled frames in
+        :param primary: output type to write at capture time, defaults to jpg if it is an output type
+        :param governor: resource governor to pause work under, or None to never pause
+        """
+        super().__init__(name="{}-derivatives".format(camera.identifier))
+        self.daemon = True
+        self.camera = camera
+        self.logger = camera.logger
+        self.queue_directory = queue_directory
+        output_types = camera.encoder.output_types
+        primary = DerivativeQueue.choose_primary(output_types, primary)
+        if primary not in output_types:
+            raise ValueError("Primary output {} is not one of the output types {}".format(primary, output_types))
+        self.primary = primary
+        self.secondary = [ext for ext in output_types if ext != primary]
+        self.governor = governor
+        self.stopper = Event()
+        self._wake = Event()
+        os.makedirs(self.queue_directory, exist_ok=True)
+
+    @staticmethod
+    def choose_primary(output_types: list, primary: str = None) -> str:
+        """
+        Gets the output type to write at capture time.
+
+        :param output_types: output types of the camera
+        :param primary: configured primary output type, if any
+        :return: the configured primary, otherwise jpg if it is an output type, otherwise the first output type
+        :rtype: str
+        """
+        if primary is None:
+            primary = next((ext for ext in output_types if ext in ("jpg", "jpeg")), output_types[0])
+        return primary
+
+    @property
+    def jobs(self) -> list:
+        """
+        Gets the job files waiting in the queue, oldest first.
+        """
+        return sorted(glob.glob(os.path.join(self.queue_directory, "*.json")))
+
+    def has_pending(self, hour_dir: str) -> bool:
+        """
+        Whether there are jobs that will write into an hour directory, used to hold off packing it.
+
+        :param hour_dir: hour directory
+        :rtype: bool
+        """
+        hour_dir = os.path.normpath(hour_dir)
+        for job_path in self.jobs:
+            try:
+                with open(job_path) as f:
+                    if os.path.normpath(json.load(f)["out_dir"]) == hour_dir:
+                        return True
+            except Exception:
+                continue
+        return False
+
+    def enqueue(self, img: Image, fn: str, capture_time: datetime.datetime):
+        """
+        Queues the secondary outputs of a capture whose primary output has been written.
+
+        :param img: the captured image
+        :param fn: filename of the capture without extension
+        :param capture_time: time of the capture, used for the hour directory and exif
+        """
+        if not self.secondary:
+            return
+        basename = os.path.basename(fn)
+        job = dict(basename=basename,
+                   capture_time=capture_time.isoformat(),
+                   out_dir=os.path.join(self.camera.output_directory, self.camera.directory_timestamp(capture_time)),
+                   outputs=self.secondary)
+        if self.primary in DerivativeQueue.lossless_types:
+            job["source"] = os.path.join(job["out_dir"], "{}.{}".format(basename, self.primary))
+        else:
+            job["source"] = os.path.join(self.queue_directory, "{}.ppm".format(basename))
+            if img.mode not in ("L", "RGB"):
+                img = img.convert("RGB")
+            img.save(job["source"], format="PPM")
+        # the job file is written last and renamed into place, it is the commit point.
+        job_path = os.path.join(self.queue_directory, "{}.json".format(basename))
+        with open(job_path + ".partial", "w") as f:
+            json.dump(job, f)
+        os.rename(job_path + ".partial", job_path)
+        self._wake.set()
+
+    def process(self, job_path: str) -> bool:
+        """
+        Generates the outputs of a job and removes it from the queue.
+
+        :param job_path: job file
+        :return: whether the job is finished with (done or given up on)
+        :rtype: bool
+        """
+        with open(job_path) as f:
+            job = json.load(f)
+        capture_time = datetime.datetime.strptime(job["capture_time"][:19], "%Y-%m-%dT%H:%M:%S")
+        if not os.path.isfile(job["source"]):
+            # the primary output may not have been moved into place yet.
+            if time.time() - os.path.getmtime(job_path) < DerivativeQueue.source_timeout:
+                return False
+            self.logger.error("Source for {} never appeared, giving up".format(job["basename"]))
+            os.remove(job_path)
+            return True
+
+        st = time.time()
+        img = Image.open(job["source"])
+        os.makedirs(job["out_dir"], exist_ok=True)
+        manifest = Manifest(job["out_dir"], self.camera.checksum) if self.camera.checksum else None
+        exif = dict(self.camera.exif)
+        exif["Exif.Photo.DateTimeOriginal"] = capture_time
+        for ext in job["outputs"]:
+            fn = os.path.join(job["out_dir"], "{}.{}".format(job["basename"], ext))
+            try:
+                self.camera.encoder.save(img, fn + ".partial." + ext)
+                self.camera.write_exif(fn + ".partial." + ext, exif=exif)
+                os.rename(fn + ".partial." + ext, fn)
+                if manifest is not None:
+                    manifest.add(fn)
+            except Exception as e:
+                self.logger.error("Couldnt write derivative {}: {}".format(os.path.basename(fn), str(e)))
+        img.close()
+        if job["source"].startswith(self.queue_directory):
+            os.remove(job["source"])
+        os.remove(job_path)
+        self.logger.debug("Wrote derivatives of {} in {:.2f}s".format(job["basename"], time.time() - st))
+        return True
+
+    def run(self):
+        """
+        Drops this thread to idle priority and works through the queue, waiting for new jobs when it is empty.
+        """
+        lower_priority()
+        while not self.stopper.is_set():
+            self._wake.clear()
+            waiting = False
+            for job_path in self.jobs:
+                if self.stopper.is_set():
+                    break
+                if self.governor is not None and not self.governor.wait_for("secondary_encode", self.stopper):
+                    break
+                try:
+                    if not self.process(job_path):
+                        waiting = True
+                except Exception as e:
+                    self.logger.error("Couldnt process derivative job {}: {}".format(job_path, str(e)))
+                    waiting = True
+            # check back for jobs waiting on a source, otherwise sleep until something is queued.
+            self._wake.wait(60 if waiting else None)
+
+    def stop(self):
+        self.stopper.set()
+        self._wake.set()
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from threading import Condition
+
+
+class DeviceArbiter(object):
+    """
+    Gives a camera device to one consumer at a time, eg. live view or the capture thread.
+
+    Captures take priority: while a capture is waiting nothing else can acquire the device, and :attr:`preempted` tells
+    the current holder to let go at its next opportunity (for live view, the next frame). Waiting is done on a
+    condition, so neither side polls.
+
+    Captures dont exclude each other, the arbiter is shared by every camera of a class (live view is per class) and each
+    camera only captures from its own thread, so several cameras of a class can capture at once, they only wait for
+    live view to let go.
+    """
+
+    priority_consumer = "capture"
+
+    def __init__(self):
+        self._condition = Condition()
+        self.owner = None
+        self.captures = 0
+        self._waiting_captures = 0
+
+    @property
+    def preempted(self) -> bool:
+        """
+        Whether a capture is waiting for the device, checked by the holder to know when to release it.
+
+        :rtype: bool
+        """
+        return self._waiting_captures > 0
+
+    def acquire(self, consumer: str, timeout: float = None) -> bool:
+        """
+        Waits for the device and takes it.
+
+        :param consumer: name of the consumer, "capture" takes priority over everything else
+        :param timeout: seconds to wait, forever if None
+        :return: whether the device was acquired
+        :rtype: bool
+        """
+        priority = consumer == DeviceArbiter.priority_consumer
+        with self._condition:
+            if priority:
+                self._waiting_captures += 1
+                self._condition.notify_all()
+            try:
+                if priority:
+                    acquired = self._condition.wait_for(lambda: self.owner is None, timeout)
+                    if acquired:
+                        self.captures += 1
+                    return acquired
+                acquired = self._condition.wait_for(
+                    lambda: self.owner is None and self.captures == 0 and self._waiting_captures == 0, timeout)
+                if acquired:
+                    self.owner = consumer
+                return acquired
+            finally:
+                if priority:
+                    self._waiting_captures -= 1
+
+    def release(self, consumer: str):
+        """
+        Releases the device, if the consumer holds it.
+
+        :param consumer: name of the consumer
+        """
+        with self._condition:
+            if consumer == DeviceArbiter.priority_consumer:
+                if self.captures > 0:
+                    self.captures -= 1
+                    self._condition.notify_all()
+            elif self.owner == consumer:
+                self.owner = None
+                self._condition.notify_all()
+
+    def wait_for_preemption(self, timeout: float = None) -> bool:
+        """
+        Waits until a capture wants the device.
+
+        :param timeout: seconds to wait, forever if None
+        :return: whether a capture is waiting
+        :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._waiting_captures > 0, timeout)
+
+    @contextmanager
+    def hold(self, consumer: str, timeout: float = None):
+        """
+        Holds the device for the duration of a with block.
+
+        :param consumer: name of the consumer
+        :param timeout: seconds to wait for the device
+        :raises TimeoutError: if the device wasnt acquired within the timeout
+        """
+        if not self.acquire(consumer, timeout):
+            raise TimeoutError("{} couldnt acquire the device from {}".format(consumer, self.owner or "capture"))
+        try:
+            yield self
+        finally:
+            self.release(consumer)
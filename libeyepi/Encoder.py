@@ -0,0 +1,140 @@
+import os
+from io import BytesIO
+from PIL import Image
+
+
+class Encoder(object):
+    """
+    Encodes images to the output formats and codec settings configured for a camera.
+
+    Configuration keys (all optional, per camera section of eyepi.conf):
+
+        - output_types: list of file extensions to write, eg. ["jpg", "tif", "webp"]
+        - tiff_compression: one of "lzw", "deflate", "none" or "zstd"
+        - jpeg_quality: 1-100, above 95 mostly just makes bigger files
+        - jpeg_subsampling: "4:4:4", "4:2:2" or "4:2:0"
+        - jpeg_progressive: true/false
+        - jpeg_optimize: true/false, optimised huffman tables, a little smaller for an extra pass over the image
+        - webp_quality: 1-100
+        - webp_lossless: true/false
+        - webp_method: 0 (fast) to 6 (slow, smaller)
+    """
+
+    default_output_types = ["tif", "jpg"]
+    supported_types = ["tif", "tiff", "jpg", "jpeg", "webp", "png"]
+    jpeg_subsamplings = ["4:4:4", "4:2:2", "4:2:0"]
+
+    # friendly names to Pillow tiff compression names.
+    tiff_compressions = {
+        "lzw": "tiff_lzw",
+        "deflate": "tiff_adobe_deflate",
+        "none": "raw",
+        "zstd": "zstd"
+    }
+
+    def __init__(self, config: dict = None):
+        """
+        :param config: configuration section for a camera.
+        """
+        config = config or dict()
+        output_types = config.get("output_types", Encoder.default_output_types)
+        if isinstance(output_types, str):
+            output_types = [output_types]
+        self.output_types = [str(ext).lower().lstrip(".") for ext in output_types
+                             if str(ext).lower().lstrip(".") in Encoder.supported_types]
+        if not len(self.output_types):
+            raise ValueError("No supported output_types in {}".format(output_types))
+
+        self.tiff_compression = str(config.get("tiff_compression", "lzw")).lower()
+        if self.tiff_compression not in Encoder.tiff_compressions:
+            raise ValueError("Unknown tiff_compression {}".format(self.tiff_compression))
+        try:
+            self.jpeg_quality = int(config.get("jpeg_quality", 75))
+        except (TypeError, ValueError):
+            raise ValueError("jpeg_quality must be a whole number from 1 to 100, not {}".format(
+                config.get("jpeg_quality")))
+        if not 1 <= self.jpeg_quality <= 100:
+            raise ValueError("jpeg_quality must be from 1 to 100, not {}".format(self.jpeg_quality))
+        self.jpeg_subsampling = str(config.get("jpeg_subsampling", "4:2:0"))
+        if self.jpeg_subsampling not in Encoder.jpeg_subsamplings:
+            raise ValueError("Unknown jpeg_subsampling {}, must be one of {}".format(
+                self.jpeg_subsampling, ", ".join(Encoder.jpeg_subsamplings)))
+        self.jpeg_progressive = bool(config.get("jpeg_progressive", False))
+        self.jpeg_optimize = bool(config.get("jpeg_optimize", False))
+        self.webp_quality = int(config.get("webp_quality", 80))
+        self.webp_lossless = bool(config.get("webp_lossless", False))
+        self.webp_method = int(config.get("webp_method", 4))
+
+    def save_kwargs(self, ext: str) -> dict:
+        """
+        Gets the keyword arguments for :func:`PIL.Image.Image.save` for an output type.
+
+        :param ext: file extension
+        :return: save keyword arguments
+        :rtype: dict
+        """
+        ext = ext.lower()
+        if ext in ("tif", "tiff"):
+            # format="TIFF" and compression are required
+            # without these 2 params it will save a tiff without compression
+            return dict(format="TIFF", compression=Encoder.tiff_compressions[self.tiff_compression])
+        if ext in ("jpg", "jpeg"):
+            return dict(format="JPEG",
+                        quality=self.jpeg_quality,
+                        subsampling=self.jpeg_subsampling,
+                        progressive=self.jpeg_progressive,
+                        optimize=self.jpeg_optimize)
+        if ext == "webp":
+            return dict(format="WEBP",
+                        quality=self.webp_quality,
+                        lossless=self.webp_lossless,
+                        method=self.webp_method)
+        return dict(format=ext.upper())
+
+    def save(self, img: Image, fn: str):
+        """
+        Encodes an image to a file, the format is taken from the file extension.
+
+        :param PIL.Image img: image to encode
+        :param fn: filename or file object. if a file object, the extension must be given as its name attribute.
+        """
+        ext = os.path.splitext(fn if isinstance(fn, str) else fn.name)[-1].lstrip(".")
+        if img.mode not in ("RGB", "L") and ext.lower() in ("jpg", "jpeg"):
+            img = img.convert("RGB")
+        img.save(fn, **self.save_kwargs(ext))
+
+    def encode(self, img: Image, ext: str) -> BytesIO:
+        """
+        Encodes an image to memory.
+
+        :param PIL.Image img: image to encode
+        :param ext: file extension of the output type
+        :return: encoded image data
+        :rtype: io.BytesIO
+        """
+        output = BytesIO()
+        output.name = "image.{}".format(ext)
+        self.save(img, output)
+        return output
+
+
+def write_exif(fn: str, exif: dict, overwrite: bool = True):
+    """
+    Splices exif data into an image file that has already been written, without decoding the image data.
+    Raises if the file cant be read or written, tags that cant be set are skipped.
+
+    :param str fn: filename of the image
+    :param dict exif: exif keys and values
+    :param bool overwrite: whether to overwrite tags that already exist in the image.
+    """
+    import pyexiv2
+    meta = pyexiv2.ImageMetadata(fn)
+    meta.read()
+    for k, v in exif.items():
+        if not overwrite and k in meta.exif_keys:
+            continue
+        try:
+            meta[k] = v
+        except:
+            pass
+    meta.write()
@@ -0,0 +1,158 @@
+import time
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _box_valid(a: numpy.ndarray, radius: int, axis: int) -> numpy.ndarray:
+    """
+    Box filter along an axis, only keeping the output where the whole box fits (the axis shrinks by 2 * radius).
+
+    The window sums are built up from sums of 1, 2, 4... neighbours, so there are only additions of the (non negative)
+    weights. A running sum would subtract two large totals, and in float32 the rounding across a wide row is bigger than
+    small weights, so flat regions could come out at or below zero.
+    """
+    size = 2 * radius + 1
+    a = numpy.moveaxis(a, axis, 0)
+    n = a.shape[0] - size + 1
+    # block[i] is the sum of width values starting at i.
+    block, width = a, 1
+    out, offset, remaining = None, 0, size
+    while True:
+        if remaining & 1:
+            part = block[offset:offset + n]
+            if out is None:
+                out = part.astype(numpy.float32)
+            else:
+                out += part
+            offset += width
+        remaining >>= 1
+        if not remaining:
+            break
+        block = block[:-width] + block[width:]
+        width *= 2
+    out *= 1 / size
+    return numpy.moveaxis(out, 0, axis)
+
+
+class ExposureFusion(object):
+    """
+    Merges a bracket of exposures into one image by exposure fusion (Mertens et al.), with vectorised numpy.
+
+    Each pixel of each exposure is weighted by local contrast (laplacian of luma), saturation (standard deviation of
+    the channels) and well exposedness (closeness to mid grey), the weights are smoothed with a box filter so that the
+    blend follows regions rather than single pixels, normalised across the bracket, and the exposures are blended with
+    them. There is no tone mapping or radiometric calibration, so the result is an ordinary 8 bit image.
+
+    To bound memory the image is fused in bands of tile_rows rows with enough overlap that the result is the same as
+    fusing it whole, so only a band of every exposure is ever held as float32. Bands are fused on a thread pool, numpy
+    releases the GIL for the heavy lifting.
+    """
+
+    def __init__(self, workers: int = 2, tile_rows: int = 128, radius: int = 8, contrast: float = 1.0,
+                 saturation: float = 1.0, exposedness: float = 1.0, sigma: float = 0.2):
+        """
+        :param workers: threads to fuse bands on
+        :param tile_rows: rows of the image per band
+        :param radius: radius of the box filter the weights are smoothed with
+        :param contrast: exponent of the contrast weight
+        :param saturation: exponent of the saturation weight
+        :param exposedness: exponent of the well exposedness weight
+        :param sigma: width of the well exposedness gaussian, in 0-1 intensity
+        """
+        self.tile_rows = max(1, int(tile_rows))
+        self.radius = max(0, int(radius))
+        self.contrast = contrast
+        self.saturation = saturation
+        self.exposedness = exposedness
+        self.sigma = sigma
+        self.pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="ExposureFusion")
+        self.last_duration = None
+
+    def weights(self, stack: numpy.ndarray) -> numpy.ndarray:
+        """
+        Computes the normalised fusion weights of a band, which has to be padded by radius + 1 on every side.
+
+        :param stack: float32 array of exposures, N x rows x columns x 3 in 0-1
+        :return: weights, N x (rows - 2 * (radius + 1)) x (columns - 2 * (radius + 1))
+        :rtype: numpy.ndarray
+        """
+        # the channel axis is only 3 long, working on the channels separately is much faster than reducing over it.
+        r, g, b = stack[..., 0], stack[..., 1], stack[..., 2]
+        luma = r + g
+        luma += b
+        luma *= 1 / 3.0
+        laplacian = luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1]
+        laplacian += luma[:, 1:-1, :-2]
+        laplacian += luma[:, 1:-1, 2:]
+        laplacian -= 4 * luma[:, 1:-1, 1:-1]
+        w = numpy.abs(laplacian, out=laplacian)
+        if self.contrast != 1:
+            w **= self.contrast
+        mean = luma[:, 1:-1, 1:-1]
+        square = numpy.zeros_like(w)
+        exposedness = numpy.zeros_like(w)
+        for channel in (r, g, b):
+            channel = channel[:, 1:-1, 1:-1]
+            square += channel * channel
+            exposedness += (channel - 0.5) ** 2
+        square *= 1 / 3.0
+        square -= mean * mean
+        saturation = numpy.sqrt(numpy.maximum(square, 0, out=square), out=square)
+        w *= saturation ** self.saturation if self.saturation != 1 else saturation
+        exposedness *= -self.exposedness / (2 * self.sigma ** 2)
+        w *= numpy.exp(exposedness, out=exposedness)
+        w += 1e-12
+        if self.radius:
+            w = _box_valid(_box_valid(w, self.radius, 1), self.radius, 2)
+        # keep every weight positive so the normalisation never divides by zero.
+        numpy.maximum(w, 1e-12, out=w)
+        total = w[0].copy()
+        for i in range(1, len(w)):
+            total += w[i]
+        w /= total
+        return w
+
+    def _fuse_band(self, images: list, out: numpy.ndarray, y0: int, y1: int):
+        halo = self.radius + 1
+        top, bottom = max(0, y0 - halo), min(out.shape[0], y1 + halo)
+        pad = ((0, 0), (halo - (y0 - top), halo - (bottom - y1)), (halo, halo), (0, 0))
+        stack = numpy.stack([img[top:bottom] for img in images]).astype(numpy.float32)
+        stack *= 1 / 255.0
+        stack = numpy.pad(stack, pad, mode="edge")
+        w = self.weights(stack)
+        fused = w[0][..., None] * stack[0, halo:-halo, halo:-halo]
+        for i in range(1, len(w)):
+            fused += w[i][..., None] * stack[i, halo:-halo, halo:-halo]
+        numpy.clip(fused * 255 + 0.5, 0, 255, out=fused)
+        out[y0:y1] = fused.astype(numpy.uint8)
+
+    def fuse(self, images: list) -> numpy.ndarray:
+        """
+        Fuses a bracket of exposures.
+
+        :param images: uint8 rgb arrays of the same shape, height x width x 3
+        :return: fused uint8 rgb array
+        :rtype: numpy.ndarray
+        """
+        if not len(images):
+            raise ValueError("Nothing to fuse")
+        shape = images[0].shape
+        if any(img.shape != shape for img in images):
+            raise ValueError("Exposures must all be the same size to fuse them")
+        st = time.time()
+        if len(images) == 1:
+            out = images[0].copy()
+        else:
+            out = numpy.empty(shape, dtype=numpy.uint8)
+            futures = [self.pool.submit(self._fuse_band, images, out, y0, min(y0 + self.tile_rows, shape[0]))
+                       for y0 in range(0, shape[0], self.tile_rows)]
+            for future in futures:
+                future.result()
+        self.last_duration = time.time() - st
+        return out
+
+    def close(self):
+        """
+        Shuts down the thread pool.
+        """
+        self.pool.shutdown(wait=False)
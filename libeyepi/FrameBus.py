@@ -0,0 +1,287 @@
+import datetime
+import json
+import os
+import struct
+import time
+import numpy
+from multiprocessing import shared_memory
+
+
+MAGIC = b"EYEP"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQQ")
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct("<QQdIIII")
+SLOT_HEADER_SIZE = 4096
+METADATA_SIZE = SLOT_HEADER_SIZE - SLOT_HEADER.size
+# random token of the writer that created a block, after the header fields.
+OWNER = struct.Struct("<16s")
+OWNER_OFFSET = HEADER.size
+
+
+def bus_name(identifier: str) -> str:
+    """
+    Gets the shared memory name for a camera.
+
+    :param identifier: camera identifier (filenameprefix)
+    :rtype: str
+    """
+    return "eyepi_{}".format(identifier)
+
+
+def slot_offset(slot: int, capacity: int) -> int:
+    return HEADER_SIZE + slot * (SLOT_HEADER_SIZE + capacity)
+
+
+class FrameBus(object):
+    """
+    Publishes the latest decoded frame of a camera into a shared memory double buffer, so other processes can analyse
+    frames without decoding jpegs from disk. See :class:`FrameBusClient` for the reading side.
+
+    Layout of the shared memory block (all little endian):
+
+        header (64 bytes): magic "EYEP", version, active slot, stale flag, sequence number, slot data capacity,
+                           owner token
+        2 slots, each:
+            slot header (4096 bytes): slot sequence, data length, timestamp, width, height, channels, metadata length,
+                                      followed by the metadata as json
+            frame data (capacity bytes): uint8 pixels, height x width x channels
+
+    The writer fills the slot that isnt active and then makes it active, so readers always see a complete frame. Each
+    slot has a seqlock: its sequence is odd while it is being written, readers check it before and after reading.
+
+    The shared memory is created on the first publish, sized for that frame, and recreated if a larger frame comes
+    along. Blocks that are replaced are flagged stale so readers re-attach. A replacement camera for the same device may
+    take the name over while the old one is still finishing a capture, so the old one only removes the block under the
+    name if it still carries its owner token.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: shared memory name, see :func:`bus_name`
+        """
+        self.name = name
+        self.shm = None
+        self.capacity = 0
+        self.seq = 0
+        self.active = 0
+        self.token = os.urandom(OWNER.size)
+
+    def _create(self, capacity: int):
+        if self.shm is not None:
+            # tell readers to re-attach to the new block.
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, self.active, 1, self.seq, self.capacity)
+            self.close()
+        try:
+            # left over from a previous run, readers may still be attached to it.
+            old = shared_memory.SharedMemory(name=self.name)
+            if old.size >= HEADER_SIZE:
+                struct.pack_into("<I", old.buf, 12, 1)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True,
+                                              size=slot_offset(2, capacity))
+        self.capacity = capacity
+        self.active = 0
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, self.active, 0, self.seq, self.capacity)
+        OWNER.pack_into(self.shm.buf, OWNER_OFFSET, self.token)
+        for slot in (0, 1):
+            SLOT_HEADER.pack_into(self.shm.buf, slot_offset(slot, capacity), 0, 0, 0.0, 0, 0, 0, 0)
+
+    def publish(self, img, capture_time: datetime.datetime, metadata: dict = None) -> int:
+        """
+        Publishes a frame.
+
+        :param img: PIL image or numpy array, it is converted to 8 bit rgb or grey
+        :param capture_time: time of the capture
+        :param metadata: json serialisable metadata to publish with the frame
+        :return: sequence number of the frame
+        :rtype: int
+        """
+        if not isinstance(img, numpy.ndarray):
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img = numpy.asarray(img)
+        if img.dtype != numpy.uint8:
+            raise ValueError("Only 8 bit frames can be published, not {}".format(img.dtype))
+        height, width = img.shape[:2]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        if img.nbytes > self.capacity:
+            self._create(img.nbytes)
+
+        meta = json.dumps(metadata or dict()).encode("utf-8")
+        if len(meta) > METADATA_SIZE:
+            raise ValueError("Frame metadata is too large ({} bytes)".format(len(meta)))
+
+        self.seq += 1
+        slot = 1 - self.active
+        offset = slot_offset(slot, self.capacity)
+        buf = self.shm.buf
+        # odd while writing
+        struct.pack_into("<Q", buf, offset, self.seq * 2 - 1)
+        view = numpy.ndarray(img.shape, dtype=numpy.uint8, buffer=buf, offset=offset + SLOT_HEADER_SIZE)
+        numpy.copyto(view, img)
+        del view
+        buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(meta)] = meta
+        SLOT_HEADER.pack_into(buf, offset, self.seq * 2, img.nbytes, capture_time.timestamp(),
+                              width, height, channels, len(meta))
+        self.active = slot
+        HEADER.pack_into(buf, 0, MAGIC, VERSION, self.active, 0, self.seq, self.capacity)
+        return self.seq
+
+    def close(self):
+        """
+        Closes the shared memory, and removes it if the block under the name is still the one this bus created.
+        """
+        if self.shm is None:
+            return
+        self.shm.close()
+        self.shm = None
+        try:
+            current = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        try:
+            if current.size >= HEADER_SIZE and OWNER.unpack_from(current.buf, OWNER_OFFSET)[0] == self.token:
+                current.unlink()
+        finally:
+            current.close()
+
+
+class Frame(object):
+    """
+    A frame mapped from a :class:`FrameBus`.
+
+    :attr:`array` is a view straight onto the shared memory, it stays valid until the writer has published two more
+    frames. Check :func:`valid` after using it, or copy it if it needs to be kept.
+    """
+
+    def __init__(self, array: numpy.ndarray, seq: int, timestamp: float, metadata: dict, client, slot: int,
+                 capacity: int):
+        self.array = array
+        self.seq = seq
+        self.timestamp = datetime.datetime.fromtimestamp(timestamp)
+        self.metadata = metadata
+        self._client = client
+        self._slot = slot
+        self._capacity = capacity
+
+    def valid(self) -> bool:
+        """
+        Whether the frame data hasnt been overwritten since it was mapped.
+
+        :rtype: bool
+        """
+        shm = self._client.shm
+        if shm is None or self._client.capacity != self._capacity:
+            return False
+        return struct.unpack_from("<Q", shm.buf, slot_offset(self._slot, self._capacity))[0] == self.seq * 2
+
+
+class FrameBusClient(object):
+    """
+    Maps frames published by a camera's :class:`FrameBus` as numpy arrays, without copying them.
+
+    eg.::
+
+        client = FrameBusClient(bus_name("MyCamera"))
+        frame = client.wait(timeout=600)
+        leaf_area(frame.array)
+    """
+
+    def __init__(self, name: str, poll_interval: float = 0.02):
+        """
+        :param name: shared memory name, see :func:`bus_name`
+        :param poll_interval: seconds between checks for a new frame while waiting
+        """
+        self.name = name
+        self.poll_interval = poll_interval
+        self.shm = None
+        self.capacity = 0
+        self.last_seq = 0
+
+    def _attach(self) -> bool:
+        self.close()
+        try:
+            try:
+                self.shm = shared_memory.SharedMemory(name=self.name, track=False)
+            except TypeError:
+                # before python 3.13 attaching registers the block with the resource tracker, which would remove it
+                # when this process exits.
+                from multiprocessing import resource_tracker
+                self.shm = shared_memory.SharedMemory(name=self.name)
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        except FileNotFoundError:
+            return False
+        return True
+
+    def latest(self):
+        """
+        Maps the latest frame.
+
+        :return: latest frame, or None if nothing has been published yet
+        :rtype: Frame
+        """
+        for _ in range(10):
+            if self.shm is None and not self._attach():
+                return None
+            buf = self.shm.buf
+            magic, version, active, stale, seq, capacity = HEADER.unpack_from(buf, 0)
+            if magic != MAGIC or version != VERSION:
+                return None
+            if stale:
+                self.close()
+                continue
+            if seq == 0:
+                return None
+            self.capacity = capacity
+            offset = slot_offset(active, capacity)
+            slot_seq, nbytes, timestamp, width, height, channels, meta_len = SLOT_HEADER.unpack_from(buf, offset)
+            if slot_seq % 2:
+                continue
+            metadata = json.loads(bytes(buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + meta_len]) or b"{}")
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            array = numpy.ndarray(shape, dtype=numpy.uint8, buffer=buf, offset=offset + SLOT_HEADER_SIZE)
+            array.flags.writeable = False
+            if struct.unpack_from("<Q", buf, offset)[0] != slot_seq:
+                continue
+            frame = Frame(array, slot_seq // 2, timestamp, metadata, self, active, capacity)
+            self.last_seq = frame.seq
+            return frame
+        return None
+
+    def wait(self, timeout: float = None):
+        """
+        Waits for a frame other than the last one returned (a restarted camera starts its sequence again).
+
+        :param timeout: seconds to wait, forever if None
+        :return: new frame, or None if the timeout passed
+        :rtype: Frame
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        last_seq = self.last_seq
+        while deadline is None or time.monotonic() < deadline:
+            if self.shm is None:
+                self._attach()
+            if self.shm is not None:
+                magic, version, active, stale, seq, capacity = HEADER.unpack_from(self.shm.buf, 0)
+                if seq != last_seq or stale:
+                    frame = self.latest()
+                    if frame is not None and frame.seq != last_seq:
+                        return frame
+            time.sleep(self.poll_interval)
+        return None
+
+    def close(self):
+        """
+        Unmaps the shared memory. Frames from it cant be used afterwards.
+        """
+        if self.shm is not None:
+            try:
+                self.shm.close()
+            except BufferError:
+                # frames are still mapped, the mapping is released when they are garbage collected.
+                pass
+            self.shm = None
@@ -1,6 +1,7 @@
-import glob, subprocess, re, traceback, os
+import glob, subprocess, re, traceback, os, tempfile
 import logging.config
 from .Camera import Camera
+from .LogQueue import configure_logging, get_camera_logger
 from threading import Lock
 from PIL import Image
 
@@ -8,10 +9,7 @@ from dateutil import zoneinfo
 
 timezone = zoneinfo.get_zonefile_instance().get("Australia/Canberra")
 
-try:
-    logging.config.fileConfig("/etc/eyepi/logging.ini")
-except:
-    pass
+configure_logging()
 
 
 class GPCamera(Camera):
@@ -35,6 +33,13 @@ class GPCamera(Camera):
         self.usb_address = [None, None]
         self._serialnumber = config['gphotoserialnumber']
         self.identifier = config["filenameprefix"]
+        self.logger = get_camera_logger(self.identifier, self.__class__.__name__)
+        # path to the gphoto2 binary and a hard timeout on every call to it, so a wedged camera cant hang the thread.
+        self.gphoto2_path = config.get("gphoto2_path", "gphoto2")
+        self.command_timeout = float(config.get("command_timeout", 60))
+        # gphoto2 config entry for exposure compensation used for bracketing, its name varies between cameras.
+        self.exposure_bias_config = config.get("exposure_bias_config", "exposurecompensation")
+        self.exposure_bias = 0
 
         self.usb_address = self.usb_address_detect()
 
@@ -48,9 +53,10 @@ class GPCamera(Camera):
             pass
 
     def usb_address_detect(self) -> tuple:
-        detect_ret = subprocess.check_output(["/usr/bin/gphoto2",
+        detect_ret = subprocess.check_output([self.gphoto2_path,
                                               "--auto-detect"],
-                                             universal_newlines=True)
+                                             universal_newlines=True,
+                                             timeout=self.command_timeout)
         detected_usb_ports = re.findall(r'usb:(\d+),(\d+)', detect_ret)
         for bus, addr in detected_usb_ports:
             try:
@@ -62,10 +68,11 @@ class GPCamera(Camera):
                 # gphoto2 command to get the serial number for the DSLR
                 # WARNING: when the port here needs to be correct, because otherwise gphoto2 will return values from
                 # an arbitrary camera
-                sn_detect_ret = subprocess.check_output(['/usr/bin/gphoto2',
+                sn_detect_ret = subprocess.check_output([self.gphoto2_path,
                                                          '--port={}'.format(port),
                                                          '--get-config=serialnumber'],
-                                                        universal_newlines=True)
+                                                        universal_newlines=True,
+                                                        timeout=self.command_timeout)
 
                 # Match the serial number.
                 # this regex can also be used to parse the values from --get-config as all results are returned like this:
@@ -100,6 +107,30 @@ class GPCamera(Camera):
                 "No identifier from detected cameras ({}) matched desired: {}".format(len(detected_usb_ports),
                                                                                       self.identifier))
 
+    def set_exposure_bias(self, ev: float) -> bool:
+        """
+        Sets the exposure compensation the next captures are taken with, through gphoto2's exposure_bias_config.
+        The camera has to support the value in the steps it uses (usually 1/3 stops).
+
+        :param ev: exposure bias in stops
+        :return: True, the value is only checked by the camera when capturing
+        :rtype: bool
+        """
+        self.exposure_bias = ev
+        return True
+
+    def default_capture_timeout(self) -> float:
+        """
+        Gets the capture timeout to use if capture_timeout isnt configured, long enough for every try of
+        :func:`_gphoto2_capture` to time out, with a few seconds each for the recovery steps and the backoff between
+        them.
+
+        :return: seconds
+        :rtype: float
+        """
+        tries = len(self.recovery_ladder) + 1
+        return (self.command_timeout + 5) * tries + self.backoff.max_total(tries - 1)
+
     def capture_image(self, filename=None):
         """
         Gapture method for DSLRs.
@@ -109,33 +140,63 @@ class GPCamera(Camera):
         This method calls gphoto2 directly, which makes us dependent on gphoto2 (not just libgphoto2 and gphoto2-cffi),
         and there is probably some issue with calling gphoto2 at the same time like 5 times, maybe dont push it.
 
+        gphoto2 always writes files, if no filename is given (eg. for captures that only store regions of interest)
+        they are written to a private temporary directory and removed once the image has been read.
+
         :param filename: filename without extension to capture to.
         :return: list of filenames (of captured images) if filename was specified, otherwise a numpy array of the image.
         :rtype: numpy.array or list
         """
+        if filename:
+            return self._gphoto2_capture(filename)
+        with tempfile.TemporaryDirectory(prefix="{}-".format(self.name)) as spool:
+            if not self._gphoto2_capture(os.path.join(spool, "capture")):
+                return None
+            try:
+                # the files are removed with the directory, so the image has to be read now.
+                self._image.load()
+            except Exception as e:
+                self.logger.error("Failed to load current image: {}".format(str(e)))
+                return None
+            return self._image
 
+    def _gphoto2_capture(self, filename: str) -> list:
+        """
+        Captures to files with gphoto2, retrying and recovering on failure, and sets the current image from them.
+
+        :param filename: filename without extension to capture to.
+        :return: list of filenames captured, empty if the capture failed.
+        :rtype: list(str)
+        """
         # the %C filename parameter given to gphoto2 will automatically expand the number of image types that the
         # camera is set to capture to.
-
-        # this one shouldnt really be used.
-        fn = "{}-temp.%C".format(self.name)
-        if filename:
-            # if target file path exists
-            fn = os.path.join(self.output_directory, "{}.%C".format(filename))
+        fn = os.path.join(self.output_directory, "{}.%C".format(filename))
 
         cmd = [
-            "gphoto2",
+            self.gphoto2_path,
             "--port=usb:{bus:03d},{dev:03d}".format(bus=self.usb_address[0], dev=self.usb_address[1]),
             "--set-config=capturetarget=0",  # capture to sdram
             "--force-overwrite",  # if the target image exists. If this isnt present gphoto2 will lock up asking
             "--capture-image-and-download",  # must capture & download in the same call to use sdram target.
             '--filename={}'.format(fn)
         ]
+        if self.fusion is not None:
+            # bracketing, the bias is set every time so it goes back to 0 after the bracket.
+            cmd.insert(2, "--set-config={}={:g}".format(self.exposure_bias_config, self.exposure_bias))
         self.logger.debug("Capture start: {}".format(fn))
-        for tries in range(6):
+        for tries in range(len(self.recovery_ladder) + 1):
+            if tries and not self._capture_abandoned.is_set():
+                # back off and escalate before trying again.
+                self.recover(tries - 1)
+                cmd[1] = "--port=usb:{bus:03d},{dev:03d}".format(bus=self.usb_address[0], dev=self.usb_address[1])
+            if self._capture_abandoned.is_set():
+                # the capture has already timed out, it recovers and retries from the top.
+                self.logger.warning("Capture timed out, not trying gphoto2 again")
+                return []
             self.logger.debug("CMD: {}".format(" ".join(cmd)))
             try:
-                output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True)
+                output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True,
+                                                 timeout=self.command_timeout)
 
                 if "error" in output.lower():
                     raise subprocess.CalledProcessError("non-zero exit status", cmd=cmd, output=output)
@@ -143,7 +204,7 @@ class GPCamera(Camera):
                     # log success of capture
                     self.logger.info("GPCamera capture success: {}".format(fn))
                     for line in output.splitlines():
-                        self.logger.debug("GPHOTO2: {}".format(line))
+                        self.logger.debug("GPHOTO2: {}".format(line), extra={"sample": 10})
                     # glob up captured images
                     filenames = glob.glob(fn.replace("%C", "*"))
                     # if there are no captured images, log the error
@@ -153,20 +214,23 @@ class GPCamera(Camera):
                         # try and load an image for the last_image.jpg resized doodadery
                         try:
                             jpeg = next(iter(filter(lambda e: '.jpeg' in e.lower() or ".jpg" in e.lower(), filenames)), None)
-                            self._image = Image.open(jpeg)
+                            if self.passthrough:
+                                self._set_image_from_files(jpeg, filenames)
+                            else:
+                                self._image = Image.open(jpeg)
                         except Exception as e:
                             self.logger.error("Failed to set current image: {}".format(str(e)))
 
-                        if filename:
-                            # return the filenames of the spooled images if files were requestsed.
-                            return filenames
-                        else:
-                            # otherwise remove the temporary files that we created in order to fill self._image
+                        if self.passthrough:
+                            # splice our exif fields into the cameras own files, keeping the tags the camera wrote
                             for fp in filenames:
-                                os.remove(fp)
-                            # and return self._image
-                            return self._image
+                                self.write_exif(fp, overwrite=False)
 
+                        # return the filenames of the spooled images.
+                        return filenames
+
+            except subprocess.TimeoutExpired as e:
+                self.logger.error("gphoto2 timed out after {}s, failed {} times".format(self.command_timeout, tries))
             except subprocess.CalledProcessError as e:
                 self.logger.error("failed {} times".format(tries))
                 for line in e.output.splitlines():
@@ -174,9 +238,42 @@ class GPCamera(Camera):
                         self.logger.error(line.strip())
         else:
             self.logger.critical("Really bad stuff happened. too many tries capturing.")
-            if filename:
-                return []
-        return None
+        return []
+
+    def redetect(self) -> bool:
+        """
+        Finds the usb address of the camera again by its serial number, it changes after a reset or replug.
+
+        :return: whether the camera was found
+        :rtype: bool
+        """
+        usb_address = self.usb_address_detect()
+        if usb_address is None:
+            return False
+        self.usb_address = usb_address
+        self.logger.info("Camera redetected at usb port {}:{}".format(*self.usb_address))
+        return True
+
+    def _set_image_from_files(self, jpeg: str, filenames: list):
+        """
+        Sets the current image from the encoded data that gphoto2 downloaded, without decoding it.
+        If the camera only captured raw files the largest embedded preview is used instead.
+
+        :param jpeg: filename of the jpeg captured, or None
+        :param filenames: all the filenames captured
+        """
+        if jpeg is not None:
+            with open(jpeg, 'rb') as f:
+                self.set_image_bytes(f.read())
+            return
+        import pyexiv2
+        for fp in filenames:
+            meta = pyexiv2.ImageMetadata(fp)
+            meta.read()
+            if len(meta.previews):
+                self.set_image_bytes(meta.previews[-1].data)
+                return
+        self.logger.error("No jpeg or embedded preview to set the current image from.")
 
     @property
     def serial_number(self) -> str:
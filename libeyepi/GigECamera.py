@@ -1,51 +1,224 @@
+import time
+import logging.config
+from threading import Lock
 from .Camera import Camera
-import aravis
-import cv2
-# import numpy
-# import cv2
+from .LogQueue import configure_logging, get_camera_logger
+from PIL import Image
+import numpy
+
+configure_logging()
+
+try:
+    import gi
+    gi.require_version("Aravis", "0.8")
+    from gi.repository import Aravis
+except Exception as e:
+    logging.error("Couldnt import aravis module, no GigE Vision support: {}".format(str(e)))
+    pass
+
+try:
+    import cv2
+except Exception as e:
+    logging.error("Couldnt import opencv module, no bayer GigE support: {}".format(str(e)))
+    pass
+
+
 class GigECamera(Camera):
     """
-    Picamera extension to the Camera abstract class.
+    GigE Vision camera extension to the Camera abstract class, using Aravis.
+
+    The device is opened once and acquires continuously into a pool of stream buffers that are allocated and queued up
+    front. Capture and live view pop the newest filled buffer, use it and push it straight back to the stream, so
+    buffers are never reallocated.
+
+    Configuration keys:
+        - device_id: aravis device id, defaults to the first device found
+        - fake: use the aravis fake camera (for testing)
+        - exposure: exposure time in microseconds
+        - gain: gain in dB
+        - roi: [x, y, width, height]
+        - pixel_format: genicam pixel format name, eg. "Mono8", "RGB8" or "BayerRG8"
+        - frame_rate: acquisition frame rate in frames per second
+        - buffers: number of stream buffers in the pool
     """
 
+    # the statistics we report, as named by aravis stream infos
+    stream_counters = ["n_completed_buffers", "n_failures", "n_underruns", "n_timeouts",
+                       "n_missing_packets", "n_resend_requests", "n_resent_packets"]
 
-    def set_camera_settings(self, camera):
+    def __init__(self, config, **kwargs):
         """
-        Sets the camera resolution to the max resolution
+        Opens the camera, applies settings from the config and starts acquisition.
 
-        if the config provides camera/height or camera/width attempts to set the resolution to that.
-        if the config provides camera/isoattempts to set the iso to that.
-        if the config provides camera/shutter_speed to set the shutterspeed to that.
+        :param config: Configuration section for this camera.
+        :param kwargs:
+        """
+        identifier = config['filenameprefix']
+        self.logger = get_camera_logger(identifier, self.__class__.__name__)
+        self.device_lock = Lock()
+        self.camera = None
+        self.stream = None
+        if config.get("fake", False):
+            Aravis.enable_interface("Fake")
+        self.device_id = config.get("device_id", None)
+        super().__init__(config, **kwargs)
+        self.open()
 
-        :param picamera.PiCamera camera: picamera camera instance to modify
+    def open(self):
+        """
+        Opens the aravis device, applies the camera settings, allocates the buffer pool and starts acquisition.
+        """
+        self.camera = Aravis.Camera.new(self.device_id)
+        self.logger.info("Opened {} {} ({})".format(self.camera.get_vendor_name(),
+                                                    self.camera.get_model_name(),
+                                                    self.camera.get_device_id()))
+        self.set_camera_settings(self.camera)
+        self.camera.set_acquisition_mode(Aravis.AcquisitionMode.CONTINUOUS)
+
+        self.stream = self.camera.create_stream(None, None)
+        payload = self.camera.get_payload()
+        for _ in range(int(self.config.get("buffers", 8))):
+            self.stream.push_buffer(Aravis.Buffer.new_allocate(payload))
+        self.camera.start_acquisition()
+
+    def set_camera_settings(self, camera):
+        """
+        Sets the exposure, gain, region of interest, pixel format and frame rate from the config.
+
+        :param Aravis.Camera camera: aravis camera instance to modify
         """
         try:
-            camera.resolution = camera.MAX_RESOLUTION
-            if type(self.config) is dict:
-                if hasattr(self, "width") and hasattr(self, "height"):
-                    camera.resolution = (int(self.width),
-                                         int(self.height))
-                if "width" in self.config and "height" in self.config:
-                    camera.resolution = (int(self.config['width']),
-                                         int(self.config['height']))
-
-                camera.shutter_speed = getattr(self, "shutter_speed", camera.shutter_speed)
-                camera.iso = getattr(self, "iso", camera.iso)
+            if "pixel_format" in self.config:
+                camera.set_pixel_format_from_string(str(self.config["pixel_format"]))
+            if "roi" in self.config:
+                x, y, w, h = (int(v) for v in self.config["roi"])
+                camera.set_region(x, y, w, h)
+            if "exposure" in self.config:
+                camera.set_exposure_time_auto(Aravis.Auto.OFF)
+                camera.set_exposure_time(float(self.config["exposure"]))
+            if "gain" in self.config:
+                camera.set_gain_auto(Aravis.Auto.OFF)
+                camera.set_gain(float(self.config["gain"]))
+            camera.set_frame_rate(float(self.config.get("frame_rate", 1)))
+        except Exception as e:
+            self.logger.error("error setting aravis camera settings: {}".format(str(e)))
+
+    def _pop_newest(self, timeout: float):
+        """
+        Pops every buffer that is ready from the stream and pushes all but the newest successful one straight back.
+        If none are ready waits up to timeout seconds for one.
+        The caller must push the returned buffer back to the stream.
+
+        :param timeout: seconds to wait for a buffer
+        :return: the newest filled buffer, or None
+        """
+        newest = None
+        buffer = self.stream.try_pop_buffer()
+        if buffer is None:
+            buffer = self.stream.timeout_pop_buffer(int(timeout * 1e6))
+        while buffer is not None:
+            if buffer.get_status() == Aravis.BufferStatus.SUCCESS:
+                if newest is not None:
+                    self.stream.push_buffer(newest)
+                newest = buffer
             else:
-                if self.config.has_option("camera", "width") and self.config.has_option("camera", "height"):
-                    camera.resolution = (self.config.getint("camera", "width"),
-                                         self.config.getint("camera", "height"))
-                if self.config.has_option("camera", "shutter_speed"):
-                    camera.shutter_speed = self.config.getfloat("camera", "shutter_speed")
-                if self.config.has_option("camera", "iso"):
-                    camera.iso = self.config.getint("camera", "iso")
+                self.logger.debug("Discarding buffer with status {}".format(buffer.get_status()))
+                self.stream.push_buffer(buffer)
+            buffer = self.stream.try_pop_buffer()
+        return newest
+
+    def _buffer_to_image(self, buffer) -> Image:
+        """
+        Converts a filled aravis buffer to an image.
+        The buffer data is wrapped with :func:`numpy.frombuffer`, the only copy made is into the PIL image.
+
+        :param buffer: aravis buffer
+        :return: image
+        :rtype: PIL.Image
+        """
+        width, height = buffer.get_image_width(), buffer.get_image_height()
+        pixel_format = buffer.get_image_pixel_format()
+        data = numpy.frombuffer(buffer.get_data(), dtype=numpy.uint8)
+        if pixel_format == Aravis.PIXEL_FORMAT_MONO_8:
+            return Image.fromarray(data[:width * height].reshape(height, width), "L")
+        if pixel_format == Aravis.PIXEL_FORMAT_RGB_8_PACKED:
+            return Image.fromarray(data[:width * height * 3].reshape(height, width, 3), "RGB")
+        bayer = {
+            Aravis.PIXEL_FORMAT_BAYER_RG_8: "COLOR_BayerBG2RGB",
+            Aravis.PIXEL_FORMAT_BAYER_GR_8: "COLOR_BayerGB2RGB",
+            Aravis.PIXEL_FORMAT_BAYER_GB_8: "COLOR_BayerGR2RGB",
+            Aravis.PIXEL_FORMAT_BAYER_BG_8: "COLOR_BayerRG2RGB",
+        }
+        if pixel_format in bayer:
+            # opencv names bayer patterns from the second row, hence the swapped names.
+            code = getattr(cv2, bayer[pixel_format])
+            return Image.fromarray(cv2.cvtColor(data[:width * height].reshape(height, width), code))
+        raise ValueError("Unsupported pixel format 0x{:08x}".format(pixel_format))
+
+    def grab(self, timeout: float = 5) -> Image:
+        """
+        Gets an image from the newest buffer in the stream and returns the buffer to the pool.
+
+        :param timeout: seconds to wait for a buffer
+        :return: image or None
+        :rtype: PIL.Image
+        """
+        with self.device_lock:
+            buffer = self._pop_newest(timeout)
+            if buffer is None:
+                return None
+            try:
+                return self._buffer_to_image(buffer)
+            finally:
+                self.stream.push_buffer(buffer)
+
+    def get_frame(self) -> bytes:
+        """
+        Gets a live view frame from the acquisition stream.
+
+        :return: encoded image data as bytes.
+        """
+        img = self.grab(timeout=1)
+        if img is None:
+            return None
+        return self.encoder.encode(img, "jpg").getvalue()
+
+    def get_telemetry(self) -> dict:
+        """
+        Gets the stream packet loss and resend counters.
+
+        :return: telemetry fields
+        :rtype: dict
+        """
+        telemetry = dict()
+        try:
+            for idx in range(self.stream.get_n_infos()):
+                name = self.stream.get_info_name(idx)
+                if name in GigECamera.stream_counters:
+                    telemetry["gige_{}".format(name)] = int(self.stream.get_info_uint64(idx))
+        except AttributeError:
+            # older aravis only has the basic statistics
+            completed, failures, underruns = self.stream.get_statistics()
+            telemetry.update(gige_n_completed_buffers=int(completed),
+                             gige_n_failures=int(failures),
+                             gige_n_underruns=int(underruns))
         except Exception as e:
-            self.logger.error("error setting picamera settings: {}".format(str(e)))
+            self.logger.error("Couldnt get stream statistics: {}".format(str(e)))
+        return telemetry
+
+    def stop(self):
+        """
+        Stops acquisition, the camera thread and its background workers.
+        """
+        try:
+            self.camera.stop_acquisition()
+        except Exception as e:
+            self.logger.error("Couldnt stop acquisition {}".format(str(e)))
+        super().stop()
 
     def capture_image(self, filename: str = None):
         """
-        Captures image using the Raspberry Pi Camera Module, at either max resolution, or resolution
-        specified in the config file.
+        Captures an image from the newest buffer in the acquisition stream.
 
         Writes images disk using :func:`encode_write_image`, so it should write out to all supported image formats
         automatically.
@@ -56,23 +229,18 @@ class GigECamera(Camera):
         """
         st = time.time()
         try:
-            with picamera.PiCamera() as camera:
-                with picamera.array.PiRGBArray(camera) as output:
-                    time.sleep(2)  # Camera warm-up time
-                    self.set_camera_settings(camera)
-                    time.sleep(0.2)
-                    # self._image = numpy.empty((camera.resolution[1], camera.resolution[0], 3), dtype=numpy.uint8)
-                    camera.capture(output, 'rgb')
-                    # self._image = output.array
-                    self._image = Image.fromarray(output.array)
-                    # self._image = cv2.cvtColor(self._image, cv2.COLOR_BGR2RGB)
+            img = self.grab(timeout=float(self.config.get("frame_timeout", 5)))
+            if img is None:
+                self.logger.error("No buffer from the stream in time.")
+                return None
+            self._image = img
             if filename:
                 filenames = self.encode_write_image(self._image, filename)
                 self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
                 return filenames
             else:
                 self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
+                return self._image
         except Exception as e:
-            self.logger.critical("EPIC FAIL, trying other method. {}".format(str(e)))
-            return None
+            self.logger.critical("EPIC FAIL, aravis capture failed. {}".format(str(e)))
         return None
@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import socket
+import time
+from threading import Thread, Event, Lock
+
+VERSION = 1
+# keep datagrams under a typical mtu so they arent fragmented, cameras are split over several datagrams past this.
+MAX_DATAGRAM = 1400
+
+
+class HeartbeatSender(Thread):
+    """
+    Sends a compact heartbeat of every camera on this node over udp, for :class:`HeartbeatIndex` to collect.
+
+    Each datagram is a json object::
+
+        {"v": 1, "node": hostname, "seq": n, "up": uptime seconds, "part": [i, n], "cams": [camera heartbeats]}
+
+    see :func:`Camera.heartbeat` for the camera fields. Sending never blocks capturing, if the aggregator is down the
+    datagrams are just lost.
+    """
+
+    def __init__(self, get_cameras, host: str, port: int = 8094, period: float = 30, node: str = None):
+        """
+        :param get_cameras: callable that returns the current camera objects, they are recreated on usb changes.
+        :param host: aggregator host
+        :param port: aggregator udp port
+        :param period: seconds between heartbeats
+        :param node: node name, defaults to the hostname
+        """
+        super().__init__(name="HeartbeatSender")
+        self.daemon = True
+        self.logger = logging.getLogger(self.name)
+        self.get_cameras = get_cameras
+        self.address = (host, int(port))
+        self.period = period
+        self.node = node or socket.gethostname()
+        self.seq = 0
+        self.started = time.time()
+        self.stopper = Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def datagrams(self) -> list:
+        """
+        Builds the datagrams for one heartbeat.
+
+        :return: encoded datagrams
+        :rtype: list(bytes)
+        """
+        self.seq += 1
+        head = json.dumps({"v": VERSION, "node": self.node, "seq": self.seq, "up": int(time.time() - self.started)},
+                          separators=(",", ":"))[:-1]
+        # room for the part counter and brackets
+        overhead = len(head) + 32
+        parts = [[]]
+        size = overhead
+        for camera in self.get_cameras():
+            try:
+                cam = json.dumps(camera.heartbeat, separators=(",", ":"))
+            except Exception as e:
+                self.logger.error("Couldnt get heartbeat of {}: {}".format(camera.identifier, str(e)))
+                continue
+            if parts[-1] and size + len(cam) + 1 > MAX_DATAGRAM:
+                parts.append([])
+                size = overhead
+            parts[-1].append(cam)
+            size += len(cam) + 1
+        return [('{},"part":[{},{}],"cams":[{}]}}'.format(head, i, len(parts), ",".join(cams))).encode("utf-8")
+                for i, cams in enumerate(parts)]
+
+    def send(self):
+        """
+        Sends one heartbeat.
+        """
+        for datagram in self.datagrams():
+            try:
+                self.sock.sendto(datagram, self.address)
+            except OSError as e:
+                self.logger.debug("Couldnt send heartbeat to {}:{}: {}".format(*self.address, str(e)))
+
+    def run(self):
+        while not self.stopper.is_set():
+            try:
+                self.send()
+            except Exception as e:
+                self.logger.error("Heartbeat failed: {}".format(str(e)))
+            self.stopper.wait(self.period)
+
+    def stop(self):
+        self.stopper.set()
+        self.sock.close()
+
+
+class HeartbeatIndex(object):
+    """
+    In memory index of the latest heartbeat of every node and camera, with staleness alerts.
+
+    A node is stale when nothing has been heard from it for node_timeout seconds. A camera is stale when its last
+    capture is older than stale_intervals of its capture intervals (as of when the heartbeat was received, so the
+    clocks of the nodes dont matter), when its capture thread has died or when the watchdog on the node has flagged it.
+    Alerts are logged when a node or camera goes stale and when it comes back, not on every check.
+    """
+
+    def __init__(self, node_timeout: float = 90, stale_intervals: float = 3, logger: logging.Logger = None):
+        """
+        :param node_timeout: seconds without a heartbeat before a node is stale
+        :param stale_intervals: capture intervals without a capture before a camera is stale
+        :param logger: logger to alert on
+        """
+        self.node_timeout = node_timeout
+        self.stale_intervals = stale_intervals
+        self.logger = logger or logging.getLogger("HeartbeatIndex")
+        self.nodes = dict()
+        self.cameras = dict()
+        self.stale = set()
+        self.last_check = dict()
+        self.received = 0
+        self.invalid = 0
+        self._lock = Lock()
+        # checks are serialised so that each transition is alerted on exactly once.
+        self._check_lock = Lock()
+
+    def ingest(self, data: bytes, address: tuple = None, now: float = None) -> bool:
+        """
+        Adds a heartbeat datagram to the index.
+
+        :param data: datagram
+        :param address: address it came from
+        :param now: time it was received, defaults to now
+        :return: whether it was a valid heartbeat
+        :rtype: bool
+        """
+        now = time.time() if now is None else now
+        try:
+            beat = json.loads(data)
+            if beat.get("v") != VERSION:
+                raise ValueError("version {}".format(beat.get("v")))
+            node = str(beat["node"])
+            cams = beat["cams"]
+            if not isinstance(cams, list) or not all(isinstance(cam, dict) for cam in cams):
+                raise ValueError("cams isnt a list of cameras")
+            for cam in cams:
+                # camera ids are index keys, so they have to be hashable.
+                hash(cam.get("id"))
+        except Exception:
+            self.invalid += 1
+            return False
+        with self._lock:
+            self.received += 1
+            self.nodes[node] = {"received": now, "seq": beat.get("seq"), "up": beat.get("up"),
+                                "address": address[0] if address else None}
+            for cam in cams:
+                self.cameras[(node, cam.get("id"))] = (now, cam)
+        return True
+
+    def camera_stale(self, received: float, cam: dict, now: float) -> str:
+        """
+        Gets why a camera is stale.
+
+        :param received: when its latest heartbeat was received
+        :param cam: its latest heartbeat
+        :param now: time to check at
+        :return: reason, or None if it isnt stale
+        :rtype: str
+        """
+        if not cam.get("en", True):
+            return None
+        if not cam.get("alive", True):
+            return "capture thread is dead"
+        if cam.get("wd"):
+            return "flagged by the watchdog, {} missed captures".format(cam.get("miss"))
+        age, interval = cam.get("age"), cam.get("int")
+        # anything else in a heartbeat from a misbehaving node isnt something to judge staleness by.
+        if not isinstance(age, (int, float)) or not isinstance(interval, (int, float)):
+            return None
+        age += now - received
+        if interval and age > self.stale_intervals * interval:
+            return "no capture for {:.0f}s".format(age)
+        return None
+
+    def check(self, now: float = None) -> dict:
+        """
+        Checks everything in the index for staleness, alerting on changes. The result is also kept in
+        :attr:`last_check`.
+
+        :param now: time to check at, defaults to now
+        :return: stale nodes and cameras (as node/camera) and why
+        :rtype: dict
+        """
+        with self._check_lock:
+            now = time.time() if now is None else now
+            stale = dict()
+            with self._lock:
+                nodes = list(self.nodes.items())
+                cameras = list(self.cameras.items())
+            for node, info in nodes:
+                if now - info["received"] > self.node_timeout:
+                    stale[node] = "no heartbeat for {:.0f}s".format(now - info["received"])
+            for (node, identifier), (received, cam) in cameras:
+                if node in stale:
+                    continue
+                reason = self.camera_stale(received, cam, now)
+                if reason:
+                    stale["{}/{}".format(node, identifier)] = reason
+            for key in set(stale) - self.stale:
+                self.logger.critical("{} is stale: {}".format(key, stale[key]))
+            for key in self.stale - set(stale):
+                self.logger.warning("{} is back".format(key))
+            self.stale = set(stale)
+            self.last_check = stale
+            return stale
+
+    def forget(self, node: str):
+        """
+        Removes a node and its cameras from the index, eg. when it has been decommissioned.
+
+        :param node: node name
+        """
+        with self._lock:
+            self.nodes.pop(node, None)
+            for key in [k for k in self.cameras if k[0] == node]:
+                del self.cameras[key]
+
+    def summary(self) -> dict:
+        """
+        Gets the whole index as a json serialisable dict.
+
+        :rtype: dict
+        """
+        with self._lock:
+            nodes = {node: dict(info, cameras=dict()) for node, info in self.nodes.items()}
+            for (node, identifier), (received, cam) in self.cameras.items():
+                if node in nodes:
+                    nodes[node]["cameras"][identifier] = dict(cam, received=received)
+        return {"nodes": nodes, "stale": sorted(self.stale), "received": self.received, "invalid": self.invalid}
+
+
+class HeartbeatReceiver(Thread):
+    """
+    Receives heartbeat datagrams into a :class:`HeartbeatIndex`.
+    """
+
+    def __init__(self, index: HeartbeatIndex, bind: str = "0.0.0.0", port: int = 8094):
+        """
+        :param index: index to add heartbeats to
+        :param bind: address to listen on
+        :param port: udp port to listen on
+        """
+        super().__init__(name="HeartbeatReceiver")
+        self.daemon = True
+        self.logger = logging.getLogger(self.name)
+        self.index = index
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # room for bursts while the index is locked for a check.
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
+        self.sock.bind((bind, int(port)))
+        self.sock.settimeout(1)
+        self.address = self.sock.getsockname()
+        self.stopper = Event()
+
+    def run(self):
+        while not self.stopper.is_set():
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                self.index.ingest(data, address)
+            except Exception as e:
+                # one bad datagram mustnt stop the receiver.
+                self.index.invalid += 1
+                self.logger.error("Couldnt ingest heartbeat from {}: {}".format(address[0], str(e)))
+
+    def stop(self):
+        self.stopper.set()
+        self.sock.close()
+
+
+def disk_headroom(path: str) -> tuple:
+    """
+    Gets the free space of the filesystem a path is on.
+
+    :param path: path
+    :return: free bytes and the free fraction
+    :rtype: tuple(int, float)
+    """
+    st = os.statvfs(path)
+    free = st.f_bavail * st.f_frsize
+    total = st.f_blocks * st.f_frsize
+    return free, (free / total if total else 0.0)
@@ -0,0 +1,185 @@
+import atexit
+import logging
+import logging.config
+import queue
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+
+_lock = Lock()
+_listener = None
+_loaded = False
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Deduplicates repeated warnings and errors.
+
+    The first occurrence of a message from a logger is let through, repeats within `window` seconds are dropped, and the
+    first repeat after the window has passed is let through with the number of repeats that were dropped.
+
+    Only records at `level` or above are deduplicated, so routine per capture messages always get through. Records can
+    opt in or out with `extra={"rate_limit": True}` or `extra={"rate_limit": False}`.
+    """
+
+    def __init__(self, window: float = 60, max_keys: int = 1024, level: int = logging.WARNING):
+        """
+        :param window: seconds to suppress repeats of a message for
+        :param max_keys: number of distinct messages to remember
+        :param level: lowest level to deduplicate
+        """
+        super().__init__()
+        self.window = window
+        self.level = level
+        self.max_keys = max_keys
+        self._seen = OrderedDict()
+        self._lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "rate_limit", record.levelno >= self.level):
+            return True
+        message = record.getMessage()
+        key = (record.name, record.levelno, message)
+        now = time.time()
+        with self._lock:
+            first, suppressed = self._seen.get(key, (None, 0))
+            if first is not None and now - first < self.window:
+                self._seen[key] = (first, suppressed + 1)
+                return False
+            self._seen[key] = (now, 0)
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_keys:
+                self._seen.popitem(last=False)
+        if suppressed:
+            record.msg = "{} [repeated {} times]".format(message, suppressed)
+            record.args = None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Samples verbose output.
+
+    Records logged with `extra={"sample": n}` are only let through once every n records per logger, so very verbose
+    output (like each line of gphoto2 output) still shows up in the log without flooding it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._counts = dict()
+        self._lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample", None)
+        if not every or every <= 1:
+            return True
+        with self._lock:
+            count = self._counts.get(record.name, 0)
+            self._counts[record.name] = count + 1
+        return count % int(every) == 0
+
+
+class ContextDefaultsFilter(logging.Filter):
+    """
+    Sets the camera level fields on records that weren't logged through a :class:`CameraLoggerAdapter`, so that
+    formatters can always use %(camera)s and %(camera_type)s.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "camera"):
+            record.camera = "-"
+        if not hasattr(record, "camera_type"):
+            record.camera_type = "-"
+        return True
+
+
+class CameraLoggerAdapter(logging.LoggerAdapter):
+    """
+    Logger adapter that adds camera level fields to every record, merged with any extra given to the log call.
+    """
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = dict(self.extra, **kwargs.get("extra", dict()))
+        return msg, kwargs
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records when the queue is full instead of blocking or erroring, so the threads
+    logging never wait on log i/o.
+    """
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def get_camera_logger(identifier: str, camera_type: str = None) -> CameraLoggerAdapter:
+    """
+    Gets a logger for a camera, that adds the camera identifier and type to its records.
+
+    :param identifier: camera identifier, also the logger name
+    :param camera_type: camera class name
+    :return: logger adapter
+    :rtype: CameraLoggerAdapter
+    """
+    return CameraLoggerAdapter(logging.getLogger(identifier), dict(camera=identifier, camera_type=camera_type or "-"))
+
+
+def configure_logging(path: str = "/etc/eyepi/logging.ini", queue_size: int = 10000) -> bool:
+    """
+    Configures logging from a logging config file, then moves the configured root handlers behind a queue.
+
+    Records are put on the queue by a :class:`DroppingQueueHandler` (after rate limiting and sampling) and the file and
+    syslog handlers are run by a :class:`logging.handlers.QueueListener` thread.
+    Safe to call many times, once the config file has been loaded later calls do nothing.
+
+    :param path: path to the logging config file
+    :param queue_size: maximum number of records waiting to be written
+    :return: whether the config file has been loaded
+    :rtype: bool
+    """
+    global _listener, _loaded
+    with _lock:
+        if _loaded:
+            return True
+        try:
+            logging.config.fileConfig(path, disable_existing_loggers=False)
+            _loaded = True
+        except Exception:
+            if _listener is not None:
+                return False
+
+        root = logging.getLogger()
+        handlers = [h for h in root.handlers if not isinstance(h, QueueHandler)]
+        if not len(handlers):
+            return _loaded
+        if _listener is not None:
+            _listener.stop()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(ContextDefaultsFilter())
+        queue_handler.addFilter(SamplingFilter())
+        queue_handler.addFilter(RateLimitFilter())
+        root.addHandler(queue_handler)
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        return _loaded
+
+
+@atexit.register
+def _stop_listener():
+    """
+    flushes the queued records on exit.
+    """
+    if _listener is not None:
+        _listener.stop()
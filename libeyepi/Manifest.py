@@ -0,0 +1,220 @@
+import datetime
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+
+timestamp_re = re.compile(r"(\d{4}_\d{2}_\d{2}_\d{2}_\d{2}_\d{2})")
+# previews, thumbnails, exposure brackets and region of interest crops written next to captures, these arent captures
+# themselves.
+derivative_re = re.compile(r"_(preview|\d+px|ev[+-][\d.]+|roi-[\w-]+)$")
+# when a capture was written in several output types, the first of these that exists is the source.
+source_preference = ["tif", "tiff", "png", "ppm", "webp", "jpg", "jpeg"]
+
+
+class Manifest(object):
+    """
+    Per hour checksum manifest, computed while files are moved into the hour directory so they are never re-read.
+
+    The manifest sits next to the hour directory (YYYY_mm_dd_HH.sha256sums) and uses the same format as sha256sum/b2sum,
+    so it can also be checked with `sha256sum -c` from inside the hour directory. It isn't inside the hour directory so
+    that it survives the hour being packed by :class:`libeyepi.ArchivePacker.ArchivePacker`.
+    """
+
+    algorithms = {
+        "sha256": hashlib.sha256,
+        "blake2b": hashlib.blake2b,
+    }
+    chunk_size = 1024 * 1024
+
+    def __init__(self, hour_dir: str, algorithm: str = "sha256"):
+        """
+        :param hour_dir: hour directory the manifest is for
+        :param algorithm: "sha256" or "blake2b"
+        """
+        if algorithm not in Manifest.algorithms:
+            raise ValueError("Unknown checksum algorithm {}".format(algorithm))
+        self.hour_dir = hour_dir.rstrip(os.sep)
+        self.algorithm = algorithm
+        self.path = "{}.{}sums".format(self.hour_dir, algorithm)
+
+    @classmethod
+    def from_path(cls, path: str):
+        """
+        Gets the manifest for an existing manifest file.
+
+        :param path: path to a .sha256sums or .blake2bsums file
+        :return: manifest
+        :rtype: Manifest
+        """
+        base, ext = os.path.splitext(path)
+        return cls(base, ext.lstrip(".")[:-len("sums")])
+
+    def new_hash(self):
+        return Manifest.algorithms[self.algorithm]()
+
+    def record(self, name: str, digest: str):
+        """
+        Appends an entry to the manifest.
+
+        :param name: file name within the hour directory
+        :param digest: hex digest of the file
+        """
+        with open(self.path, "a") as f:
+            f.write("{}  {}\n".format(digest, name))
+
+    def hash_file(self, fn: str) -> str:
+        """
+        Hashes a file through a memory map.
+
+        :param fn: file to hash
+        :return: hex digest
+        :rtype: str
+        """
+        h = self.new_hash()
+        with open(fn, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    h.update(mm)
+        return h.hexdigest()
+
+    def add(self, fn: str) -> str:
+        """
+        Hashes a file that was written into the hour directory and records it.
+
+        :param fn: file in the hour directory
+        :return: hex digest
+        :rtype: str
+        """
+        digest = self.hash_file(fn)
+        self.record(os.path.basename(fn), digest)
+        return digest
+
+    def move(self, src: str) -> str:
+        """
+        Moves a file into the hour directory, hashing it on the way and recording it in the manifest.
+
+        Across filesystems the file is copied in chunks that are hashed as they are written. On the same filesystem the
+        file is hashed from the page cache (it was only just written) and renamed.
+
+        :param src: file to move
+        :return: path of the moved file
+        :rtype: str
+        """
+        os.makedirs(self.hour_dir, exist_ok=True)
+        dst = os.path.join(self.hour_dir, os.path.basename(src))
+        if os.stat(src).st_dev == os.stat(self.hour_dir).st_dev:
+            digest = self.hash_file(src)
+            os.replace(src, dst)
+        else:
+            h = self.new_hash()
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                for chunk in iter(lambda: fsrc.read(Manifest.chunk_size), b""):
+                    h.update(chunk)
+                    fdst.write(chunk)
+            os.remove(src)
+            digest = h.hexdigest()
+        self.record(os.path.basename(dst), digest)
+        return dst
+
+    def entries(self) -> list:
+        """
+        Reads the entries of the manifest, later entries for the same name replace earlier ones.
+
+        :return: list of (name, digest)
+        :rtype: list(tuple)
+        """
+        entries = dict()
+        with open(self.path) as f:
+            for line in f:
+                digest, _, name = line.rstrip("\n").partition("  ")
+                if name:
+                    entries[name] = digest
+        return sorted(entries.items())
+
+    def verify(self) -> dict:
+        """
+        Verifies every entry of the manifest against the hour directory, or the packed archive if it has been packed.
+        Files are read through memory maps, an archive is mapped once and each member hashed from a slice of it.
+
+        :return: dict of name to "ok", "failed" or "missing"
+        :rtype: dict
+        """
+        results = dict()
+        archive, members, mm, f = None, dict(), None, None
+        for ext in ("tar", "zip"):
+            if os.path.isfile("{}.{}.json".format(self.hour_dir, ext)):
+                archive = "{}.{}".format(self.hour_dir, ext)
+                with open(archive + ".json") as jf:
+                    members = json.load(jf)["members"]
+                f = open(archive, "rb")
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                break
+        try:
+            for name, digest in self.entries():
+                fn = os.path.join(self.hour_dir, name)
+                if os.path.isfile(fn):
+                    actual = self.hash_file(fn)
+                elif name in members:
+                    h = self.new_hash()
+                    member = members[name]
+                    view = memoryview(mm)[member["offset"]:member["offset"] + member["size"]]
+                    try:
+                        h.update(view)
+                    finally:
+                        view.release()
+                    actual = h.hexdigest()
+                else:
+                    results[name] = "missing"
+                    continue
+                results[name] = "ok" if actual == digest else "failed"
+        finally:
+            if mm is not None:
+                mm.close()
+                f.close()
+        return results
+
+
+def find_manifests(path: str) -> list:
+    """
+    Finds every manifest under a directory.
+
+    :param path: directory to search, eg. a camera output directory
+    :return: list of manifest paths
+    :rtype: list(str)
+    """
+    if os.path.isfile(path):
+        return [path]
+    manifests = []
+    for algorithm in Manifest.algorithms:
+        manifests.extend(glob.glob(os.path.join(path, "**", "*.{}sums".format(algorithm)), recursive=True))
+    return sorted(manifests)
+
+
+def archived_captures(path: str, packed: list = None) -> list:
+    """
+    Finds the captures under a directory, keeping one source file per capture.
+
+    :param path: directory to search, eg. a camera output directory
+    :param packed: list to add the archives of packed hours to, their captures arent found
+    :return: list of (capture time, filename), in capture order
+    :rtype: list(tuple(datetime.datetime, str))
+    """
+    captures = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        stems = dict()
+        for fn in files:
+            if packed is not None and (fn.endswith(".tar.json") or fn.endswith(".zip.json")):
+                packed.append(os.path.join(root, fn[:-len(".json")]))
+            stem, ext = os.path.splitext(fn)
+            ext = ext.lstrip(".").lower()
+            m = timestamp_re.search(stem)
+            if ext in source_preference and m and not derivative_re.search(stem):
+                stems.setdefault(stem, []).append((source_preference.index(ext), fn, m.group(1)))
+        for fns in stems.values():
+            _, fn, ts = min(fns)
+            captures.append((datetime.datetime.strptime(ts, "%Y_%m_%d_%H_%M_%S"), os.path.join(root, fn)))
+    return sorted(captures)
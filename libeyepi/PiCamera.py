@@ -1,6 +1,7 @@
 
 import logging.config
 from .Camera import Camera
+from .LogQueue import configure_logging, get_camera_logger
 import time
 from io import BytesIO
 from PIL import Image
@@ -8,10 +9,7 @@ from dateutil import zoneinfo
 
 timezone = zoneinfo.get_zonefile_instance().get("Australia/Canberra")
 
-try:
-    logging.config.fileConfig("/etc/eyepi/logging.ini")
-except:
-    pass
+configure_logging()
 
 try:
     import picamera
@@ -35,38 +33,46 @@ class PiCamera(Camera):
 
         :func:`time.sleep` added to rate limit a little bit.
 
+        The camera is held from :func:`Camera.arbiter` and closed whenever a capture preempts the stream, the stream
+        picks up again once the capture is done.
         """
         import picamera
         print("start thread")
-        try:
-            with picamera.PiCamera() as camera:
-                # camera setup
-                camera.resolution = (640, 480)
-                # camera.hflip = True
-                # camera.vflip = True
-
-                # let camera warm up
-                camera.start_preview()
-                time.sleep(2)
-
-                stream = BytesIO()
-                for foo in camera.capture_continuous(stream, 'jpeg',
-                                                     use_video_port=True):
-                    # store frame
-                    stream.seek(0)
-                    cls._frame = stream.read()
-
-                    # reset stream for next frame
-                    stream.seek(0)
-                    stream.truncate()
-
-                    # if there hasn't been any clients asking for frames in
-                    # the last 10 seconds stop the thread
-                    time.sleep(0.01)
-                    if time.time() - cls._last_access > 1:
-                        break
-        except Exception as e:
-            print("Couldnt acquire camera")
+        arbiter = cls.arbiter()
+        # if there hasn't been any clients asking for frames in the last second stop the thread
+        while time.time() - cls._last_access <= 1:
+            if not arbiter.acquire("live_view", timeout=1):
+                continue
+            try:
+                with picamera.PiCamera() as camera:
+                    # camera setup
+                    camera.resolution = (640, 480)
+                    # camera.hflip = True
+                    # camera.vflip = True
+
+                    # let camera warm up
+                    camera.start_preview()
+                    time.sleep(2)
+
+                    stream = BytesIO()
+                    for foo in camera.capture_continuous(stream, 'jpeg',
+                                                         use_video_port=True):
+                        # store frame
+                        stream.seek(0)
+                        cls._frame = stream.read()
+
+                        # reset stream for next frame
+                        stream.seek(0)
+                        stream.truncate()
+
+                        time.sleep(0.01)
+                        if arbiter.preempted or time.time() - cls._last_access > 1:
+                            break
+            except Exception as e:
+                print("Couldnt acquire camera")
+                time.sleep(1)
+            finally:
+                arbiter.release("live_view")
         print("Closing Thread")
         cls._thread = None
 
@@ -90,6 +96,8 @@ class PiCamera(Camera):
                     camera.resolution = (int(self.config['width']),
                                          int(self.config['height']))
 
+                if getattr(self, "exposure_bias", 0):
+                    camera.exposure_compensation = int(round(self.exposure_bias * 6))
                 camera.shutter_speed = getattr(self, "shutter_speed", camera.shutter_speed)
                 camera.iso = getattr(self, "iso", camera.iso)
             else:
@@ -103,6 +111,20 @@ class PiCamera(Camera):
         except Exception as e:
             self.logger.error("error setting picamera settings: {}".format(str(e)))
 
+    def set_exposure_bias(self, ev: float) -> bool:
+        """
+        Sets the exposure compensation the next captures are taken with, in the 1/6 stop steps picamera uses.
+
+        :param ev: exposure bias in stops, -4 1/6 to +4 1/6
+        :return: whether the bias is in range
+        :rtype: bool
+        """
+        if abs(ev * 6) > 25:
+            self.logger.error("Exposure bias {:+g}ev is out of range".format(ev))
+            return False
+        self.exposure_bias = ev
+        return True
+
     def capture_image(self, filename: str = None):
         """
         Captures image using the Raspberry Pi Camera Module, at either max resolution, or resolution
@@ -111,10 +133,14 @@ class PiCamera(Camera):
         Writes images disk using :func:`encode_write_image`, so it should write out to all supported image formats
         automatically.
 
+        In passthrough mode the jpeg from the gpu encoder is written to disk as is by :func:`write_passthrough`.
+
         :param filename: image filename without extension
         :return: :func:`numpy.array` if filename not specified, otherwise list of files.
         :rtype: numpy.array
         """
+        if self.passthrough:
+            return self._capture_passthrough(filename)
         st = time.time()
         try:
             with picamera.PiCamera() as camera:
@@ -137,3 +163,31 @@ class PiCamera(Camera):
             self.logger.critical("EPIC FAIL, trying other method. {}".format(str(e)))
             return None
         return None
+
+    def _capture_passthrough(self, filename: str = None):
+        """
+        Captures a jpeg from the gpu encoder of the Raspberry Pi Camera Module into a :class:`io.BytesIO`.
+        The encoded data is never decoded here, :attr:`_image` is only opened lazily from it.
+
+        :param filename: image filename without extension
+        :return: list of files if filename specified.
+        :rtype: list(str)
+        """
+        st = time.time()
+        try:
+            stream = BytesIO()
+            with picamera.PiCamera() as camera:
+                time.sleep(2)  # Camera warm-up time
+                self.set_camera_settings(camera)
+                time.sleep(0.2)
+                if "jpeg_quality" in self.config:
+                    camera.capture(stream, 'jpeg', quality=self.encoder.jpeg_quality)
+                else:
+                    camera.capture(stream, 'jpeg')
+            self.set_image_bytes(stream.getvalue())
+            self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
+            if filename:
+                return self.write_passthrough(stream, filename, "jpg")
+        except Exception as e:
+            self.logger.critical("EPIC FAIL, passthrough capture failed. {}".format(str(e)))
+        return None
@@ -0,0 +1,263 @@
+"""
+Per capture analysis plugins.
+
+A plugin is a function that takes the path of a stored capture and a metadata dict, and returns a json serialisable dict
+of results::
+
+    def leaf_area(image_path: str, metadata: dict) -> dict:
+        ...
+        return {"leaf_area_px": area}
+
+Plugins are registered as entry points in the "eyepi.plugins" group, eg. in setup.py::
+
+    entry_points={"eyepi.plugins": ["leaf_area = mypackage.analysis:leaf_area"]}
+
+or named in the plugins list of a camera config as "module:function".
+"""
+
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import time
+from threading import Thread, Event, Semaphore, Lock
+
+ENTRY_POINT_GROUP = "eyepi.plugins"
+
+
+def installed_plugins() -> dict:
+    """
+    Gets the plugins registered as entry points.
+
+    :return: dict of plugin name to "module:function"
+    :rtype: dict
+    """
+    try:
+        from importlib.metadata import entry_points
+        eps = entry_points()
+        eps = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, "select") else eps.get(ENTRY_POINT_GROUP, [])
+        return {ep.name: ep.value for ep in eps}
+    except Exception as e:
+        logging.getLogger(__name__).error("Couldnt read installed plugins: {}".format(str(e)))
+    return dict()
+
+
+def load_plugin(target: str):
+    """
+    Imports a plugin function.
+
+    :param target: "module:function"
+    :return: the plugin function
+    """
+    module_name, _, attr = target.partition(":")
+    obj = importlib.import_module(module_name)
+    for part in attr.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _run_plugin(target: str, image_path: str, metadata: dict, cpu_seconds: int, memory_mb: int, conn):
+    """
+    Runs a plugin in a child process with resource limits, sending the result or error back through a pipe.
+    """
+    try:
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds) + 1))
+        if memory_mb:
+            resource.setrlimit(resource.RLIMIT_AS, (int(memory_mb) * 1024 * 1024,) * 2)
+        os.nice(10)
+        result = load_plugin(target)(image_path, metadata)
+        conn.send(("ok", json.loads(json.dumps(result or dict(), default=str))))
+    except BaseException as e:
+        conn.send(("error", "{}: {}".format(e.__class__.__name__, str(e))))
+    finally:
+        conn.close()
+
+
+class PluginRunner(Thread):
+    """
+    Runs analysis plugins on each capture in separate processes, so a slow or crashing plugin never holds up capturing.
+
+    Captures are handed over through a bounded queue (they are dropped if it is full). Each plugin runs in its own
+    process from a forkserver, at most max_workers at a time, with a wall clock timeout and cpu time (RLIMIT_CPU) and
+    memory (RLIMIT_AS) limits. Results are written next to the capture as <name>.<plugin>.json and passed to a callback,
+    eg. to go into telemetry.
+    """
+
+    def __init__(self, plugins: dict, max_workers: int = 2, timeout: float = 60, cpu_seconds: int = 30,
+                 memory_mb: int = None, queue_size: int = 16, on_result=None, logger: logging.Logger = None):
+        """
+        :param plugins: dict of plugin name to "module:function"
+        :param max_workers: most plugin processes to run at once
+        :param timeout: wall clock seconds before a plugin process is killed
+        :param cpu_seconds: cpu seconds a plugin process may use
+        :param memory_mb: address space limit for plugin processes, None for no limit
+        :param queue_size: captures that can wait to be analysed
+        :param on_result: called with (metadata, plugin name, result dict) for each successful result
+        :param logger: logger to use
+        """
+        super().__init__(name="PluginRunner")
+        self.daemon = True
+        self.plugins = plugins
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.on_result = on_result
+        self.logger = logger or logging.getLogger(__name__)
+        self.captures = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.failures = dict()
+        self.stopper = Event()
+        self._slots = Semaphore(max_workers)
+        self._pending = dict()
+        self._pending_lock = Lock()
+        try:
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload([target.partition(":")[0] for target in plugins.values()])
+        except ValueError:
+            self._context = multiprocessing.get_context()
+
+    @classmethod
+    def from_config(cls, config: dict, **kwargs):
+        """
+        Creates a runner for the plugins enabled in a camera config: the plugins list if it is set (entry point names
+        or "module:function"), otherwise every installed plugin.
+
+        :param config: camera config
+        :return: runner, or None if there are no plugins
+        :rtype: PluginRunner
+        """
+        installed = installed_plugins()
+        names = config.get("plugins", None)
+        if names is None:
+            plugins = installed
+        else:
+            plugins = dict()
+            for name in names:
+                if ":" in name:
+                    plugins[name.rpartition(":")[2]] = name
+                elif name in installed:
+                    plugins[name] = installed[name]
+                else:
+                    logging.getLogger(__name__).error("Plugin {} isnt installed".format(name))
+        if not plugins:
+            return None
+        memory_mb = config.get("plugin_memory_mb", None)
+        return cls(plugins,
+                   max_workers=int(config.get("plugin_workers", 2)),
+                   timeout=float(config.get("plugin_timeout", 60)),
+                   cpu_seconds=int(config.get("plugin_cpu_seconds", 30)),
+                   memory_mb=None if memory_mb is None else int(memory_mb),
+                   **kwargs)
+
+    def submit(self, files: list, metadata: dict) -> bool:
+        """
+        Queues a stored capture for analysis, never blocks.
+
+        :param files: stored files of the capture, the first is given to the plugins
+        :param metadata: json serialisable metadata given to the plugins, along with the files
+        :return: whether it was queued
+        :rtype: bool
+        """
+        if not files:
+            return False
+        metadata = dict(metadata, files=list(files))
+        self._add_pending(os.path.dirname(files[0]), 1)
+        try:
+            self.captures.put_nowait(metadata)
+        except queue.Full:
+            self._add_pending(os.path.dirname(files[0]), -1)
+            self.dropped += 1
+            self.logger.warning("Plugins are behind, not analysing {}".format(os.path.basename(files[0])))
+            return False
+        return True
+
+    def _add_pending(self, directory: str, n: int):
+        with self._pending_lock:
+            self._pending[directory] = self._pending.get(directory, 0) + n
+            if self._pending[directory] <= 0:
+                del self._pending[directory]
+
+    def has_pending(self, hour_dir: str) -> bool:
+        """
+        Whether there are captures in an hour directory still being analysed, used to hold off packing it.
+
+        :param hour_dir: hour directory
+        :rtype: bool
+        """
+        with self._pending_lock:
+            return os.path.normpath(hour_dir) in (os.path.normpath(d) for d in self._pending)
+
+    @property
+    def pending(self) -> int:
+        with self._pending_lock:
+            return sum(self._pending.values())
+
+    def _run(self, name: str, target: str, metadata: dict):
+        """
+        Runs one plugin on one capture and waits for it, killing it if it goes over its timeout.
+        """
+        image_path = metadata["files"][0]
+        parent_conn, child_conn = self._context.Pipe(duplex=False)
+        st = time.time()
+        try:
+            process = self._context.Process(target=_run_plugin, name="plugin-{}".format(name),
+                                            args=(target, image_path, metadata, self.cpu_seconds, self.memory_mb,
+                                                  child_conn))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            status, result = "error", "timed out after {}s".format(self.timeout)
+            if parent_conn.poll(self.timeout):
+                try:
+                    status, result = parent_conn.recv()
+                except EOFError:
+                    process.join(1)
+                    status, result = "error", "exited with {}".format(process.exitcode)
+            process.join(max(0.1, self.timeout - (time.time() - st)))
+            if process.is_alive():
+                process.kill()
+                process.join(1)
+            if status != "ok":
+                self.failures[name] = self.failures.get(name, 0) + 1
+                self.logger.error("Plugin {} failed on {}: {}".format(name, os.path.basename(image_path), result))
+                return
+            result["elapsed_s"] = float(time.time() - st)
+            fn = "{}.{}.json".format(os.path.splitext(image_path)[0], name)
+            with open(fn + ".partial", "w") as f:
+                json.dump(result, f)
+            os.replace(fn + ".partial", fn)
+            if self.on_result is not None:
+                self.on_result(metadata, name, result)
+        except Exception as e:
+            self.failures[name] = self.failures.get(name, 0) + 1
+            self.logger.error("Couldnt run plugin {}: {}".format(name, str(e)))
+        finally:
+            parent_conn.close()
+            self._slots.release()
+
+    def run(self):
+        while not self.stopper.is_set():
+            try:
+                metadata = self.captures.get(timeout=1)
+            except queue.Empty:
+                continue
+            threads = []
+            for name, target in self.plugins.items():
+                self._slots.acquire()
+                t = Thread(target=self._run, args=(name, target, metadata), name="plugin-{}".format(name))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+            Thread(target=self._finish, args=(threads, metadata), daemon=True).start()
+
+    def _finish(self, threads: list, metadata: dict):
+        for t in threads:
+            t.join()
+        self._add_pending(os.path.dirname(metadata["files"][0]), -1)
+
+    def stop(self):
+        self.stopper.set()
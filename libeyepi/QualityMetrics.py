@@ -0,0 +1,101 @@
+import time
+import numpy
+from PIL import Image
+
+
+class QualityMetrics(object):
+    """
+    Per frame image quality metrics, computed with vectorised numpy on a downsampled copy of the frame.
+
+    The size of the downsampled copy adapts so that computing the metrics stays within a cpu time budget: it shrinks when
+    a frame goes over budget and grows back (up to max_size) when frames are well under it. Only the cpu time of the
+    calling thread counts, so other cameras' captures and encodes dont shrink it.
+
+    Metrics (all prefixed with quality_ so they can go straight into telemetry):
+        - luma_p1, luma_p5, luma_p50, luma_p95, luma_p99: exposure histogram percentiles (0-255)
+        - clipped_high, clipped_low: fraction of pixels with luma >= 250 or <= 5
+        - clipped_channels: fraction of pixels with any channel saturated at 255
+        - sharpness: variance of the laplacian of luma, low when out of focus or fogged
+        - mean_r, mean_g, mean_b: channel means
+        - cast_rg, cast_bg: red/green and blue/green ratios of the channel means, 1.0 when grey balanced
+        - cast: distance of the mean chromaticity from neutral grey
+        - size_px: longest side of the downsampled copy the metrics were computed on
+    """
+
+    percentiles = [1, 5, 50, 95, 99]
+
+    def __init__(self, budget_s: float = 0.05, max_size: int = 512, min_size: int = 64):
+        """
+        :param budget_s: cpu time budget per frame, in seconds
+        :param max_size: largest longest side of the downsampled copy
+        :param min_size: smallest longest side of the downsampled copy
+        """
+        self.budget_s = budget_s
+        self.max_size = max_size
+        self.min_size = min_size
+        self.size = max_size
+
+    def target_size(self, img: Image) -> tuple:
+        """
+        Gets the size of the downsampled copy for an image, keeping its aspect ratio.
+
+        :param img: image, it doesnt need to have been decoded
+        :return: width and height
+        :rtype: tuple(int, int)
+        """
+        width, height = img.size
+        scale = min(1.0, self.size / float(max(width, height)))
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def compute(self, img: Image) -> dict:
+        """
+        Computes the metrics for an already downsampled image, and adapts the downsample size to the budget.
+
+        :param img: downsampled image
+        :return: metrics
+        :rtype: dict
+        """
+        st = time.thread_time()
+        rgb = numpy.asarray(img.convert("RGB"))
+        luma = numpy.asarray(img.convert("L"))
+        n = float(luma.size)
+
+        cdf = numpy.cumsum(numpy.bincount(luma.ravel(), minlength=256)) / n
+        metrics = dict()
+        for pct in QualityMetrics.percentiles:
+            metrics["quality_luma_p{}".format(pct)] = int(numpy.searchsorted(cdf, pct / 100.0))
+        metrics["quality_clipped_high"] = float(1.0 - cdf[249])
+        metrics["quality_clipped_low"] = float(cdf[5])
+        metrics["quality_clipped_channels"] = float(numpy.count_nonzero((rgb == 255).any(axis=2)) / n)
+
+        y = luma.astype(numpy.float32)
+        laplacian = (4 * y[1:-1, 1:-1] - y[:-2, 1:-1] - y[2:, 1:-1] - y[1:-1, :-2] - y[1:-1, 2:])
+        metrics["quality_sharpness"] = float(laplacian.var()) if laplacian.size else 0.0
+
+        means = rgb.reshape(-1, 3).mean(axis=0)
+        mean_r, mean_g, mean_b = (float(m) for m in means)
+        metrics["quality_mean_r"] = mean_r
+        metrics["quality_mean_g"] = mean_g
+        metrics["quality_mean_b"] = mean_b
+        metrics["quality_cast_rg"] = mean_r / mean_g if mean_g else 0.0
+        metrics["quality_cast_bg"] = mean_b / mean_g if mean_g else 0.0
+        chromaticity = means / means.sum() if means.sum() else numpy.full(3, 1 / 3.0)
+        metrics["quality_cast"] = float(numpy.sqrt(((chromaticity - 1 / 3.0) ** 2).sum()))
+        metrics["quality_size_px"] = int(max(img.size))
+
+        elapsed = time.thread_time() - st
+        metrics["timing_quality_s"] = float(elapsed)
+        self.adapt(elapsed)
+        return metrics
+
+    def adapt(self, elapsed: float):
+        """
+        Adapts the downsample size for the next frame to the time the last one took.
+        Cost is roughly proportional to the number of pixels, so the size scales by the square root of the ratio.
+
+        :param elapsed: cpu seconds the last frame took
+        """
+        if elapsed > self.budget_s:
+            self.size = max(self.min_size, int(self.size * (self.budget_s / elapsed) ** 0.5))
+        elif elapsed < self.budget_s / 4:
+            self.size = min(self.max_size, int(self.size * 1.25) + 1)
@@ -0,0 +1,149 @@
+import fcntl
+import logging
+import os
+import random
+import time
+from threading import Thread, Event
+
+
+class CaptureTimeout(Exception):
+    """
+    Raised when a backend call doesnt return within its timeout.
+    """
+    pass
+
+
+class Backoff(object):
+    """
+    Exponential backoff with jitter.
+    """
+
+    def __init__(self, base: float = 1, factor: float = 2, max_delay: float = 60, jitter: float = 0.1):
+        """
+        :param base: delay for the first attempt in seconds
+        :param factor: multiplier for each subsequent attempt
+        :param max_delay: maximum delay in seconds
+        :param jitter: fraction of the delay to randomly add, so cameras dont retry in lockstep
+        """
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        """
+        Gets the delay before an attempt.
+
+        :param attempt: number of attempts already made
+        :return: seconds to wait
+        :rtype: float
+        """
+        delay = min(self.max_delay, self.base * self.factor ** attempt)
+        return delay + delay * self.jitter * random.random()
+
+    def max_total(self, attempts: int) -> float:
+        """
+        Gets the longest the delays before a number of attempts can add up to, including jitter.
+
+        :param attempts: number of attempts
+        :rtype: float
+        """
+        return sum(min(self.max_delay, self.base * self.factor ** a) * (1 + self.jitter) for a in range(attempts))
+
+
+def call_with_timeout(func, timeout: float, *args, **kwargs):
+    """
+    Calls a function in a separate thread and waits up to timeout seconds for it to return.
+
+    Python cant kill a thread, so if the call times out the thread is left running (as a daemon) and returned on the
+    exception so that the caller can check whether it ever finishes.
+
+    :param func: function to call
+    :param timeout: seconds to wait, None waits forever
+    :return: the return value of func
+    :raises CaptureTimeout: if the call didnt return in time, with the thread as its second argument.
+    """
+    result = dict()
+
+    def target():
+        try:
+            result["value"] = func(*args, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = Thread(target=target, name="{}-call".format(getattr(func, "__name__", "backend")))
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise CaptureTimeout("{} didnt return within {}s".format(getattr(func, "__name__", func), timeout), thread)
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+
+def usb_reset(bus: int, address: int) -> bool:
+    """
+    Resets a usb device with the USBDEVFS_RESET ioctl, as if it had been unplugged and plugged back in.
+
+    :param bus: usb bus number
+    :param address: usb device address on the bus
+    :return: whether the reset ioctl succeeded
+    :rtype: bool
+    """
+    from .Camera import USBDEVFS_RESET
+    path = "/dev/bus/usb/{:03d}/{:03d}".format(int(bus), int(address))
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        fcntl.ioctl(fd, USBDEVFS_RESET, 0)
+        return True
+    finally:
+        os.close(fd)
+
+
+class Watchdog(Thread):
+    """
+    Flags camera threads that have missed too many capture deadlines, or have died.
+
+    Flagged cameras have their `watchdog_flagged` attribute set, which shows up in their status.
+    """
+
+    def __init__(self, get_cameras, max_missed: int = 3, period: float = 60):
+        """
+        :param get_cameras: callable that returns the current camera objects, they are recreated on usb changes.
+        :param max_missed: number of missed deadlines before a camera is flagged
+        :param period: seconds between checks
+        """
+        super().__init__(name="Watchdog")
+        self.daemon = True
+        self.logger = logging.getLogger(self.name)
+        self.get_cameras = get_cameras
+        self.max_missed = max_missed
+        self.period = period
+        self.stopper = Event()
+
+    def check(self):
+        """
+        Checks every camera once.
+        """
+        for camera in self.get_cameras():
+            if not camera.config.get("enable", True):
+                continue
+            missed = camera.missed_deadlines
+            flagged = missed >= self.max_missed or (camera.ident is not None and not camera.is_alive())
+            if flagged:
+                self.logger.critical("{} has missed {} capture deadlines (thread alive: {})".format(
+                    camera.identifier, missed, camera.is_alive()))
+            elif camera.watchdog_flagged:
+                self.logger.warning("{} is capturing again".format(camera.identifier))
+            camera.watchdog_flagged = flagged
+
+    def run(self):
+        while not self.stopper.wait(self.period):
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error("Watchdog check failed: {}".format(str(e)))
+
+    def stop(self):
+        self.stopper.set()
@@ -0,0 +1,89 @@
+import time
+from .Camera import Camera
+from .Clock import SimulatedClock
+from .Manifest import archived_captures
+from PIL import Image
+
+class ReplayCamera(Camera):
+    """
+    Camera that replays the images of an existing archive in capture order, to run the capture pipeline on real data.
+
+    Unless a clock is given or set in the config, it runs on a :class:`SimulatedClock` starting at the first archived
+    capture, so weeks of captures go through in minutes and the output is the same every time.
+
+    Configuration keys:
+        - replay_directory: archive directory to replay
+        - replay_loop: start again from the first image when they run out, otherwise the camera stops
+    """
+
+    def __init__(self, config, **kwargs):
+        """
+        Indexes the archive, the images are only read as they are captured.
+
+        :param config: Configuration section for this camera.
+        :param kwargs:
+        """
+        self.replay_directory = config.get("replay_directory", None)
+        if not self.replay_directory:
+            raise ValueError("replay_directory must be set for a replay camera")
+        self.archive = archived_captures(self.replay_directory)
+        if kwargs.get("clock", None) is None and "clock" not in config:
+            start = self.archive[0][0] if len(self.archive) else None
+            kwargs["clock"] = SimulatedClock(start=start)
+        super().__init__(config, **kwargs)
+        self.replay_loop = bool(self.config.get("replay_loop", False))
+        self.position = 0
+        self.logger.info("Replaying {} captures from {}".format(len(self.archive), self.replay_directory))
+
+    @property
+    def time_to_capture(self) -> bool:
+        """
+        Stops the camera once the archive has been replayed, otherwise the same as :func:`Camera.time_to_capture`.
+
+        :rtype: bool
+        """
+        if self.position >= len(self.archive) and not (self.replay_loop and len(self.archive)):
+            self.logger.info("Replayed all {} captures, stopping".format(len(self.archive)))
+            self.stop()
+            return False
+        return super().time_to_capture
+
+    def next_frame(self):
+        """
+        Reads the next archived image.
+
+        :return: image, or None when the archive has run out
+        :rtype: PIL.Image
+        """
+        if self.position >= len(self.archive):
+            if not self.replay_loop or not len(self.archive):
+                return None
+            self.position = 0
+        capture_time, fn = self.archive[self.position]
+        self.position += 1
+        with Image.open(fn) as img:
+            return img.convert("RGB")
+
+    def capture_image(self, filename: str = None):
+        """
+        Provides the next archived image, stopping the camera once they have all been replayed.
+
+        Writes images disk using :func:`encode_write_image` like a real camera.
+
+        :param filename: image filename without extension
+        :return: image if filename not specified, otherwise list of files.
+        :rtype: PIL.Image or list(str)
+        """
+        st = time.time()
+        img = self.next_frame()
+        if img is None:
+            self.logger.info("Replayed all {} captures, stopping".format(len(self.archive)))
+            self.stop()
+            return [] if filename else None
+        self._image = img
+        if filename:
+            filenames = self.encode_write_image(self._image, filename)
+            self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
+            return filenames
+        self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
+        return self._image
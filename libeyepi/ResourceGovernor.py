@@ -0,0 +1,199 @@
+import glob
+import logging
+import os
+import threading
+import time
+
+NORMAL = 0
+PRESSURE = 1
+CRITICAL = 2
+
+
+def lower_priority(niceness: int = 19) -> bool:
+    """
+    Lowers the scheduling priority of the calling thread. On linux niceness is per thread, so this doesnt affect the
+    capture thread.
+
+    :param niceness: niceness to set
+    :return: whether the priority was lowered
+    :rtype: bool
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+        return True
+    except Exception as e:
+        logging.getLogger(__name__).warning("Couldnt lower thread priority: {}".format(str(e)))
+    return False
+
+
+class ResourceGovernor(object):
+    """
+    Decides what optional capture side work is allowed, from the cpu temperature and the system load average.
+
+    There are three pressure levels, NORMAL, PRESSURE and CRITICAL. Each kind of optional work is shed (skipped) or
+    deferred (done later, when the pressure is gone) from the level in :attr:`shed_levels`; primary capture and writing
+    the primary output are never governed.
+
+    Readings are cached for cache_s so asking is cheap enough to do for every frame. The sysfs and procfs paths can be
+    pointed at other files for testing.
+    """
+
+    # the lowest level at which each kind of optional work is no longer done
+    shed_levels = {
+        "quality_metrics": PRESSURE,
+        "preview_overlay": PRESSURE,
+        "secondary_encode": PRESSURE,
+        "packing": PRESSURE,
+        "preview": CRITICAL,
+        "timelapse": CRITICAL,
+        "plugins": CRITICAL,
+    }
+    level_names = ["normal", "pressure", "critical"]
+
+    def __init__(self, max_temperature: float = 70.0, critical_temperature: float = 80.0,
+                 max_load: float = None, critical_load: float = None,
+                 thermal_path: str = "/sys/class/thermal", loadavg_path: str = "/proc/loadavg",
+                 cache_s: float = 5.0):
+        """
+        :param max_temperature: cpu temperature in degrees celsius above which there is pressure
+        :param critical_temperature: cpu temperature in degrees celsius above which it is critical
+        :param max_load: 1 minute load average above which there is pressure, defaults to the number of cpus
+        :param critical_load: 1 minute load average above which it is critical, defaults to twice max_load
+        :param thermal_path: sysfs thermal directory containing thermal_zone*/temp
+        :param loadavg_path: procfs loadavg file
+        :param cache_s: how long readings are reused for, in seconds
+        """
+        self.max_temperature = max_temperature
+        self.critical_temperature = critical_temperature
+        self.max_load = max_load if max_load is not None else float(os.cpu_count() or 1)
+        self.critical_load = critical_load if critical_load is not None else self.max_load * 2
+        self.thermal_path = thermal_path
+        self.loadavg_path = loadavg_path
+        self.cache_s = cache_s
+        self.shed = dict()
+        self._level = NORMAL
+        self._temperature = None
+        self._load = None
+        self._read_time = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        Creates a governor from a camera config section.
+
+        :param config: camera config
+        :return: governor, or None if it is disabled
+        :rtype: ResourceGovernor
+        """
+        if not config.get("governor", False):
+            return None
+        max_load = config.get("max_load", None)
+        critical_load = config.get("critical_load", None)
+        return cls(max_temperature=float(config.get("max_temperature", 70)),
+                   critical_temperature=float(config.get("critical_temperature", 80)),
+                   max_load=None if max_load is None else float(max_load),
+                   critical_load=None if critical_load is None else float(critical_load),
+                   thermal_path=config.get("thermal_path", "/sys/class/thermal"),
+                   loadavg_path=config.get("loadavg_path", "/proc/loadavg"))
+
+    def read_temperature(self):
+        """
+        Reads the hottest thermal zone.
+
+        :return: temperature in degrees celsius, or None if there are no readable thermal zones
+        :rtype: float
+        """
+        temperatures = []
+        for fn in glob.glob(os.path.join(self.thermal_path, "thermal_zone*", "temp")):
+            try:
+                with open(fn) as f:
+                    temperatures.append(int(f.read().strip()) / 1000.0)
+            except Exception:
+                continue
+        return max(temperatures) if temperatures else None
+
+    def read_load(self):
+        """
+        Reads the 1 minute load average.
+
+        :return: load average, or None if it couldnt be read
+        :rtype: float
+        """
+        try:
+            with open(self.loadavg_path) as f:
+                return float(f.read().split()[0])
+        except Exception:
+            return None
+
+    def update(self, force: bool = False) -> int:
+        """
+        Re-reads the temperature and load if the cached readings are stale, and works out the pressure level.
+
+        :param force: re-read even if the cached readings are fresh
+        :return: pressure level
+        :rtype: int
+        """
+        with self._lock:
+            now = time.monotonic()
+            if force or self._read_time is None or now - self._read_time >= self.cache_s:
+                self._read_time = now
+                self._temperature = self.read_temperature()
+                self._load = self.read_load()
+                temperature = self._temperature if self._temperature is not None else float("-inf")
+                load = self._load if self._load is not None else float("-inf")
+                if temperature >= self.critical_temperature or load >= self.critical_load:
+                    self._level = CRITICAL
+                elif temperature >= self.max_temperature or load >= self.max_load:
+                    self._level = PRESSURE
+                else:
+                    self._level = NORMAL
+            return self._level
+
+    @property
+    def level(self) -> int:
+        return self.update()
+
+    def allow(self, work: str) -> bool:
+        """
+        Whether a kind of optional work should be done now, counting it if it isnt.
+
+        :param work: one of the keys of :attr:`shed_levels`
+        :rtype: bool
+        """
+        if self.update() < ResourceGovernor.shed_levels.get(work, CRITICAL + 1):
+            return True
+        self.shed[work] = self.shed.get(work, 0) + 1
+        return False
+
+    def wait_for(self, work: str, stopper: threading.Event, poll: float = 30.0) -> bool:
+        """
+        Blocks until a kind of deferred work is allowed, for background threads.
+
+        :param work: one of the keys of :attr:`shed_levels`
+        :param stopper: event that ends the wait early
+        :param poll: seconds between checks
+        :return: whether the work is allowed, False if the stopper was set
+        :rtype: bool
+        """
+        while not stopper.is_set():
+            if self.update() < ResourceGovernor.shed_levels.get(work, CRITICAL + 1):
+                return True
+            stopper.wait(poll)
+        return False
+
+    def get_telemetry(self) -> dict:
+        """
+        Gets the readings and the counts of shed work, for telemetry.
+
+        :rtype: dict
+        """
+        level = self.update()
+        telemetry = {"governor_level": level}
+        if self._temperature is not None:
+            telemetry["cpu_temperature"] = float(self._temperature)
+        if self._load is not None:
+            telemetry["load_1m"] = float(self._load)
+        for work, count in self.shed.items():
+            telemetry["governor_shed_{}".format(work)] = count
+        return telemetry
@@ -0,0 +1,78 @@
+import datetime
+import math
+from collections import OrderedDict
+
+# julian date of the J2000 epoch, and of the unix epoch
+J2000 = 2451545.0
+UNIX_EPOCH_JD = 2440587.5
+# solar altitude at sunrise/sunset, allowing for refraction and the size of the sun's disc
+SUNRISE_ALTITUDE = -0.833
+
+
+def sun_times(day: datetime.date, latitude: float, longitude: float) -> tuple:
+    """
+    Calculates sunrise and sunset for a day with the NOAA sunrise equation, accurate to a minute or so.
+
+    :param day: local date
+    :param latitude: latitude in degrees, north positive
+    :param longitude: longitude in degrees, east positive
+    :return: sunrise and sunset as naive local datetimes. (None, None) if the sun doesnt rise, the start and end of
+        the day if it doesnt set.
+    :rtype: tuple(datetime.datetime, datetime.datetime)
+    """
+    n = day.toordinal() - datetime.date(2000, 1, 1).toordinal()
+    mean_noon = n - longitude / 360.0
+    anomaly = math.radians((357.5291 + 0.98560028 * mean_noon) % 360)
+    centre = 1.9148 * math.sin(anomaly) + 0.0200 * math.sin(2 * anomaly) + 0.0003 * math.sin(3 * anomaly)
+    ecliptic_longitude = math.radians((math.degrees(anomaly) + centre + 180 + 102.9372) % 360)
+    transit = J2000 + mean_noon + 0.0053 * math.sin(anomaly) - 0.0069 * math.sin(2 * ecliptic_longitude)
+    declination = math.asin(math.sin(ecliptic_longitude) * math.sin(math.radians(23.4397)))
+
+    phi = math.radians(latitude)
+    cos_hour_angle = ((math.sin(math.radians(SUNRISE_ALTITUDE)) - math.sin(phi) * math.sin(declination)) /
+                      (math.cos(phi) * math.cos(declination)))
+    if cos_hour_angle > 1:
+        return None, None
+    if cos_hour_angle < -1:
+        start = datetime.datetime.combine(day, datetime.time(0, 0))
+        return start, start + datetime.timedelta(days=1) - datetime.timedelta(microseconds=1)
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+
+    def to_local(julian_date: float) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp((julian_date - UNIX_EPOCH_JD) * 86400).replace(microsecond=0)
+
+    return to_local(transit - hour_angle / 360.0), to_local(transit + hour_angle / 360.0)
+
+
+class SolarTable(object):
+    """
+    Cache of sunrise and sunset times for a location, so they are only calculated once per day however often the
+    capture window is checked.
+    """
+
+    def __init__(self, latitude: float, longitude: float, size: int = 8):
+        """
+        :param latitude: latitude in degrees, north positive
+        :param longitude: longitude in degrees, east positive
+        :param size: number of days to keep
+        """
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.size = size
+        self._table = OrderedDict()
+
+    def get(self, day: datetime.date) -> tuple:
+        """
+        Gets sunrise and sunset for a day, see :func:`sun_times`.
+
+        :param day: local date
+        :rtype: tuple(datetime.datetime, datetime.datetime)
+        """
+        if day in self._table:
+            self._table.move_to_end(day)
+            return self._table[day]
+        times = sun_times(day, self.latitude, self.longitude)
+        self._table[day] = times
+        while len(self._table) > self.size:
+            self._table.popitem(last=False)
+        return times
@@ -0,0 +1,136 @@
+import json
+import logging
+import re
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server that handles each request in a thread.
+    """
+    daemon_threads = True
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for the status api.
+
+    GET /cameras                                list of camera statuses
+    GET /cameras/<identifier>                   status of a camera
+    GET /cameras/<identifier>/last_image.jpg    latest preview, supports If-None-Match
+    POST /cameras/<identifier>/capture          trigger a capture
+    """
+
+    # set on the subclass created by :class:`StatusServer`
+    get_cameras = None
+    logger = logging.getLogger("StatusServer")
+
+    routes = [
+        ("GET", re.compile(r"^/cameras/?$"), "list_cameras"),
+        ("GET", re.compile(r"^/cameras/(?P<identifier>[^/]+)/?$"), "camera_status"),
+        ("GET", re.compile(r"^/cameras/(?P<identifier>[^/]+)/last_image\.jpg$"), "last_image"),
+        ("POST", re.compile(r"^/cameras/(?P<identifier>[^/]+)/capture/?$"), "trigger_capture"),
+    ]
+
+    def log_message(self, format, *args):
+        self.logger.debug(format % args)
+
+    def _route(self, method: str):
+        path = self.path.split("?", 1)[0]
+        for route_method, pattern, handler in StatusRequestHandler.routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                try:
+                    return getattr(self, handler)(**match.groupdict())
+                except Exception as e:
+                    self.logger.error("Error handling {} {}: {}".format(method, path, str(e)))
+                    return self._send_json({"error": str(e)}, status=500)
+        self._send_json({"error": "not found"}, status=404)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def _send_json(self, document, status: int = 200):
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _camera(self, identifier: str):
+        for camera in self.get_cameras():
+            if camera.identifier == identifier:
+                return camera
+        return None
+
+    def list_cameras(self):
+        self._send_json([camera.status for camera in self.get_cameras()])
+
+    def camera_status(self, identifier: str):
+        camera = self._camera(identifier)
+        if camera is None:
+            return self._send_json({"error": "no camera {}".format(identifier)}, status=404)
+        self._send_json(camera.status)
+
+    def last_image(self, identifier: str):
+        camera = self._camera(identifier)
+        if camera is None:
+            return self._send_json({"error": "no camera {}".format(identifier)}, status=404)
+        data, etag = camera.preview
+        if data is None:
+            return self._send_json({"error": "no image yet"}, status=404)
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def trigger_capture(self, identifier: str):
+        camera = self._camera(identifier)
+        if camera is None:
+            return self._send_json({"error": "no camera {}".format(identifier)}, status=404)
+        camera.trigger_capture()
+        self._send_json({"triggered": identifier}, status=202)
+
+
+class StatusServer(Thread):
+    """
+    Serves camera status and the latest preview of each camera from memory over http.
+    """
+
+    def __init__(self, get_cameras, bind: str = "127.0.0.1", port: int = 8080):
+        """
+        :param get_cameras: callable that returns the current camera objects, they are recreated on usb changes.
+        :param bind: address to listen on
+        :param port: port to listen on
+        """
+        super().__init__(name="StatusServer")
+        self.daemon = True
+        self.logger = logging.getLogger(self.name)
+        handler = type("BoundStatusRequestHandler", (StatusRequestHandler,),
+                       dict(get_cameras=staticmethod(get_cameras)))
+        self.server = ThreadingHTTPServer((bind, int(port)), handler)
+        self.logger.info("Serving status on http://{}:{}/cameras".format(bind, port))
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        """
+        Stops serving.
+        """
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,131 @@
+import datetime
+import logging
+import math
+import os
+from PIL import Image
+
+
+class Thumbnails(object):
+    """
+    Writes a small fixed pyramid of thumbnails for each capture, and keeps a per day contact sheet up to date.
+
+    The pyramid levels (<basename>_1024px.jpg, <basename>_256px.jpg and <basename>_64px.jpg by default) are written to
+    the spool next to the capture, so they are moved, checksummed and packed with it. Each level is downsampled from
+    the one above it, and if the capture is jpeg data the largest level comes from a draft (reduced scale) decode.
+
+    The contact sheet (contact_sheets/YYYY_mm_dd.jpg in the output directory) has a row per hour, and a column per
+    capture slot in the hour up to max_per_hour (short intervals share cells, the latest capture wins). The smallest
+    level is pasted into its cell as each capture comes in, the sheet for the current day is kept in memory so it is
+    only re-read after a restart.
+    """
+
+    default_sizes = [1024, 256, 64]
+
+    def __init__(self, output_directory: str, interval_s: float, sizes: list = None, contact_sheet: bool = True,
+                 max_per_hour: int = 12, jpeg_quality: int = 85, logger: logging.Logger = None):
+        """
+        :param output_directory: camera output directory, the contact sheets are written to a directory in it
+        :param interval_s: capture interval in seconds, sets the layout of the contact sheet
+        :param sizes: longest side of each pyramid level
+        :param contact_sheet: whether to keep a contact sheet
+        :param max_per_hour: most columns in the contact sheet
+        :param jpeg_quality: jpeg quality of the thumbnails
+        :param logger: logger to use
+        """
+        self.sizes = sorted((int(s) for s in (sizes or Thumbnails.default_sizes)), reverse=True)
+        self.contact_sheet = contact_sheet
+        self.directory = os.path.join(output_directory, "contact_sheets")
+        self.interval_s = max(1.0, float(interval_s))
+        self.jpeg_quality = jpeg_quality
+        self.logger = logger or logging.getLogger(__name__)
+        self.columns = max(1, min(int(max_per_hour), int(math.ceil(3600 / self.interval_s))))
+        self.rows = 24
+        self._sheet = None
+        self._sheet_day = None
+
+    @staticmethod
+    def fit(size: tuple, longest: int) -> tuple:
+        """
+        Gets the size that fits within a square, keeping the aspect ratio and never upscaling.
+        """
+        width, height = size
+        scale = min(1.0, longest / float(max(width, height)))
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+    def pyramid(self, img: Image) -> list:
+        """
+        Downsamples an image to each pyramid level.
+
+        :param img: full resolution image. if it is lazily opened jpeg data it is draft decoded
+        :return: list of (size, image), largest first
+        :rtype: list(tuple)
+        """
+        # tile is only set until the image data has been decoded
+        if getattr(img, "format", None) == "JPEG" and img.tile:
+            img.draft("RGB", Thumbnails.fit(img.size, self.sizes[0]))
+        level = img if img.mode in ("RGB", "L") else img.convert("RGB")
+        levels = []
+        for size in self.sizes:
+            level = level.resize(Thumbnails.fit(level.size, size), resample=Image.BOX)
+            levels.append((size, level))
+        return levels
+
+    def write_pyramid(self, img: Image, fn: str) -> tuple:
+        """
+        Writes the pyramid of a capture.
+
+        :param img: full resolution image
+        :param fn: filename of the capture, without extension
+        :return: files written and the smallest level
+        :rtype: tuple(list(str), PIL.Image)
+        """
+        fnp = os.path.splitext(fn)[0]
+        files = []
+        levels = self.pyramid(img)
+        for size, level in levels:
+            path = "{}_{}px.jpg".format(fnp, size)
+            level.save(path, format="JPEG", quality=self.jpeg_quality)
+            files.append(path)
+        return files, levels[-1][1]
+
+    def cell(self, capture_time: datetime.datetime) -> tuple:
+        """
+        Gets the top left pixel of the contact sheet cell for a capture time.
+        """
+        column = (capture_time.minute * 60 + capture_time.second) * self.columns // 3600
+        cell_size = self.sizes[-1]
+        return column * cell_size, capture_time.hour * cell_size
+
+    def sheet_path(self, day: datetime.datetime) -> str:
+        return os.path.join(self.directory, day.strftime("%Y_%m_%d.jpg"))
+
+    def add_to_contact_sheet(self, thumb: Image, capture_time: datetime.datetime):
+        """
+        Pastes a thumbnail into the contact sheet of its day and writes the sheet.
+
+        :param thumb: smallest pyramid level of the capture
+        :param capture_time: time of the capture
+        """
+        day = capture_time.date()
+        cell_size = self.sizes[-1]
+        if self._sheet_day != day:
+            self._sheet_day = day
+            self._sheet = None
+            path = self.sheet_path(capture_time)
+            # carry on with todays sheet after a restart
+            if os.path.isfile(path):
+                try:
+                    with Image.open(path) as existing:
+                        if existing.size == (self.columns * cell_size, self.rows * cell_size):
+                            self._sheet = existing.convert("RGB")
+                except Exception as e:
+                    self.logger.error("Couldnt read contact sheet, starting a new one: {}".format(str(e)))
+            if self._sheet is None:
+                self._sheet = Image.new("RGB", (self.columns * cell_size, self.rows * cell_size))
+        x, y = self.cell(capture_time)
+        self._sheet.paste(thumb.convert("RGB"), (x + (cell_size - thumb.size[0]) // 2,
+                                                 y + (cell_size - thumb.size[1]) // 2))
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.sheet_path(capture_time)
+        self._sheet.save(path + ".partial", format="JPEG", quality=self.jpeg_quality)
+        os.replace(path + ".partial", path)
@@ -0,0 +1,209 @@
+import datetime
+import glob
+import logging
+import os
+import queue
+import subprocess
+from threading import Thread, Event
+from .ResourceGovernor import lower_priority
+from .Clock import Clock
+
+
+class Timelapse(Thread):
+    """
+    Builds a daily timelapse video incrementally, one frame per capture, through a persistent ffmpeg process.
+
+    Frames (the preview jpegs) are piped into an ffmpeg process per hour, which writes a fragmented mp4 segment
+    (timelapse/YYYY_mm_dd/YYYY_mm_dd_HH.mp4.partial) that is playable while it is still being written, and renamed to
+    .mp4 when it is finished so only finished segments are ever joined. When the hour is over by
+    the clock the segment is finished, whether or not another frame comes (eg. at the end of a capture window), and the
+    day's segments are joined into timelapse/YYYY_mm_dd.mp4 without re-encoding, so the cost per capture is a single
+    frame encode however long the day gets.
+
+    Frames are handed over through a small queue so a slow ffmpeg never holds up capturing, if it fills up the oldest
+    frame is dropped. Joining is done by a separate thread so it never holds up encoding frames either.
+    """
+
+    def __init__(self, output_directory: str, fps: int = 25, crf: int = 23, ffmpeg_path: str = "ffmpeg",
+                 queue_size: int = 8, logger: logging.Logger = None, clock: Clock = None):
+        """
+        :param output_directory: camera output directory, the videos are written to a timelapse directory in it
+        :param fps: frame rate of the videos
+        :param crf: x264 constant rate factor, lower is better quality and bigger
+        :param ffmpeg_path: ffmpeg binary to call
+        :param queue_size: number of frames that can be waiting to be encoded
+        :param logger: logger to use
+        :param clock: clock the capture times are from, to know when an hour is over
+        """
+        super().__init__(name="Timelapse")
+        self.daemon = True
+        self.directory = os.path.join(output_directory, "timelapse")
+        self.fps = fps
+        self.crf = crf
+        self.ffmpeg_path = ffmpeg_path
+        self.logger = logger or logging.getLogger(__name__)
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.stopper = Event()
+        self.clock = clock or Clock()
+        self._process = None
+        self._hour = None
+        self._segment = None
+        # days whose segments need joining, None tells the joiner to finish.
+        self._days = queue.Queue()
+        self._joiner = Thread(target=self._join_days, name="TimelapseJoin", daemon=True)
+
+    def add(self, jpeg: bytes, capture_time: datetime.datetime):
+        """
+        Queues a frame, dropping the oldest one if the queue is full.
+
+        :param jpeg: jpeg encoded frame
+        :param capture_time: time of the capture
+        """
+        while True:
+            try:
+                self.frames.put_nowait((jpeg, capture_time))
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                    self.logger.warning("Timelapse encoder is behind, dropped a frame")
+                except queue.Empty:
+                    pass
+
+    def segment_path(self, hour: datetime.datetime) -> str:
+        return os.path.join(self.directory, hour.strftime("%Y_%m_%d"), hour.strftime("%Y_%m_%d_%H.mp4"))
+
+    def day_path(self, day: datetime.datetime) -> str:
+        return os.path.join(self.directory, day.strftime("%Y_%m_%d.mp4"))
+
+    def _open_segment(self, hour: datetime.datetime):
+        """
+        Starts an ffmpeg process writing the segment for an hour. If the segment already exists (after a restart) a new
+        part is started next to it rather than overwriting it.
+        """
+        path = self.segment_path(hour)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part = 1
+        base = path
+        while os.path.exists(path) or os.path.exists(path + ".partial"):
+            path = "{}_{}.mp4".format(os.path.splitext(base)[0], part)
+            part += 1
+        cmd = [self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-y",
+               "-f", "image2pipe", "-c:v", "mjpeg", "-framerate", str(self.fps), "-i", "-",
+               "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+               "-c:v", "libx264", "-preset", "veryfast", "-crf", str(self.crf), "-pix_fmt", "yuv420p",
+               "-movflags", "+frag_keyframe+empty_moov+default_base_moof", "-g", str(self.fps),
+               "-f", "mp4", path + ".partial"]
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        self._hour = hour
+        self._segment = path
+        self.logger.info("Started timelapse segment {}".format(os.path.basename(path)))
+
+    def _close_segment(self):
+        """
+        Finishes the current segment and queues the day's video to be rebuilt from its segments.
+        """
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=60)
+            if self._process.returncode:
+                self.logger.error("ffmpeg exited with {} for timelapse segment".format(self._process.returncode))
+        except Exception as e:
+            self.logger.error("Couldnt finish timelapse segment: {}".format(str(e)))
+            self._process.kill()
+        self._process = None
+        self._finish_segment(self._segment + ".partial")
+        self._days.put(self._hour)
+
+    def _finish_segment(self, partial: str):
+        """
+        Renames a segment that has been written to its final name, so it is included when the day is joined. Segments
+        are fragmented, so even one cut short by a crash plays up to its last fragment.
+        """
+        try:
+            os.replace(partial, partial[:-len(".partial")])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.error("Couldnt finish timelapse segment {}: {}".format(os.path.basename(partial), str(e)))
+
+    def _join_days(self):
+        lower_priority()
+        while True:
+            day = self._days.get()
+            days = [day]
+            # catch up with everything queued while the last join ran, each day only needs joining once.
+            while True:
+                try:
+                    days.append(self._days.get_nowait())
+                except queue.Empty:
+                    break
+            pending = dict((d.date(), d) for d in days if d is not None)
+            for d in sorted(pending.values()):
+                self.concat_day(d)
+            if None in days:
+                return
+
+    def concat_day(self, day: datetime.datetime):
+        """
+        Joins the segments of a day into a single video without re-encoding them.
+
+        :param day: any time on the day
+        """
+        segments = sorted(glob.glob(os.path.join(self.directory, day.strftime("%Y_%m_%d"), "*.mp4")))
+        if not segments:
+            return
+        path = self.day_path(day)
+        list_path = path + ".txt"
+        with open(list_path, "w") as f:
+            for segment in segments:
+                f.write("file '{}'\n".format(os.path.abspath(segment)))
+        try:
+            subprocess.check_call([self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-y",
+                                   "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy",
+                                   "-movflags", "+faststart", "-f", "mp4", path + ".partial"],
+                                  stdout=subprocess.DEVNULL, timeout=600)
+            os.replace(path + ".partial", path)
+        except Exception as e:
+            self.logger.error("Couldnt join timelapse segments for {}: {}".format(day.strftime("%Y_%m_%d"), str(e)))
+        finally:
+            os.remove(list_path)
+
+    def run(self):
+        lower_priority()
+        # segments left unfinished by a crash or power cut.
+        for partial in glob.glob(os.path.join(self.directory, "*", "*.mp4.partial")):
+            self._finish_segment(partial)
+            try:
+                self._days.put(datetime.datetime.strptime(os.path.basename(os.path.dirname(partial)), "%Y_%m_%d"))
+            except ValueError:
+                pass
+        self._joiner.start()
+        while not self.stopper.is_set():
+            try:
+                jpeg, capture_time = self.frames.get(timeout=1)
+            except queue.Empty:
+                # finish the segment once its hour is over, even if no more frames are coming.
+                if self._process is not None and self.clock.now() >= self._hour + datetime.timedelta(hours=1):
+                    self._close_segment()
+                continue
+            hour = capture_time.replace(minute=0, second=0, microsecond=0)
+            try:
+                if self._process is not None and (hour != self._hour or self._process.poll() is not None):
+                    self._close_segment()
+                if self._process is None:
+                    self._open_segment(hour)
+                self._process.stdin.write(jpeg)
+                self._process.stdin.flush()
+            except Exception as e:
+                self.logger.error("Couldnt add frame to timelapse: {}".format(str(e)))
+                self._close_segment()
+        self._close_segment()
+        self._days.put(None)
+
+    def stop(self):
+        self.stopper.set()
@@ -1,16 +1,17 @@
 import time
 import logging.config
+from contextlib import contextmanager
+from threading import Thread, Event, Condition
 from .Camera import Camera
+from .LogQueue import configure_logging, get_camera_logger
+from .Recovery import Backoff
 from PIL import Image
 
 from dateutil import zoneinfo
 
 timezone = zoneinfo.get_zonefile_instance().get("Australia/Canberra")
 
-try:
-    logging.config.fileConfig("/etc/eyepi/logging.ini")
-except:
-    pass
+configure_logging()
 
 
 try:
@@ -20,108 +21,211 @@ except Exception as e:
     pass
 
 
-class USBCamera(Camera):
+class FrameGrabber(Thread):
     """
-    USB Camera Class
+    Continuously drains frames from a v4l2 device so that the freshest frame is always available.
+
+    Frames are read into a set of 3 preallocated buffers that are reused (triple buffering), so the grab loop never
+    allocates and never writes into the buffer that holds the latest frame or the buffer that is being read.
     """
 
-    @classmethod
-    def stream_thread(cls):
+    num_buffers = 3
+
+    def __init__(self, sys_number: int, name: str = None):
         """
-        usb camera stream thread.
-        TODO: Needs to be aware of multiple cameras.
+        :param sys_number: system device number of device to use (the 0 from /dev/video0)
+        :param name: name for the thread and logger.
         """
-        print("ThreadStartup ...")
-        cam = cv2.VideoCapture()
+        super().__init__(name="{}-grabber".format(name or sys_number))
+        self.daemon = True
+        self.logger = logging.getLogger(self.name)
+        self.sys_number = int(sys_number)
+        self.stopper = Event()
+        self.video_capture = None
+        # waits between attempts to open a device that isnt there.
+        self.backoff = Backoff(max_delay=30)
+        self.frame_count = 0
+        self._buffers = [None] * FrameGrabber.num_buffers
+        self._latest = None
+        self._reading = set()
+        self._timestamp = None
+        self._condition = Condition()
+        self.open()
 
-        # camera setup
-        # let camera warm up
-        time.sleep(2)
-        cam.set(3, 30000)
-        cam.set(4, 30000)
+    def open(self) -> bool:
+        """
+        ensures the capture device is open and valid, and set to its highest resolution.
 
-        print("Started up!")
-        # for foo in camera.capture_continuous(stream, 'jpeg',
-        #                                      use_video_port=True):
-        while True:
-            ret, frame = cam.read()
-            frame = cv2.imencode(".jpg", frame)
-            cls._frame = frame[1].tostring()
-            # store frame
+        :return: whether the device is open.
+        :rtype: bool
+        """
+        try:
+            if not self.video_capture:
+                self.video_capture = cv2.VideoCapture()
 
-            # if there hasn't been any clients asking for frames in
-            # the last 10 seconds stop the thread
-            if time.time() - cls._last_access > 10:
-                print("ThreadShutdown")
-                break
-        cls._thread = None
+            if not self.video_capture.isOpened():
+                if not self.video_capture.open(self.sys_number):
+                    raise IOError("VideoCapture().open({}) failed.".format(self.sys_number))
+                # just max them out to get the highest resolution.
+                self.video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 100000)
+                self.video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 100000)
+                self.logger.info("Capturing at {w}x{h}".format(w=self.video_capture.get(cv2.CAP_PROP_FRAME_WIDTH),
+                                                               h=self.video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            return True
+        except Exception as e:
+            self.logger.error("Capture device could not be opened {}".format(str(e)))
+        return False
 
-    def __init__(self, identifier: str, sys_number: int, **kwargs):
+    def _free_buffer(self) -> int:
         """
-        USB camera init. must have a sys_number (the 0 from /dev/video0) to capture from
-
-        :param identifier: identifier for the webcamera
-        :param sys_number: system device number of device to use
-        :param kwargs:
+        gets the index of a buffer that is neither the latest frame nor being read.
+        must be called with the condition held.
         """
-        self.logger = logging.getLogger(identifier)
+        for idx in range(FrameGrabber.num_buffers):
+            if idx != self._latest and idx not in self._reading:
+                return idx
 
+    def run(self):
+        """
+        grab loop, reads frames into the free buffer then swaps it in as the latest frame.
+        """
+        attempt = 0
+        while not self.stopper.is_set():
+            if self.video_capture is None or not self.video_capture.isOpened():
+                # opencv is missing or the device isnt there (yet), keep trying without spinning.
+                if not self.open():
+                    self.stopper.wait(self.backoff.delay(attempt))
+                    attempt += 1
+                    continue
+                attempt = 0
+            with self._condition:
+                idx = self._free_buffer()
+            try:
+                ret, frame = self.video_capture.read(self._buffers[idx])
+            except Exception as e:
+                self.logger.error("Error webcam capture did not read {}".format(str(e)))
+                ret, frame = False, None
+            if not ret:
+                # device went away or isnt ready, dont spin. it is reopened at the top of the loop if it went away.
+                self.stopper.wait(0.1)
+                continue
+            with self._condition:
+                # read only reuses the buffer if the frame shape matches, keep whatever it returned.
+                self._buffers[idx] = frame
+                self._latest = idx
+                self._timestamp = time.time()
+                self.frame_count += 1
+                self._condition.notify_all()
         try:
-            import cv2
-        except ImportError as e:
-            self.logger.fatal(e)
-            self.logger("no webcam support through cv2")
-        # only webcams have a v4l sys_number.
-        self.sys_number = int(sys_number)
-        self.video_capture = None
-        try:
-            self.video_capture = cv2.VideoCapture()
+            if self.video_capture is not None:
+                self.video_capture.release()
         except Exception as e:
-            self.logger.fatal("couldnt open video capture device on {}".format(self.sys_number))
+            self.logger.error("Couldnt release cv2 device {}".format(str(e)))
+
+    @contextmanager
+    def latest(self, timeout: float = 5):
+        """
+        Context manager that provides the latest frame and its timestamp.
+        The frame is a view of the grab buffer, it is only valid inside the context, so copy out of it.
+        Waits up to timeout seconds for the first frame.
 
-        self._assert_capture_device()
+        :param timeout: seconds to wait for a first frame
+        :return: tuple of frame (bgr numpy.array) and timestamp, or (None, None) if there are no frames.
+        """
+        with self._condition:
+            if self._latest is None:
+                self._condition.wait_for(lambda: self._latest is not None, timeout)
+            idx = self._latest
+            if idx is not None:
+                self._reading.add(idx)
+            timestamp = self._timestamp
+        if idx is None:
+            yield None, None
+            return
         try:
-            if not self.video_capture.open(self.sys_number):
-                self.logger.fatal("Couldnt open a video capture device on {}".format(self.sys_number))
-        except Exception as e:
-            self.logger.fatal("Couldnt open a video capture device")
-        # 3 -> width 4->height 5->fps just max them out to get the highest resolution.
-        self.video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 100000)
-        self.video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 100000)
-        self.logger.info("Capturing at {w}x{h}".format(w=self.video_capture.get(cv2.CAP_PROP_FRAME_WIDTH),
-                                                       h=self.video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            yield self._buffers[idx], timestamp
+        finally:
+            with self._condition:
+                self._reading.discard(idx)
 
-        super(USBCamera, self).__init__(identifier, **kwargs)
+    def wait_for_frame(self, frame_count: int, timeout: float = 1) -> int:
+        """
+        Waits for a frame newer than frame_count.
+
+        :param frame_count: frame count of the last frame seen.
+        :param timeout: seconds to wait.
+        :return: the current frame count
+        :rtype: int
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.frame_count > frame_count, timeout)
+            return self.frame_count
 
     def stop(self):
         """
-        releases the video device and stops the camera thread
+        stops the grab loop, the device is released when it exits.
         """
-        try:
-            self.video_capture.release()
-        except Exception as e:
-            self.logger.error("Couldnt release cv2 device {}".format(str(e)))
         self.stopper.set()
 
-    def _assert_capture_device(self):
+
+class USBCamera(Camera):
+    """
+    USB Camera Class
+
+    A :class:`FrameGrabber` thread keeps the latest frame from the device, so capture and live view never wait on the
+    v4l2 buffer queue.
+    """
+
+    def __init__(self, config, sys_number: int = None, **kwargs):
         """
-        ensures the capture device is open and valid.
+        USB camera init. must have a sys_number (the 0 from /dev/video0) to capture from, either as an argument or
+        "sysnumber" in the config.
 
-        :param self:
+        :param config: Configuration section for this camera.
+        :param sys_number: system device number of device to use
+        :param kwargs:
         """
-        try:
-            if not self.video_capture:
-                self.video_capture = cv2.VideoCapture()
+        identifier = config['filenameprefix']
+        self.logger = get_camera_logger(identifier, self.__class__.__name__)
+        # only webcams have a v4l sys_number.
+        self.sys_number = int(config.get("sysnumber", sys_number or 0))
+        self._live_view_count = 0
 
-            if not self.video_capture.isOpened():
-                if not self.video_capture.open(self.sys_number):
-                    raise IOError("VideoCapture().open({}) failed.".format(self.sys_number))
-        except Exception as e:
-            self.logger.error("Capture device could not be opened {}".format(str(e)))
+        super(USBCamera, self).__init__(config, **kwargs)
+        # only opened once the camera is set up, so the device isnt left open if that fails.
+        self.grabber = FrameGrabber(self.sys_number, name=identifier)
+        self.grabber.start()
+
+    @property
+    def video_capture(self):
+        """
+        the cv2.VideoCapture owned by the frame grabber.
+        """
+        return self.grabber.video_capture
+
+    def get_frame(self) -> bytes:
+        """
+        Gets a live view frame from the frame grabber, waiting briefly for one newer than the last one served.
+
+        :return: encoded image data as bytes.
+        """
+        self._live_view_count = self.grabber.wait_for_frame(self._live_view_count)
+        with self.grabber.latest() as (frame, timestamp):
+            if frame is None:
+                return None
+            ret, data = cv2.imencode(".jpg", frame)
+        return data.tobytes() if ret else None
+
+    def stop(self):
+        """
+        releases the video device and stops the camera thread and its background workers
+        """
+        self.grabber.stop()
+        super().stop()
 
     def capture_image(self, filename=None):
         """
-        captures an image from the usb webcam.
+        captures an image from the usb webcam by copying out the latest frame from the frame grabber.
         Writes some limited exif data to the image if it can.
 
         :param filename: filename to output without excension
@@ -130,17 +234,18 @@ class USBCamera(Camera):
         """
 
         st = time.time()
-        for _ in range(50):
-            try:
-                ret, im = self.video_capture.read()
-                if ret:
-                    self._image = Image.fromarray(im)
-                    break
-                time.sleep(0.1)
-            except Exception as e:
-                self.logger.error("Error webcam capture did not read {}".format(str(e)))
-        else:
-            self.logger.error("webcam failed capture 50 times.")
+        try:
+            with self.grabber.latest() as (frame, timestamp):
+                if frame is None:
+                    self.logger.error("webcam has not produced any frames.")
+                    return None
+                # cv2 frames are bgr, this is also the copy out of the grab buffer.
+                self._image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            age = time.time() - timestamp
+            if age > 5:
+                self.logger.warning("latest webcam frame is {0:.1f}s old".format(age))
+        except Exception as e:
+            self.logger.error("Error webcam capture did not read {}".format(str(e)))
             return None
 
         if filename:
@@ -154,4 +259,3 @@ class USBCamera(Camera):
             self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
             return self._image
         return None
-
@@ -0,0 +1,62 @@
+import time
+from .Camera import Camera
+from PIL import Image
+
+
+class VirtualCamera(Camera):
+    """
+    Camera that produces synthetic frames, for load testing the capture pipeline without hardware.
+
+    Configuration keys:
+        - width, height: size of the synthetic frame
+        - latency: seconds the simulated capture takes
+    """
+
+    def __init__(self, config, **kwargs):
+        """
+        Generates the synthetic frame once, so that producing frames costs nothing but the simulated latency.
+
+        :param config: Configuration section for this camera.
+        :param kwargs:
+        """
+        super().__init__(config, **kwargs)
+        self.width = int(self.config.get("width", Camera.default_width))
+        self.height = int(self.config.get("height", Camera.default_height))
+        self.latency = float(self.config.get("latency", 0))
+        gradient = Image.linear_gradient("L").resize((self.width, self.height))
+        noise = Image.effect_noise((self.width, self.height), 48)
+        self._frame_image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+        self.exposure_bias = 0
+
+    def set_exposure_bias(self, ev: float) -> bool:
+        """
+        Simulates an exposure bias by scaling the synthetic frame, clipping it like a sensor would.
+
+        :param ev: exposure bias in stops
+        :return: True
+        :rtype: bool
+        """
+        self.exposure_bias = ev
+        return True
+
+    def capture_image(self, filename: str = None):
+        """
+        Waits for the simulated capture latency, then provides the synthetic frame.
+
+        Writes images disk using :func:`encode_write_image` like a real camera.
+
+        :param filename: image filename without extension
+        :return: image if filename not specified, otherwise list of files.
+        :rtype: PIL.Image or list(str)
+        """
+        st = time.time()
+        self.stopper.wait(self.latency)
+        self._image = self._frame_image
+        if self.exposure_bias:
+            self._image = self._image.point(lambda v: min(255, int(v * 2 ** self.exposure_bias)))
+        if filename:
+            filenames = self.encode_write_image(self._image, filename)
+            self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
+            return filenames
+        self.logger.debug("Took {0:.2f}s to capture".format(time.time() - st))
+        return self._image
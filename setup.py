@@ -21,7 +21,13 @@ setup(
     keywords=['timelapse', 'imaging'],
     entry_points={
         'console_scripts': [
-            'py-eyepi = eyepiscripts.pyeyepi:main'
+            'py-eyepi = eyepiscripts.pyeyepi:main',
+            'py-eyepi-encodebench = eyepiscripts.encodebench:main',
+            'py-eyepi-loadtest = eyepiscripts.loadtest:main',
+            'py-eyepi-extract = eyepiscripts.extract:main',
+            'py-eyepi-verify = eyepiscripts.verify:main',
+            'py-eyepi-reprocess = eyepiscripts.reprocess:main',
+            'py-eyepi-aggregator = eyepiscripts.aggregator:main'
         ]
     },
     install_requires=[
@@ -0,0 +1,33 @@
+import warnings
+import numpy
+from libeyepi.ExposureFusion import ExposureFusion, _box_valid
+
+
+def bracket(width: int, height: int = 64):
+    base = numpy.random.RandomState(0).randint(0, 256, (height, width, 3)).astype(numpy.int16)
+    # flat neutral grey has no contrast or saturation, so only the floor keeps its weights positive.
+    base[:, width // 2:] = 128
+    return [numpy.clip(base + ev, 0, 255).astype(numpy.uint8) for ev in (-60, 0, 60)]
+
+
+def test_box_filter_matches_mean():
+    a = numpy.random.RandomState(1).rand(2, 40, 30).astype(numpy.float32)
+    for radius in (1, 3, 8):
+        size = 2 * radius + 1
+        expected = numpy.stack([a[:, i:i + size].mean(axis=1) for i in range(40 - size + 1)], axis=1)
+        numpy.testing.assert_allclose(_box_valid(a, radius, 1), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_wide_frame_with_flat_region():
+    images = bracket(4000)
+    fusion = ExposureFusion()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            fused = fusion.fuse(images)
+    finally:
+        fusion.close()
+    flat = fused[:, 2000 + fusion.radius + 1:]
+    # the exposures of the flat region are 68, 128 and 188, the blend has to stay between them.
+    assert flat.min() >= 68 and flat.max() <= 188
+    assert numpy.all(flat == flat[0, 0])